@@ -10,6 +10,20 @@ const driver = neo4j.driver(
     neo4j.auth.basic('neo4j', 'password') // Replace with your Neo4j username and password
   );
 
+// Canonical model identity: uppercased, without whitespace or punctuation.
+// Every Model node is merged on it, whichever scraper path created it.
+function canonicalModelNumber(value) {
+    return String(value).toUpperCase().replace(/[^0-9A-Z]/g, '');
+}
+
+// Bump the graph data version so the backend drops caches built from the old data
+async function bumpGraphVersion(tx) {
+    await tx.run(
+        `MERGE (v:GraphMeta {name: 'dataVersion'})
+         SET v.version = coalesce(v.version, 0) + 1`
+    );
+}
+
 async function insertPartData(partData) {
     const session = driver.session();
     const tx = session.beginTransaction();
@@ -66,11 +80,12 @@ async function insertPartData(partData) {
         for (const model of partData.modelData) {
             await tx.run(
                 `MATCH (p:Part {partSelectNumber: $partSelectNumber})
-                 MERGE (m:Model {brand: $brand, modelNumber: $modelNumber})
-                 SET m.description = $description
+                 MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
+                 SET m.brand = $brand, m.modelNumber = $modelNumber, m.description = $description
                  MERGE (p)-[:COMPATIBLE_WITH]->(m)`,
                 {
                     partSelectNumber: partData.partSelectNumber,
+                    canonicalModelNumber: canonicalModelNumber(model.modelNumber),
                     brand: model.brand,
                     modelNumber: model.modelNumber,
                     description: model.description
@@ -120,6 +135,8 @@ async function insertPartData(partData) {
             );
         }
 
+        await bumpGraphVersion(tx);
+
         // Commit the transaction after all operations
         await tx.commit();
     } catch (error) {
@@ -137,8 +154,10 @@ async function insertModelSymptomData(modelDetails) {
     try {
         // Insert Model node
         await tx.run(
-            `MERGE (m:Model {modelId: $modelId})`,
+            `MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
+             SET m.modelId = $modelId`,
             {
+                canonicalModelNumber: canonicalModelNumber(modelDetails.modelId),
                 modelId: modelDetails.modelId,
             }
         );
@@ -146,11 +165,11 @@ async function insertModelSymptomData(modelDetails) {
         // Insert Symptoms and related Parts in a transaction
         for (const symptom of modelDetails.symptoms) {
             await tx.run(
-                `MATCH (m:Model {modelId: $modelId})
+                `MATCH (m:Model {canonicalModelNumber: $canonicalModelNumber})
                  MERGE (s:Symptom {name: $symptomName})
                  MERGE (m)-[:HAS_SYMPTOM]->(s)`,
                 {
-                    modelId: modelDetails.modelId,
+                    canonicalModelNumber: canonicalModelNumber(modelDetails.modelId),
                     symptomName: symptom.symptomName,
                 }
             );
@@ -176,6 +195,8 @@ async function insertModelSymptomData(modelDetails) {
             }
         }
 
+        await bumpGraphVersion(tx);
+
         // Commit the transaction after all operations
         await tx.commit();
     } catch (error) {
@@ -198,11 +219,13 @@ async function insertModelData(modelDetails) {
     
         // Insert the model node with the associated properties
         await tx.run(
-          `MERGE (m:Model {modelNum: $modelNum})
-           SET m.name = $name,
+          `MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
+           SET m.modelNum = $modelNum,
+               m.name = $name,
                m.brand = $brand,
                m.modelType = $modelType`,
           {
+            canonicalModelNumber: canonicalModelNumber(modelDetails.modelNum),
             modelNum: modelDetails.modelNum,
             name: modelDetails.name,
             brand: modelDetails.brand,
@@ -216,12 +239,12 @@ async function insertModelData(modelDetails) {
         await tx.run(
           `MERGE (s:Section {name: $sectionName})
            SET s.url = $sectionUrl
-           MERGE (m:Model {modelNum: $modelNum})
+           MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
            MERGE (m)-[:HAS_SECTION]->(s)`,
           {
             sectionName: section.name,
             sectionUrl: section.url,
-            modelNum: modelDetails.modelNum
+            canonicalModelNumber: canonicalModelNumber(modelDetails.modelNum)
           }
         );
         // console.log(`Section ${section.name} related to model ${modelDetails.modelNum}`);
@@ -232,12 +255,12 @@ async function insertModelData(modelDetails) {
         await tx.run(
           `MERGE (mn:Manual {name: $manualName})
            SET mn.url = $manualUrl
-           MERGE (m:Model {modelNum: $modelNum})
+           MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
            MERGE (m)-[:HAS_MANUAL]->(mn)`,
           {
             manualName: manual.name,
             manualUrl: manual.url,
-            modelNum: modelDetails.modelNum
+            canonicalModelNumber: canonicalModelNumber(modelDetails.modelNum)
           }
         );
         console.log(`Manual ${manual.name} related to model ${modelDetails.modelNum}`);
@@ -251,7 +274,7 @@ async function insertModelData(modelDetails) {
                p.price = $partPrice,
                p.status = $partStatus,
                p.url = $partUrl
-           MERGE (m:Model {modelNum: $modelNum})
+           MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
            MERGE (m)-[:COMPATIBLE_WITH]->(p)`,
           {
             partId: part.id,
@@ -259,12 +282,14 @@ async function insertModelData(modelDetails) {
             partPrice: part.price,
             partStatus: part.status,
             partUrl: part.url,
-            modelNum: modelDetails.modelNum
+            canonicalModelNumber: canonicalModelNumber(modelDetails.modelNum)
           }
         );
         console.log(`Part ${part.name} related to model ${modelDetails.modelNum}`);
       }
   
+      await bumpGraphVersion(tx);
+
       // Commit the transaction after all operations
       await tx.commit();
       console.log(`Model details for ${modelDetails.modelNum} successfully inserted into Neo4j.`);
@@ -302,9 +327,11 @@ async function insertModelInstructionData(instructions) {
 
             // Insert the model node with the associated properties
             await tx.run(
-                `MERGE (m:Model {modelNumber: $modelNumber})
-                 ON CREATE SET m.createdAt = timestamp()`,
+                `MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
+                 ON CREATE SET m.createdAt = timestamp()
+                 SET m.modelNumber = $modelNumber`,
                 {
+                    canonicalModelNumber: canonicalModelNumber(instruction.modelNumber),
                     modelNumber: instruction.modelNumber
                 }
             );
@@ -318,7 +345,7 @@ async function insertModelInstructionData(instructions) {
                      i.difficulty = $difficulty,
                      i.repairTime = $repairTime,
                      i.helpfulVotes = $helpfulVotes
-                 MERGE (m:Model {modelNumber: $modelNumber})
+                 MERGE (m:Model {canonicalModelNumber: $canonicalModelNumber})
                  MERGE (m)-[:HAS_INSTRUCTION]->(i)`,
                 {
                     title: instruction.title,
@@ -326,7 +353,7 @@ async function insertModelInstructionData(instructions) {
                     difficulty: instruction.difficulty || 'No difficulty info',
                     repairTime: instruction.repairTime || 'No repair time info',
                     helpfulVotes: instruction.helpfulVotes || 'No helpful votes',
-                    modelNumber: instruction.modelNumber
+                    canonicalModelNumber: canonicalModelNumber(instruction.modelNumber)
                 }
             );
 
@@ -352,6 +379,8 @@ async function insertModelInstructionData(instructions) {
             }
         }
 
+        await bumpGraphVersion(tx);
+
         // Commit the transaction after all operations
         await tx.commit();
         console.log(`Instructions and parts successfully inserted into Neo4j.`);
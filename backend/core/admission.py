@@ -0,0 +1,71 @@
+"""Admission control for the FastAPI worker: bounded concurrency, a short wait queue and fast rejection."""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException
+
+from graph_rag import metrics
+
+
+class AdmissionLimiter:
+    """Concurrency limit for one class of requests, with a bounded queue whose waiters give up after a deadline.
+
+    A request arriving when the queue is full is rejected at once with `429`; one that
+    waited in the queue past `queue_timeout` seconds is rejected with `503`. Both carry a
+    `Retry-After` estimated from the recent run time of the class.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._max_concurrent = max_concurrent
+        self._waiting = 0
+        self._mean_duration = 1.0
+
+    def retry_after(self) -> int:
+        """Seconds after which a rejected client may expect a free slot."""
+        return max(1, math.ceil(self._mean_duration * (self._waiting + 1) / self._max_concurrent))
+
+    def _reject(self, status_code: int, reason: str):
+        metrics.increment(f"admission.{self.name}.rejected.{status_code}")
+        raise HTTPException(status_code=status_code, detail=reason, headers={"Retry-After": str(self.retry_after())})
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a slot of this class for the duration of the block, or raise an HTTPException."""
+        if self._semaphore.locked():
+            if self._waiting >= self.max_queue:
+                self._reject(429, "Too many requests, please retry later")
+            self._waiting += 1
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject(503, "The service is busy, please retry later")
+            finally:
+                self._waiting -= 1
+            metrics.observe(f"admission.{self.name}.queue_wait", time.monotonic() - start)
+        else:
+            await self._semaphore.acquire()
+
+        metrics.increment(f"admission.{self.name}.admitted")
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+            # Exponentially weighted mean run time, used for Retry-After
+            self._mean_duration = 0.8 * self._mean_duration + 0.2 * (time.monotonic() - start)
+
+    def stats(self) -> dict:
+        """Function to return the free slots, queue length and mean run time of this class."""
+        return {
+            "available": self._semaphore._value,  # pylint: disable=protected-access
+            "waiting": self._waiting,
+            "mean_duration": round(self._mean_duration, 3),
+        }
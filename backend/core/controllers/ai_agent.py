@@ -1,13 +1,115 @@
 """This file is controller for the Fast API"""
 
+import logging
+import os
+import threading
+from functools import partial
+
 from langchain.memory import ConversationBufferMemory
 from graph_rag.ai_agent import MemoryParallelAgent
+from graph_rag.ai_agent import MemoryPlanExecuteAgent
 from graph_rag.ai_agent import MemorySequentialAgent
+from graph_rag.ai_agent import ParallelAgent
+from graph_rag.ai_agent import PlanExecuteAgent
+from graph_rag.ai_agent import SequentialAgent
+from graph_rag.answer_cache import AnswerCache, is_stateless
+from graph_rag.cancellation import check_cancelled
+from graph_rag.config import ANSWER_CACHE_PATH, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, graph_index, graph_version
+from graph_rag.fast_path import answer_compatibility, is_compatibility_question
+from graph_rag.singleflight import coalesce
+
+# Agent used by /agent/: "sequential" (ReAct), "speculative" (ReAct with retrieval prefetch),
+# "parallel" (ReAct over both tools) or "plan" (plan-then-execute)
+AGENT_MODES = {
+    "sequential": MemorySequentialAgent,
+    "speculative": partial(MemorySequentialAgent, speculative=True),
+    "parallel": MemoryParallelAgent,
+    "plan": MemoryPlanExecuteAgent,
+}
+
+# The same agents without memory, for stateless questions
+STATELESS_AGENT_MODES = {
+    "sequential": SequentialAgent,
+    "speculative": partial(SequentialAgent, speculative=True),
+    "parallel": ParallelAgent,
+    "plan": PlanExecuteAgent,
+}
 
+AGENT_MODE = os.environ.get("AGENT_MODE", "sequential")
+
+# One conversation is shared by every request: the turns reading or writing it run one at a time,
+# while stateless questions, which need no history, run concurrently on the agent without memory
 memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-agent_executor = MemorySequentialAgent(memory=memory) 
-# agent_executor = MemoryParallelAgent(memory=memory)
+memory_lock = threading.Lock()
+agent_executor = AGENT_MODES[AGENT_MODE](memory=memory)
+stateless_agent_executor = STATELESS_AGENT_MODES[AGENT_MODE]()
+
+logger = logging.getLogger(__name__)
+
+answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, path=ANSWER_CACHE_PATH)
+
+
+def classify_request(message: str) -> str:
+    """Guess, without blocking, how expensive a question will be: "fast_path", "cached" or "agent"."""
+    if is_compatibility_question(message) and graph_index.ready:
+        return "fast_path"
+    if is_stateless(message) and answer_cache.contains(message, AGENT_MODE):
+        return "cached"
+    return "agent"
+
+
+def with_memory(func, *args):
+    """Function to call `func(*args)` holding the conversation memory, waiting for it cancellably."""
+    while not memory_lock.acquire(timeout=0.1):
+        check_cancelled("memory_lock")
+    try:
+        return func(*args)
+    finally:
+        memory_lock.release()
+
+
+def save_turn(message: str, answer: str):
+    """Function to add a question and its answer to the conversation history."""
+    with_memory(memory.save_context, {"input": message}, {"output": answer})
 
 
 def ask_agent(message: str) -> dict:
-    return agent_executor.invoke(message)
+    # Compatibility checks between a known part and model are answered from the graph index, once it is
+    # built; the request never waits for the export, and any failure falls through to the agent
+    if is_compatibility_question(message):
+        if graph_index.ready:
+            try:
+                answer = answer_compatibility(graph_index.get(), message)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Fast path failed, using the agent", extra={"error": str(e)})
+                answer = None
+            if answer is not None:
+                save_turn(message, answer)
+                return answer
+        else:
+            graph_index.warm_up()
+
+    # Questions that refer back to the conversation always go through the agent, with the history
+    if not is_stateless(message):
+        return with_memory(agent_executor.invoke, message)
+
+    # Cached per configured mode: "sequential" and "speculative" share an agent class but not their answers
+    mode = AGENT_MODE
+    version = graph_version.current()
+    answer = answer_cache.get(message, mode, version)
+    if answer is not None:
+        # Keep the conversation history complete so follow-up questions still work
+        save_turn(message, answer)
+        return answer
+
+    answer = _run_stateless_agent(message)
+    save_turn(message, answer)
+    if answer:
+        answer_cache.put(message, mode, version, answer)
+    return answer
+
+
+# Identical stateless questions arriving together share a single agent run
+@coalesce("ask_agent", key=lambda message: " ".join(message.split()))
+def _run_stateless_agent(message: str) -> str:
+    return stateless_agent_executor.invoke(message)
@@ -0,0 +1,44 @@
+"""Run blocking request work off the event loop and cancel it when the client disconnects."""
+
+import asyncio
+import time
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from graph_rag import metrics
+from graph_rag.cancellation import CancelToken, RequestCancelled, cancel_scope
+
+
+def _run_with_token(token: CancelToken, func, *args):
+    with cancel_scope(token):
+        return func(*args)
+
+
+async def run_until_disconnect(request: Request, poll_interval: float, func, *args):
+    """Run `func(*args)` in the thread pool, cancelling it if the client goes away first.
+
+    The client is polled every `poll_interval` seconds. After a disconnect the work is
+    cancelled and awaited until it reaches its next checkpoint and stops, so the caller's
+    admission slot stays taken exactly as long as the thread is busy; then a 499 is raised,
+    which nobody reads.
+    """
+    token = CancelToken()
+    work = asyncio.ensure_future(run_in_threadpool(_run_with_token, token, func, *args))
+    while True:
+        done, _ = await asyncio.wait({work}, timeout=poll_interval)
+        if done:
+            return work.result()
+        if await request.is_disconnected():
+            break
+
+    token.cancel()
+    metrics.increment("cancellation.client_disconnected")
+    try:
+        await work
+        # The work finished before reaching a checkpoint
+        metrics.increment("cancellation.completed_anyway")
+    except RequestCancelled:
+        metrics.increment("cancellation.cancelled")
+    metrics.observe("cancellation.stop_delay", time.monotonic() - token.cancelled_at)
+    raise HTTPException(status_code=499, detail="Client closed request")
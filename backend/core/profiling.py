@@ -0,0 +1,226 @@
+"""Sampled per-request profiling of the /agent/ work, switchable at runtime.
+
+One request in `sample_rate` is profiled, in one of two modes:
+- "cprofile": a deterministic profile (cProfile) of the worker thread running the request;
+  the profiles are merged into one pstats file that snakeviz or flameprof render.
+- "sampler": a wall-clock stack sampler taking the stacks of the worker thread and of the
+  event loop every `interval` seconds; the profiles are merged into collapsed stacks
+  ("frame;frame;frame count"), the input of flamegraph.pl, speedscope and inferno.
+
+Every profile is stored with the trace ID of its request, the last `max_profiles` are kept.
+Threads started by the request (parallel tools, speculative prefetch) are not profiled.
+
+Only one cProfile runs at a time: from Python 3.12 cProfile takes the interpreter-wide
+`sys.monitoring` slot, so a second one would fail inside its request. A sampled request
+overlapping a running cProfile is profiled with the stack sampler instead. On 3.12+ a
+cProfile profile also records the other threads running meanwhile.
+"""
+
+import cProfile
+import io
+import itertools
+import marshal
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from graph_rag import metrics
+
+PROFILING_MODES = ("off", "cprofile", "sampler")
+
+
+def frame_name(frame) -> str:
+    """Function to name a frame as module.qualified_name, like the collapsed stack format expects."""
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse_stack(frame, root: str) -> str:
+    """Function to render the stack ending at `frame` root first, separated by semicolons."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join([root, *reversed(names)])
+
+
+class StackSampler:
+    """Background thread sampling the stacks of registered threads into their profiles."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._targets = {}
+        self._thread = None
+
+    def add(self, key, threads: dict, stacks: Counter):
+        """Sample `threads` ({thread id: root name}) into `stacks` until `remove(key)`."""
+        with self._lock:
+            self._targets[key] = (threads, stacks)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, key):
+        with self._lock:
+            self._targets.pop(key, None)
+
+    def _run(self):
+        while True:
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            # Samples are written under the lock, so a profile is complete once `remove` returns
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                for threads, stacks in self._targets.values():
+                    for thread_id, root in threads.items():
+                        frame = frames.get(thread_id)
+                        if frame is not None:
+                            stacks[collapse_stack(frame, root)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class RequestProfiler:
+    """Decides which requests are profiled, profiles them and keeps the results by trace ID."""
+
+    def __init__(self, mode: str = "off", sample_rate: int = 100, interval: float = 0.005, max_profiles: int = 200):
+        self._lock = threading.Lock()
+        self._cprofile = threading.Lock()
+        self._requests = itertools.count()
+        self.profiles = deque(maxlen=max_profiles)
+        self.configure(mode, sample_rate, interval)
+
+    def configure(self, mode: str, sample_rate: int = None, interval: float = None):
+        """Function to switch the profiling mode and sampling settings without restarting."""
+        if mode not in PROFILING_MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of {', '.join(PROFILING_MODES)}")
+        with self._lock:
+            self.mode = mode
+            if sample_rate is not None:
+                self.sample_rate = max(int(sample_rate), 1)
+            if interval is not None:
+                self.interval = max(float(interval), 0.001)
+                self.sampler = StackSampler(self.interval)
+
+    def sampled(self) -> bool:
+        """Function to decide whether the next request is profiled: exactly one in `sample_rate`."""
+        return self.mode != "off" and next(self._requests) % self.sample_rate == 0
+
+    def wrap(self, func, trace_id: str, path: str):
+        """Function to return `func` profiled under `trace_id` in the current mode.
+
+        Must be called on the event loop thread, whose stacks the sampler also records.
+        """
+        mode, loop_thread = self.mode, threading.get_ident()
+
+        def profiled(*args):
+            # A request overlapping a running cProfile falls back to the stack sampler
+            cprofile = mode == "cprofile" and self._cprofile.acquire(blocking=False)
+            if mode == "cprofile" and not cprofile:
+                metrics.increment("profiling.cprofile.busy")
+            profile = {
+                "trace_id": trace_id,
+                "path": path,
+                "mode": "cprofile" if cprofile else "sampler",
+                "started_at": time.time(),
+            }
+            start = time.perf_counter()
+            try:
+                if cprofile:
+                    profiler = cProfile.Profile()
+                    try:
+                        return profiler.runcall(func, *args)
+                    finally:
+                        profiler.create_stats()
+                        profile["stats"] = profiler.stats
+                        self._cprofile.release()
+                else:
+                    stacks = Counter()
+                    self.sampler.add(trace_id, {threading.get_ident(): "worker", loop_thread: "event_loop"}, stacks)
+                    try:
+                        return func(*args)
+                    finally:
+                        self.sampler.remove(trace_id)
+                        profile["stacks"] = dict(stacks)
+                        profile["interval"] = self.interval
+            finally:
+                profile["duration"] = time.perf_counter() - start
+                with self._lock:
+                    self.profiles.append(profile)
+                metrics.increment(f"profiling.{profile['mode']}.profiles")
+
+        return profiled
+
+    def find(self, trace_id: str):
+        """Function to return the stored profile of a trace ID, or None."""
+        with self._lock:
+            return next((profile for profile in self.profiles if profile["trace_id"] == trace_id), None)
+
+    def summaries(self) -> list:
+        """Function to list the stored profiles without their payloads, most recent last."""
+        with self._lock:
+            return [
+                {key: profile[key] for key in ("trace_id", "path", "mode", "started_at", "duration")}
+                | {"samples": sum(profile.get("stacks", {}).values())}
+                for profile in self.profiles
+            ]
+
+    def collapsed(self, trace_id: str = None) -> str:
+        """Function to merge the sampled stacks (of one trace or of all) into collapsed-stack text."""
+        with self._lock:
+            profiles = [p for p in self.profiles if "stacks" in p and trace_id in (None, p["trace_id"])]
+        stacks = Counter()
+        for profile in profiles:
+            stacks.update(profile["stacks"])
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def merged_stats(self, trace_id: str = None):
+        """Function to merge the deterministic profiles (of one trace or of all) into a pstats.Stats, or None."""
+        with self._lock:
+            profiles = [p for p in self.profiles if "stats" in p and trace_id in (None, p["trace_id"])]
+        if not profiles:
+            return None
+        merged = None
+        for profile in profiles:
+            # Stats.add merges into the first Stats in place, so the stored dicts are copied
+            stats = pstats.Stats(_StatsHolder(dict(profile["stats"])), stream=io.StringIO())
+            merged = stats if merged is None else merged.add(stats)
+        return merged
+
+    def status(self) -> dict:
+        return {
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "interval": self.interval,
+            "profiles": len(self.profiles),
+            "max_profiles": self.profiles.maxlen,
+        }
+
+
+class _StatsHolder:
+    """Adapter letting pstats.Stats load a raw `Profile.stats` dict."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def new_trace_id(header: str = None) -> str:
+    """Function to reuse the caller's trace ID (X-Trace-Id or W3C traceparent) or make a new one."""
+    if header:
+        parts = header.split("-")
+        # traceparent is "version-traceid-parentid-flags"
+        return parts[1] if len(parts) == 4 else header[:64]
+    return uuid.uuid4().hex
+
+
+def dump_stats(stats) -> bytes:
+    """Function to serialize merged stats in the .prof format written by `pstats.Stats.dump_stats`."""
+    return marshal.dumps(stats.stats)
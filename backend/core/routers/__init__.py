@@ -1,12 +1,46 @@
-from fastapi import APIRouter, Request, HTTPException
+import io
+import logging
+import secrets
 
-from core.controllers.ai_agent import ask_agent
+from fastapi import APIRouter, Depends, Header, Request, Response, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from core.admission import AdmissionLimiter
+from core.controllers.ai_agent import ask_agent, classify_request
+from core.disconnect import run_until_disconnect
+from core.profiling import RequestProfiler, dump_stats, new_trace_id
+from graph_rag import cascade, metrics, singleflight
+from graph_rag.config import (
+    ADMISSION_AGENT_CONCURRENCY,
+    ADMISSION_CACHED_CONCURRENCY,
+    ADMISSION_FAST_PATH_CONCURRENCY,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMIN_TOKEN,
+    DISCONNECT_POLL_INTERVAL,
+    PROFILING_INTERVAL,
+    PROFILING_MAX_PROFILES,
+    PROFILING_MODE,
+    PROFILING_SAMPLE_RATE,
+    openai_scheduler,
+)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Each class of request has its own limit, so cheap requests never queue behind full agent runs
+admission = {
+    "fast_path": AdmissionLimiter("fast_path", ADMISSION_FAST_PATH_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT),
+    "cached": AdmissionLimiter("cached", ADMISSION_CACHED_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT),
+    "agent": AdmissionLimiter("agent", ADMISSION_AGENT_CONCURRENCY, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT),
+}
+
+profiler = RequestProfiler(PROFILING_MODE, PROFILING_SAMPLE_RATE, PROFILING_INTERVAL, PROFILING_MAX_PROFILES)
+
 
 @router.get("/agent/")
-async def get_ai_message(message: str, request: Request):
+async def get_ai_message(message: str, request: Request, http_response: Response):
     """
     Handle incoming requests from the frontend, pass the message to the AI agent,
     and return the AI's response with session memory.
@@ -15,15 +49,90 @@ async def get_ai_message(message: str, request: Request):
     try:
         _ = request.session.get("memory_key", "")  # You can track user sessions here for specific memory
 
-        # Ask the agent the question
-        response = ask_agent(message)
+        # Every answer carries a trace ID; sampled requests store their profile under it
+        trace_id = new_trace_id(request.headers.get("x-trace-id") or request.headers.get("traceparent"))
+        http_response.headers["X-Trace-Id"] = trace_id
+        work = profiler.wrap(ask_agent, trace_id, request.url.path) if profiler.sampled() else ask_agent
+
+        # Ask the agent the question off the event loop so concurrent requests can overlap,
+        # within the admission limit of the kind of request (429/503 with Retry-After when full).
+        # The LLM and Neo4j work stops early if the user closes the chat before the answer is ready.
+        async with admission[classify_request(message)].admit():
+            response = await run_until_disconnect(request, DISCONNECT_POLL_INTERVAL, work, message)
         return {"response": response}
-    
+
+    except HTTPException:
+        raise
     except Exception as e:
         # Log the error and return an HTTP 500 error
-        print(f"Error processing the stupid request: {e}")
+        logger.error("Error processing the request", extra={"error": str(e)}, exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+@router.get("/metrics/")
+async def get_metrics():
+    """Return pipeline metrics, request coalescing statistics, model escalation rates, the OpenAI queue and admission state."""
+    return {
+        **metrics.snapshot(),
+        "singleflight": singleflight.stats(),
+        "escalation_rates": cascade.escalation_rates(),
+        "openai_scheduler": openai_scheduler.stats(),
+        "admission": {name: limiter.stats() for name, limiter in admission.items()},
+    }
+
+
+def require_admin(x_admin_token: str = Header(default=None)):
+    """Let a request through only with the admin token; without ADMIN_TOKEN every admin endpoint is forbidden."""
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+admin_router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@admin_router.get("/profiling/")
+async def get_profiling():
+    """Return the profiling mode, sample rate and number of stored profiles."""
+    return profiler.status()
+
+
+@admin_router.put("/profiling/")
+async def set_profiling(mode: str, sample_rate: int = None, interval: float = None):
+    """Switch profiling to "off", "cprofile" or "sampler", profiling one request in `sample_rate`."""
+    try:
+        profiler.configure(mode, sample_rate, interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return profiler.status()
+
+
+@admin_router.get("/profiling/profiles/")
+async def get_profiles():
+    """List the stored profiles with their trace IDs and durations."""
+    return profiler.summaries()
+
+
+@admin_router.get("/profiling/flamegraph/", response_class=PlainTextResponse)
+async def get_flamegraph(trace_id: str = None):
+    """Return the sampled stacks of one trace or of all stored profiles, as collapsed stacks for flamegraph.pl or speedscope."""
+    return profiler.collapsed(trace_id)
+
+
+@admin_router.get("/profiling/pstats/")
+async def get_pstats(trace_id: str = None, format: str = "text", limit: int = 50):  # pylint: disable=redefined-builtin
+    """Return the merged deterministic profiles as the top functions by cumulative time, or as a .prof file."""
+    stats = profiler.merged_stats(trace_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No cProfile profiles stored")
+    if format == "prof":
+        return Response(
+            content=dump_stats(stats),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": 'attachment; filename="agent.prof"'},
+        )
+    stats.stream = io.StringIO()
+    stats.sort_stats("cumulative").print_stats(limit)
+    return PlainTextResponse(stats.stream.getvalue())
+
 
-   
\ No newline at end of file
+router.include_router(admin_router)
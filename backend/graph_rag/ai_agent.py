@@ -1,30 +1,139 @@
 import argparse
 import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from typing import Union
 import re
 import sys
 sys.path.append('/Users/kohsheentiku/Desktop/Open-source/case-study/backend')
 
-from langchain.agents import Tool, AgentExecutor, AgentOutputParser, create_react_agent
+from langchain.agents import Tool, AgentExecutor, AgentOutputParser
 from langchain.prompts import StringPromptTemplate
 from langchain.schema import AgentAction, AgentFinish
 from langchain.memory import ConversationBufferMemory
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnableParallel
-
-from graph_rag.config import GRAPH_ENTITIES
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
+from langchain_core.tools import render_text_description
+from tqdm import tqdm
+
+from graph_rag.batch import run_batch_file
+from graph_rag.cancellation import check_cancelled, submit_in_context
+from graph_rag.cascade import cascade_models, run_cascade
+from graph_rag.config import (
+    CASCADE_SMALL_MODEL,
+    ENTITY_RELATIONSHIP_MAP,
+    EXPANSION_DEPTH,
+    EXPANSION_FANOUT,
+    EXPANSION_FANOUT_BY_TYPE,
+    EXPANSION_MAX_NODES,
+    EXPANSION_MAX_START,
+    GRAPH_ENTITIES,
+    RESULT_FIELD_MAX_LENGTH,
+    SPECULATION_WORKERS,
+    SPECULATIVE_PREFETCH,
+    embedding_provider,
+    graph_index,
+    neo4j_graph,
+    openai_http_client,
+)
+from graph_rag.graph_expansion import GraphExpander
 from graph_rag.graph_query import query_db
-from graph_rag.prompts import MEMORY_PARALLEL_PROMPT_TEMPLATE, MEMORY_SEQUENTIAL_PROMPT_TEMPLATE, PARALLEL_PROMPT_TEMPLATE, SEQUENTIAL_PROMPT_TEMPLATE
+from graph_rag.part_digests import attach_digests
+from graph_rag.prompts import (
+    MEMORY_PARALLEL_PROMPT_TEMPLATE,
+    MEMORY_SEQUENTIAL_PROMPT_TEMPLATE,
+    PARALLEL_PROMPT_TEMPLATE,
+    PLAN_PROMPT_TEMPLATE,
+    SEQUENTIAL_PROMPT_TEMPLATE,
+    SYNTHESIS_PROMPT_TEMPLATE,
+)
+from graph_rag.scratchpad import format_scratchpad
 from graph_rag.semantic_query import similarity_search
+from graph_rag.serializers import serialize_matches
+from graph_rag.speculation import prefetchable, speculate
+
+logger = logging.getLogger(__name__)
+
+graph_expander = GraphExpander(
+    neo4j_graph,
+    ENTITY_RELATIONSHIP_MAP,
+    depth=EXPANSION_DEPTH,
+    fanout=EXPANSION_FANOUT,
+    fanout_by_type=EXPANSION_FANOUT_BY_TYPE,
+    max_start=EXPANSION_MAX_START,
+    max_nodes=EXPANSION_MAX_NODES,
+)
+
+
+def query_tool(query: str) -> str:
+    """Run the Query tool and serialize its results compactly for the prompt."""
+    return serialize_matches(attach_digests(neo4j_graph, query_db(query)), max_length=RESULT_FIELD_MAX_LENGTH)
+
+
+def similarity_search_tool(prompt: str) -> str:
+    """Run the Similarity Search tool and serialize its results compactly for the prompt."""
+    return serialize_matches(attach_digests(neo4j_graph, similarity_search(prompt)), max_length=RESULT_FIELD_MAX_LENGTH)
+
+
+def graph_lookup_tool(text: str) -> str:
+    """Answer compatibility and symptom-to-part questions from the in-process graph index."""
+    try:
+        results = graph_index.get().lookup(text)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        results = [{"error": f"The graph index is not available, use the other tools: {e}"}]
+    return serialize_matches(results, max_length=RESULT_FIELD_MAX_LENGTH)
+
+
+def neighborhood_tool(text: str) -> str:
+    """Expand the part and model numbers in the input to their neighborhood, in one graph query."""
+    try:
+        results = attach_digests(neo4j_graph, graph_expander.expand(text))
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.warning("Neighborhood expansion failed", extra={"error": str(e)})
+        results = [{"error": f"The neighborhood could not be expanded, use the other tools: {e}"}]
+    return serialize_matches(results, max_length=RESULT_FIELD_MAX_LENGTH)
 
 
 # Define the tools available to the agent
 TOOLS = [
-    Tool(name="Query", func=query_db, description="Use this tool to find entities in the user prompt that can be used to generate queries"),
-    Tool(name="Similarity Search", func=similarity_search, description="Use this tool to perform a similarity search in the database"),
+    Tool(
+        name="Graph Lookup",
+        func=graph_lookup_tool,
+        description=(
+            "Use this tool first to check if a part is compatible with a model, to list parts compatible with a model "
+            "or models compatible with a part, and to find parts that fix a symptom on a model. "
+            "The input must contain the part and/or model numbers and, for symptoms, the symptom itself"
+        ),
+    ),
+    Tool(
+        name="Query",
+        func=prefetchable("Query", query_tool),
+        description="Use this tool to find entities in the user prompt that can be used to generate queries",
+    ),
+    Tool(
+        name="Similarity Search",
+        func=prefetchable("Similarity Search", similarity_search_tool),
+        description="Use this tool to perform a similarity search in the database",
+    ),
+    Tool(
+        name="Neighborhood",
+        func=neighborhood_tool,
+        description=(
+            "Use this tool to get, in one step, everything connected to parts or models you already know: a part's "
+            "reviews, repair stories, questions and answers and compatible models, a model's symptoms and the parts "
+            "that fix them, its sections, manuals and instructions. "
+            "The input must contain the part numbers (e.g. PS11752778) and/or model numbers"
+        ),
+    ),
 ]
 
+# Tools the speculative agents start on the raw question before the LLM has picked one
+SPECULATIVE_TOOLS = {"Query": query_tool, "Similarity Search": similarity_search_tool}
+speculation_executor = ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="speculation")
+
 # A helper class for output parsing
 class CustomOutputParser(AgentOutputParser):
     """Custom output parser for the agent."""
@@ -39,17 +148,14 @@ class CustomOutputParser(AgentOutputParser):
                 log=llm_output,
             )
 
-        print("beforematch")
         # Parse out the action and action input using regex
         match = re.search(r"Action: (.*?)[\n]*Action Input:[\s]*(.*)", llm_output, re.DOTALL)
         if not match:
             raise ValueError(f"Could not parse LLM output: `{llm_output}`")
-        print("aftermatch")
 
         action = match.group(1).strip()
-        print("actionhere:",action)
         action_input = match.group(2).strip().strip('"')
-        print("actioninputhere:",action_input)
+        logger.debug("Agent action", extra={"tool": action, "tool_input": action_input})
 
         # Return the action and its input
         return AgentAction(tool=action, tool_input=action_input, log=llm_output)
@@ -64,13 +170,9 @@ class CustomPromptTemplate(StringPromptTemplate):
     def format(self, **kwargs) -> str:
         # Get the intermediate steps (AgentAction, Observation tuples)
         intermediate_steps = kwargs.pop("intermediate_steps")
-        thoughts = ""
-        for action, observation in intermediate_steps:
-            thoughts += action.log
-            thoughts += f"\nObservation: {observation}\nThought: "
 
-        # Set the agent_scratchpad variable to that value
-        kwargs["agent_scratchpad"] = thoughts
+        # Set the agent_scratchpad variable to the budgeted scratchpad
+        kwargs["agent_scratchpad"] = format_scratchpad(intermediate_steps)
 
         # Create a tools variable from the list of tools provided
         kwargs["tools"] = "\n".join([f"{tool.name}: {tool.description}" for tool in TOOLS])
@@ -95,8 +197,8 @@ class CombinedQueryTool(Tool):
         results = parallel_chain.invoke(input)
 
         # Combine the results
-        combined_results = results["query_result"] + results["similarity_result"]
-        return combined_results
+        combined_results = attach_digests(neo4j_graph, results["query_result"] + results["similarity_result"])
+        return serialize_matches(combined_results, max_length=RESULT_FIELD_MAX_LENGTH)
 
     async def _arun(self, input):
         raise NotImplementedError("CombinedQueryTool does not support async")
@@ -106,30 +208,60 @@ class CombinedQueryTool(Tool):
 class Agent:
     """Base Agent class to handle the agent execution."""
 
-    def __init__(self, tools, prompt_template):
+    def __init__(self, tools, prompt_template, speculative: bool = False):
         self.tools = tools
         self.prompt_template = prompt_template
+        self.speculative = speculative
         self.agent_executor = self._init_agent_executor()
 
     def _init_agent_executor(self) -> AgentExecutor:
         prompt = PromptTemplate(template=self.prompt_template)
-        llm = ChatOpenAI(temperature=0, model="gpt-4")
+        llms = {
+            model: ChatOpenAI(temperature=0, model=model, http_client=openai_http_client).bind(stop=["\nObservation:"])
+            for model in cascade_models(CASCADE_SMALL_MODEL, "gpt-4")
+        }
         output_parser = CustomOutputParser()
 
-        agent = create_react_agent(
-            llm=llm,
-            tools=self.tools,
-            prompt=prompt,
-            output_parser=output_parser,
-            stop_sequence=["\nObservation:"],
+        def parses(llm_output: str) -> bool:
+            try:
+                output_parser.parse(llm_output)
+                return True
+            except ValueError:
+                return False
+
+        def next_step(prompt_value):
+            # A run whose client went away stops before spending another LLM call
+            check_cancelled("agent_step")
+            # The cheaper model's step is used whenever it parses as an Action or an Answer
+            llm_output = run_cascade("agent", list(llms), lambda model: llms[model].invoke(prompt_value).content, parses)
+            return output_parser.parse(llm_output)
+
+        # Same chain as `create_react_agent`, with a token-budgeted scratchpad instead of `format_log_to_str`
+        prompt = prompt.partial(
+            tools=render_text_description(list(self.tools)),
+            tool_names=", ".join([tool.name for tool in self.tools]),
+        )
+        agent = (
+            RunnablePassthrough.assign(agent_scratchpad=lambda x: format_scratchpad(x["intermediate_steps"]))
+            | prompt
+            | RunnableLambda(next_step)
         )
 
-        agent_executor = AgentExecutor.from_agent_and_tools(agent=agent, tools=self.tools, verbose=True)
+        # LangChain's verbose trace writes to stdout synchronously, so it is only on when debugging
+        agent_executor = AgentExecutor.from_agent_and_tools(
+            agent=agent, tools=self.tools, verbose=logger.isEnabledFor(logging.DEBUG)
+        )
         return agent_executor
 
+    def _execute(self, inputs: dict) -> dict:
+        """Run the agent executor, prefetching the retrieval tools on the raw input in speculative mode."""
+        prefetch = speculate(SPECULATIVE_TOOLS, inputs["input"], speculation_executor) if self.speculative else nullcontext()
+        with prefetch:
+            return self.agent_executor.invoke(inputs)
+
     def invoke(self, user_input: str) -> str:
         """Invoke the agent with the user input."""
-        result = self.agent_executor.invoke({"input": user_input})
+        result = self._execute({"input": user_input})
         return result["output"]
 
 
@@ -137,16 +269,16 @@ class Agent:
 class SequentialAgent(Agent):
     """Sequential agent without memory."""
 
-    def __init__(self):
-        super().__init__(tools=TOOLS, prompt_template=SEQUENTIAL_PROMPT_TEMPLATE)
+    def __init__(self, speculative: bool = SPECULATIVE_PREFETCH):
+        super().__init__(tools=TOOLS, prompt_template=SEQUENTIAL_PROMPT_TEMPLATE, speculative=speculative)
 
 
 # Sequential agent with memory
 class MemorySequentialAgent(Agent):
     """Sequential agent with memory."""
 
-    def __init__(self, memory=None):
-        super().__init__(tools=TOOLS, prompt_template=MEMORY_SEQUENTIAL_PROMPT_TEMPLATE)
+    def __init__(self, memory=None, speculative: bool = SPECULATIVE_PREFETCH):
+        super().__init__(tools=TOOLS, prompt_template=MEMORY_SEQUENTIAL_PROMPT_TEMPLATE, speculative=speculative)
         self.memory = memory
 
     def invoke(self, user_input: str) -> str:
@@ -154,10 +286,10 @@ class MemorySequentialAgent(Agent):
         if self.memory:
             self.memory.save_context({"input": user_input}, {"output": ""})
             chat_history = self.memory.load_memory_variables({})["chat_history"]
-            result = self.agent_executor.invoke({"input": user_input, "chat_history": chat_history})
+            result = self._execute({"input": user_input, "chat_history": chat_history})
             self.memory.save_context({"input": user_input}, {"output": result["output"]})
         else:
-            result = self.agent_executor.invoke({"input": user_input})
+            result = self._execute({"input": user_input})
         return result["output"]
 
 
@@ -182,31 +314,148 @@ class MemoryParallelAgent(Agent):
         if self.memory:
             self.memory.save_context({"input": user_input}, {"output": ""})
             chat_history = self.memory.load_memory_variables({})["chat_history"]
-            result = self.agent_executor.invoke({"input": user_input, "chat_history": chat_history})
+            result = self._execute({"input": user_input, "chat_history": chat_history})
             self.memory.save_context({"input": user_input}, {"output": result["output"]})
         else:
-            result = self.agent_executor.invoke({"input": user_input})
+            result = self._execute({"input": user_input})
         return result["output"]
 
 
+# Plan-then-execute agent: one planning call, concurrent tools, one synthesis call
+class PlanExecuteAgent:
+    """Agent that plans its retrieval in one LLM call and answers in a second one.
+
+    Unlike the ReAct agents, tool results never go back to the planner, so every
+    question costs exactly two LLM calls however many tools it needs.
+    """
+
+    max_steps = 4
+
+    def __init__(self, tools=None, memory: ConversationBufferMemory = None):
+        self.tools = {tool.name: tool for tool in (tools or TOOLS)}
+        self.memory = memory
+        self.planner_llm = ChatOpenAI(temperature=0, model="gpt-4o", http_client=openai_http_client)
+        self.synthesis_llm = ChatOpenAI(temperature=0, model="gpt-4", http_client=openai_http_client)
+
+    def plan(self, user_input: str, chat_history: str = "") -> list:
+        """Ask the LLM which tools to run and with what input, as a list of (tool name, input) pairs."""
+        prompt = PLAN_PROMPT_TEMPLATE.format(
+            tools="\n".join(f"{tool.name}: {tool.description}" for tool in self.tools.values()),
+            tool_names=", ".join(self.tools),
+            chat_history=chat_history,
+            max_steps=self.max_steps,
+            input=user_input,
+        )
+        response = self.planner_llm.invoke(prompt).content
+        try:
+            steps = json.loads(re.sub(r"```(?:json)?", "", response).strip())["steps"]
+            plan = [(step["tool"], str(step["input"])) for step in steps if step.get("tool") in self.tools]
+        except (json.JSONDecodeError, KeyError, TypeError, AttributeError) as e:
+            # Fall back to running every tool on the question itself
+            logger.info("Could not parse the plan, running all tools", extra={"error": str(e)})
+            plan = [(name, user_input) for name in self.tools]
+        return plan[:self.max_steps]
+
+    def execute(self, plan: list) -> list:
+        """Run the planned tool calls concurrently and return (tool name, input, result) triples."""
+        if not plan:
+            return []
+
+        def run_step(step):
+            name, tool_input = step
+            try:
+                return name, tool_input, self.tools[name].invoke(tool_input)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                return name, tool_input, [{"error": str(e)}]
+
+        with ThreadPoolExecutor(max_workers=len(plan)) as executor:
+            futures = [submit_in_context(executor, run_step, step) for step in plan]
+            return [future.result() for future in futures]
+
+    def synthesize(self, user_input: str, observations: list, chat_history: str = "") -> str:
+        """Write the final answer from the tool results in a single LLM call."""
+        prompt = SYNTHESIS_PROMPT_TEMPLATE.format(
+            chat_history=chat_history,
+            observations="\n\n".join(
+                f"{name} ({tool_input}):\n{result}" for name, tool_input, result in observations
+            ) or "No tools were run.",
+            input=user_input,
+        )
+        response = self.synthesis_llm.invoke(prompt).content
+        return response.split("Answer:")[-1].strip() if "Answer:" in response else response.strip()
+
+    def invoke(self, user_input: str) -> str:
+        """Invoke the agent with the user input."""
+        chat_history = ""
+        if self.memory:
+            chat_history = self.memory.load_memory_variables({})["chat_history"]
+        observations = self.execute(self.plan(user_input, chat_history))
+        check_cancelled("agent_step")
+        output = self.synthesize(user_input, observations, chat_history)
+        if self.memory:
+            self.memory.save_context({"input": user_input}, {"output": output})
+        return output
+
+
+# Plan-then-execute agent with memory
+class MemoryPlanExecuteAgent(PlanExecuteAgent):
+    """Plan-then-execute agent with memory."""
+
+    def __init__(self, memory: ConversationBufferMemory = None):
+        super().__init__(tools=TOOLS, memory=memory)
+
+
 # Main entry point for the script
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Embed entities in the Neo4j graph")
     parser.add_argument("--message", type=str, help="The message to send to the agent")
     parser.add_argument("--parallel", action="store_true", help="Whether to run the agent in parallel mode")
+    parser.add_argument("--plan", action="store_true", help="Whether to run the agent in plan-then-execute mode")
     parser.add_argument("--memory", action="store_true", help="Whether to include memory")
+    parser.add_argument("--speculative", action="store_true", help="Whether to prefetch retrieval in sequential mode")
+    parser.add_argument("--batch", type=str, help="JSONL file of questions to answer instead of --message")
+    parser.add_argument("--output", type=str, help="JSONL file the batch results are appended to (and resumed from)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Questions of a batch answered at the same time")
+    parser.add_argument("--retry-errors", action="store_true", help="Run the questions that failed in an earlier batch again")
+    parser.add_argument("--question-timeout", type=float, default=300, help="Seconds after which a batch question is given up")
     args = parser.parse_args()
 
+    if args.batch:
+        # Batch questions are independent of each other, so they run without memory
+        if args.plan:
+            batch_agent = PlanExecuteAgent()
+        elif args.parallel:
+            batch_agent = ParallelAgent()
+        else:
+            batch_agent = SequentialAgent(args.speculative or SPECULATIVE_PREFETCH)
+        output_path = args.output or os.path.splitext(args.batch)[0] + ".results.jsonl"
+        with tqdm(desc="Answering questions", unit="question") as progress_bar:
+            summary = run_batch_file(
+                batch_agent,
+                args.batch,
+                output_path,
+                embedding_provider,
+                concurrency=args.concurrency,
+                retry_errors=args.retry_errors,
+                timeout=args.question_timeout,
+                progress=lambda result: progress_bar.update(),
+            )
+        print(json.dumps(summary, indent=2))
+        sys.exit(1 if summary["failed"] else 0)
+
     # Initialize memory if requested
     if args.memory:
         test_memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
         test_memory.save_context({"input": "Hello, my name is John Doe"}, {"output": "Hello, John Doe"})
 
-    # Choose agent type (parallel or sequential, with or without memory)
-    if args.parallel:
+    # Choose agent type (plan-then-execute, parallel or sequential, with or without memory)
+    if args.plan:
+        agent_exe = MemoryPlanExecuteAgent(memory=test_memory) if args.memory else PlanExecuteAgent()
+    elif args.parallel:
         agent_exe = MemoryParallelAgent(memory=test_memory) if args.memory else ParallelAgent()
     else:
-        agent_exe = MemorySequentialAgent(memory=test_memory) if args.memory else SequentialAgent()
+        speculative = args.speculative or SPECULATIVE_PREFETCH
+        agent_exe = MemorySequentialAgent(memory=test_memory, speculative=speculative) if args.memory else SequentialAgent(speculative)
 
-    print(f"Using {'parallel' if args.parallel else 'sequential'} agent mode")
+    print(f"Using {'plan-then-execute' if args.plan else 'parallel' if args.parallel else 'sequential'} agent mode")
     print(f"\n\n--->Result: \n{agent_exe.invoke(args.message)}\n\n")
@@ -0,0 +1,118 @@
+"""Cache of final agent answers for stateless questions, invalidated by the graph data version."""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from graph_rag import metrics
+
+# Words that point back into the conversation ("is it compatible?", "what about that one?"). A question
+# containing one is never cached, even when it also names a part or model number: "is this part compatible
+# with WDT780SAEM1?" depends on which part the conversation was about
+CONTEXT_REFERENCE = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|one|same|above|previous|earlier|again|also|instead)\b"
+)
+
+
+def normalize_question(question: str) -> str:
+    """Function to normalize a question so trivially different spellings share a cache entry."""
+    question = " ".join(question.lower().split())
+    return question.rstrip("?!. ")
+
+
+def is_stateless(question: str) -> bool:
+    """Function to decide whether a question can be answered without the conversation history."""
+    normalized = normalize_question(question)
+    if not normalized:
+        return False
+    return not CONTEXT_REFERENCE.search(normalized)
+
+
+class AnswerCache:
+    """Bounded LRU of answers with a TTL, optionally backed by a SQLite file.
+
+    Every entry remembers the graph data version it was computed against and is
+    ignored once the graph has moved on to another version.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers "
+                "(question TEXT, mode TEXT, version INTEGER, expires_at REAL, answer TEXT, "
+                "PRIMARY KEY (question, mode))"
+            )
+            self._db.commit()
+
+    def get(self, question: str, mode: str, version: int):
+        """Return the cached answer, or None when it is missing, expired or from an older graph version."""
+        key = (normalize_question(question), mode)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT version, expires_at, answer FROM answers WHERE question = ? AND mode = ?", key
+                ).fetchone()
+                if row is not None:
+                    entry = self._remember(key, row)
+
+            if entry is None:
+                metrics.increment("answer_cache.miss")
+                return None
+            entry_version, expires_at, answer = entry
+            if entry_version != version or expires_at <= now:
+                self._forget(key)
+                metrics.increment("answer_cache.stale")
+                return None
+
+            self._entries.move_to_end(key)
+            metrics.increment("answer_cache.hit")
+            return answer
+
+    def contains(self, question: str, mode: str) -> bool:
+        """Whether the in-memory tier holds an unexpired answer, without touching SQLite, metrics or the LRU order."""
+        entry = self._entries.get((normalize_question(question), mode))
+        return entry is not None and entry[1] > time.time()
+
+    def put(self, question: str, mode: str, version: int, answer: str):
+        """Store the answer computed against the given graph data version."""
+        key = (normalize_question(question), mode)
+        entry = (version, time.time() + self.ttl, answer)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers WHERE version != ?", (version,))
+                self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)", (*key, *entry))
+                self._db.commit()
+
+    def clear(self):
+        """Drop every cached answer."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
+                self._db.commit()
+
+    def _remember(self, key, entry):
+        """Insert an entry into the in-memory tier; the caller must hold the lock."""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def _forget(self, key):
+        """Remove an entry from both tiers; the caller must hold the lock."""
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM answers WHERE question = ? AND mode = ?", key)
+            self._db.commit()
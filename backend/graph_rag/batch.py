@@ -0,0 +1,180 @@
+"""Batch runs of the agent over a JSONL file of questions, for evaluations and pre-generated answers.
+
+Every input line is a JSON object with a `question` (or `message`) and an optional `id`
+(the line number otherwise); any other fields are copied to the result. Questions run
+`concurrency` at a time with the "batch" OpenAI priority, so interactive requests sharing
+the API key go first, and the embeddings of concurrent questions are requested together
+through one EmbeddingBatcher. Each result is appended to the output file as soon as its
+question finishes:
+
+    {"id": "q1", "question": "...", "answer": "...", "status": "ok", "duration": 4.21}
+
+The output file doubles as the checkpoint: a rerun with the same output skips the
+questions it already holds (failed ones too, unless `retry_errors` is set), so a crashed
+run resumes where it stopped.
+
+Every question runs under its own cancellation token, cancelled after `timeout` seconds, so
+a question stuck on an outage (similarity queries retry Neo4j errors until cancelled) is
+recorded with the "timeout" status instead of holding its slot forever.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from graph_rag import metrics
+from graph_rag.cancellation import CancelToken, RequestCancelled, cancel_scope, submit_in_context
+from graph_rag.embeddings import EmbeddingBatcher
+from graph_rag.openai_scheduler import priority
+from graph_rag.semantic_query import embedding_scope
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path: str) -> list:
+    """Function to read the questions of a JSONL file, skipping blank and malformed lines."""
+    items = []
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning("Skipping malformed question line", extra={"line": line_number, "error": str(e)})
+                continue
+            if isinstance(item, str):
+                item = {"question": item}
+            question = item.pop("question", None) or item.pop("message", None)
+            if not question:
+                logger.warning("Skipping a line without a question", extra={"line": line_number})
+                continue
+            items.append({**item, "id": str(item.get("id", line_number)), "question": question})
+    return items
+
+
+def finished_ids(path: str, retry_errors: bool = False) -> set:
+    """Function to read the IDs of the questions an earlier run already wrote to the output file.
+
+    A line cut short by a crash is ignored, so its question runs again.
+    """
+    ids = set()
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not (retry_errors and result.get("status") != "ok"):
+                    ids.add(str(result.get("id")))
+    except FileNotFoundError:
+        pass
+    return ids
+
+
+def ends_with_newline(path: str) -> bool:
+    """Function to check whether a non-empty file ends with a complete line."""
+    with open(path, "rb") as file:
+        file.seek(-1, 2)
+        return file.read(1) == b"\n"
+
+
+def answer_question(agent, item: dict, timeout: float = None) -> dict:
+    """Function to run the agent on one question, cancelled after `timeout` seconds, and return its result line."""
+    started_at = time.time()
+    start = time.perf_counter()
+    token = CancelToken()
+    timer = threading.Timer(timeout, token.cancel) if timeout else None
+    if timer is not None:
+        timer.daemon = True
+        timer.start()
+    try:
+        with cancel_scope(token):
+            result = {"answer": agent.invoke(item["question"]), "status": "ok"}
+        metrics.increment("batch.answered")
+    except RequestCancelled:
+        logger.warning("Batch question timed out", extra={"id": item["id"], "timeout": timeout})
+        result = {"answer": None, "status": "timeout", "error": f"No answer within {timeout} seconds"}
+        metrics.increment("batch.timed_out")
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.warning("Batch question failed", extra={"id": item["id"], "error": str(e)})
+        result = {"answer": None, "status": "error", "error": str(e)}
+        metrics.increment("batch.failed")
+    finally:
+        if timer is not None:
+            timer.cancel()
+    duration = time.perf_counter() - start
+    metrics.observe("batch.question", duration)
+    return {**item, **result, "started_at": started_at, "duration": round(duration, 3)}
+
+
+def run_batch(agent, items, embedder, concurrency: int = 16, timeout: float = None):
+    """Generator running the agent on every item, `concurrency` at a time, yielding results as they finish.
+
+    Items are submitted only as slots free up, so the input is never queued up in full.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        with priority("batch"), embedding_scope(embedder):
+            # The pool's threads run in a copy of this context, with the batch priority and the shared embedder
+            running = {submit_in_context(executor, answer_question, agent, item, timeout) for _, item in zip(range(concurrency), items)}
+            while running:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    next_item = next(items, None)
+                    if next_item is not None:
+                        running.add(submit_in_context(executor, answer_question, agent, next_item, timeout))
+                    yield future.result()
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Function to return the value below which `fraction` of the values fall (nearest rank)."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def run_batch_file(agent, input_path: str, output_path: str, embedding_provider, concurrency: int = 16,
+                   retry_errors: bool = False, progress=None, timeout: float = 300) -> dict:
+    """Function to answer the questions of `input_path` not yet in `output_path`, appending each result as it finishes.
+
+    Returns a summary of the run: counts, wall time and answer time percentiles.
+    """
+    items = read_questions(input_path)
+    done = finished_ids(output_path, retry_errors)
+    pending = [item for item in items if item["id"] not in done]
+    logger.info("Starting batch run", extra={"questions": len(items), "already_done": len(items) - len(pending)})
+
+    embedder = EmbeddingBatcher(embedding_provider)
+    durations, failed = [], 0
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as output:
+        if output.tell() and not ends_with_newline(output_path):
+            # End the line a crash cut short, so the first new result starts on a line of its own
+            output.write("\n")
+        for result in run_batch(agent, pending, embedder, concurrency, timeout):
+            # One complete line per result, flushed at once, so a crash loses at most the questions in flight
+            output.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            output.flush()
+            durations.append(result["duration"])
+            failed += result["status"] != "ok"
+            if progress is not None:
+                progress(result)
+
+    summary = {
+        "questions": len(items),
+        "skipped": len(items) - len(pending),
+        "answered": len(pending) - failed,
+        "failed": failed,
+        "wall_time": round(time.perf_counter() - start, 3),
+        "p50": percentile(durations, 0.5),
+        "p95": percentile(durations, 0.95),
+        "embedding_requests": embedder.requests,
+        "embedding_batches": embedder.batches,
+    }
+    logger.info("Batch run finished", extra=summary)
+    return summary
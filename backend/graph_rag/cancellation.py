@@ -0,0 +1,82 @@
+"""Cooperative cancellation of a request's work once its client has gone away.
+
+The work of a request runs inside `cancel_scope(token)`. The agent, the OpenAI transport
+and the Neo4j streaming code call `check_cancelled` between steps, between scheduler waits
+and between streamed chunks or records, so a cancelled run stops at the next checkpoint
+and frees its connection, scheduler slot and server-side cursor. The token lives in a
+context variable, so it follows the work into threads started with `submit_in_context`
+and into LangChain's own thread pools, which copy the context.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from graph_rag import metrics
+
+
+class RequestCancelled(BaseException):
+    """Raised inside the work of a request whose client disconnected.
+
+    Like `asyncio.CancelledError` it derives from BaseException, so the many
+    `except Exception` retry and fallback blocks of the pipeline do not swallow it.
+    """
+
+
+class CancelToken:
+    """Flag shared between a request handler and the threads doing the request's work.
+
+    A token with a `parent` is also cancelled when its parent is, so one piece of a request's
+    work (e.g. a losing query of a race) can be stopped on its own.
+    """
+
+    def __init__(self, parent: "CancelToken" = None):
+        self._event = threading.Event()
+        self.parent = parent
+        self.cancelled_at = None
+
+    def cancel(self):
+        if not self._event.is_set():
+            self.cancelled_at = time.monotonic()
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+
+_token = contextvars.ContextVar("cancel_token", default=None)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """Make `token` the cancellation token of the work done in this context inside the block."""
+    reset = _token.set(token)
+    try:
+        yield token
+    finally:
+        _token.reset(reset)
+
+
+def current_token():
+    """Function to return the cancellation token of the current work, or None."""
+    return _token.get()
+
+
+def is_cancelled() -> bool:
+    """Function to check whether the current request has been cancelled, without raising."""
+    token = _token.get()
+    return token is not None and token.cancelled
+
+
+def check_cancelled(where: str):
+    """Function to stop the current work with `RequestCancelled` if its request has been cancelled."""
+    if is_cancelled():
+        metrics.increment(f"cancellation.stopped.{where}")
+        raise RequestCancelled(f"Request cancelled, stopped at {where}")
+
+
+def submit_in_context(executor, func, *args):
+    """Function to submit `func` to a thread pool so it runs under the caller's cancellation token."""
+    return executor.submit(contextvars.copy_context().run, func, *args)
@@ -0,0 +1,146 @@
+"""Merge duplicate Model nodes into one node per canonical model number.
+
+Depending on the scraper path, a model was stored under `modelNum`, `modelNumber` or
+`modelId`. This pass gives every Model a `canonicalModelNumber` (uppercased, without
+whitespace or punctuation), merges the nodes sharing one into a single node and adds a
+uniqueness constraint, so every model lookup is a single index seek.
+"""
+
+import os
+import argparse
+import logging
+from collections import defaultdict
+
+from langchain_community.graphs import Neo4jGraph
+from dotenv import load_dotenv
+
+from graph_rag.graph_index import normalize_identifier
+from graph_rag.graph_version import bump_version
+
+load_dotenv()
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MODEL_IDENTIFIERS_QUERY = """
+MATCH (m:Model)
+RETURN elementId(m) AS id, coalesce(m.modelNumber, m.modelNum, m.modelId) AS number,
+       properties(m) AS properties, COUNT { (m)--() } AS degree
+"""
+
+SET_CANONICAL_QUERY = """
+UNWIND $rows AS row
+MATCH (m:Model) WHERE elementId(m) = row.id
+SET m.canonicalModelNumber = row.canonical
+"""
+
+RELATIONSHIP_TYPES_QUERY = """
+MATCH (m:Model)-[r]-() WHERE elementId(m) IN $ids
+RETURN DISTINCT type(r) AS type, startNode(r) = m AS outgoing
+"""
+
+# Relationship types cannot be parameters, so they are formatted in (from the database itself);
+# the moved relationship keeps the properties of the one it replaces
+MOVE_OUTGOING_QUERY = """
+MATCH (keep:Model) WHERE elementId(keep) = $keep
+MATCH (duplicate:Model)-[r:`{type}`]->(other) WHERE elementId(duplicate) IN $duplicates
+MERGE (keep)-[moved:`{type}`]->(other)
+SET moved += properties(r)
+DELETE r
+"""
+
+MOVE_INCOMING_QUERY = """
+MATCH (keep:Model) WHERE elementId(keep) = $keep
+MATCH (duplicate:Model)<-[r:`{type}`]-(other) WHERE elementId(duplicate) IN $duplicates
+MERGE (keep)<-[moved:`{type}`]-(other)
+SET moved += properties(r)
+DELETE r
+"""
+
+MERGE_PROPERTIES_QUERY = """
+MATCH (keep:Model) WHERE elementId(keep) = $keep
+SET keep += $properties
+WITH keep
+MATCH (duplicate:Model) WHERE elementId(duplicate) IN $duplicates
+DETACH DELETE duplicate
+"""
+
+CONSTRAINT_QUERY = """
+CREATE CONSTRAINT model_canonical_number IF NOT EXISTS
+FOR (m:Model) REQUIRE m.canonicalModelNumber IS UNIQUE
+"""
+
+
+def configure_logger(verbose):
+    """Configure logger level based on verbosity"""
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+
+def merge_duplicates(graph, nodes) -> str:
+    """Merge nodes sharing one canonical model number into the best-connected one and return its id."""
+    nodes = sorted(nodes, key=lambda node: node["degree"], reverse=True)
+    keep, duplicates = nodes[0]["id"], [node["id"] for node in nodes[1:]]
+
+    for row in graph.query(RELATIONSHIP_TYPES_QUERY, params={"ids": duplicates}):
+        query = MOVE_OUTGOING_QUERY if row["outgoing"] else MOVE_INCOMING_QUERY
+        graph.query(query.format(type=row["type"]), params={"keep": keep, "duplicates": duplicates})
+
+    # Properties of the kept node win; duplicates only fill in what it is missing.
+    # Embeddings are left alone, they are recomputed by vector_indexes.py
+    properties = {}
+    for node in reversed(nodes):
+        properties.update(
+            {key: value for key, value in node["properties"].items() if value is not None and not key.startswith("embedding")}
+        )
+    graph.query(MERGE_PROPERTIES_QUERY, params={"keep": keep, "duplicates": duplicates, "properties": properties})
+    return keep
+
+
+def canonicalize_models(graph):
+    """Set `canonicalModelNumber` on every Model, merge duplicates and add the uniqueness constraint."""
+    groups = defaultdict(list)
+    for node in graph.query(MODEL_IDENTIFIERS_QUERY):
+        if not node["number"]:
+            logger.warning(f"Model {node['id']} has no model number, skipping")
+            continue
+        groups[normalize_identifier(node["number"])].append(node)
+
+    rows = []
+    merged = 0
+    for canonical, nodes in groups.items():
+        if len(nodes) > 1:
+            logger.debug(f"Merging {len(nodes)} Model nodes into {canonical}")
+            keep = merge_duplicates(graph, nodes)
+            merged += 1
+        else:
+            keep = nodes[0]["id"]
+        rows.append({"id": keep, "canonical": canonical})
+
+    graph.query(SET_CANONICAL_QUERY, params={"rows": rows})
+    graph.query(CONSTRAINT_QUERY)
+    bump_version(graph)
+    logger.info(f"Canonicalized {len(groups)} models, merged {merged} groups of duplicates")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate Model nodes in the Neo4j graph")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    args = parser.parse_args()
+
+    configure_logger(args.verbose)
+
+    graph = Neo4jGraph(
+        url=os.environ.get("NEO4J_URI"),
+        username=os.environ.get("NEO4J_USERNAME"),
+        password=os.environ.get("NEO4J_PASSWORD"),
+        refresh_schema=False,
+    )
+    canonicalize_models(graph)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Model-tier cascade: try a cheaper model first and escalate only when its output fails a local check."""
+
+import logging
+
+from graph_rag import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def cascade_models(small_model: str, large_model: str) -> list:
+    """Function to list the models of a cascade, cheapest first, without duplicates or empty entries."""
+    return [model for model in dict.fromkeys([small_model, large_model]) if model]
+
+
+def run_cascade(stage: str, models: list, call, check):
+    """Function to call `call(model)` for each model in turn until `check(output)` accepts the output.
+
+    A failed call or rejected output on any tier but the last escalates to the next model;
+    the last model's output is returned as is. Counts calls, escalations and the model that
+    answered per stage.
+    """
+    metrics.increment(f"cascade.{stage}.calls")
+    for tier, model in enumerate(models):
+        last = tier == len(models) - 1
+        try:
+            output = call(model)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if last:
+                raise
+            logger.info("Cascade stage failed, escalating", extra={"stage": stage, "model": model, "error": str(e)})
+        else:
+            if last or check(output):
+                metrics.increment(f"cascade.{stage}.answered_by.{model}")
+                return output
+        metrics.increment(f"cascade.{stage}.escalated")
+    return None
+
+
+def escalation_rates() -> dict:
+    """Function to return the share of calls escalated to a larger model, per stage."""
+    counters = metrics.snapshot()["counters"]
+    rates = {}
+    for name, calls in counters.items():
+        if name.startswith("cascade.") and name.endswith(".calls") and calls:
+            stage = name[len("cascade."):-len(".calls")]
+            rates[stage] = round(counters.get(f"cascade.{stage}.escalated", 0) / calls, 4)
+    return rates
@@ -0,0 +1,158 @@
+"""Content-addressed cache of deterministic (temperature 0) chat completions.
+
+Entries are keyed by a hash of the model, messages and every other request parameter.
+A bounded LRU sits in front of an optional SQLite store that evicts the least recently
+used entries once it grows past a size limit. The store doubles as a record/replay
+fixture: `record` refreshes every entry from the API, `replay` never calls the API.
+"""
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from openai import OpenAIError
+from openai.types.chat import ChatCompletion
+
+from graph_rag import metrics
+
+CACHE_MODES = ["on", "off", "record", "replay"]
+
+
+class CompletionCacheMiss(OpenAIError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def completion_key(params: dict) -> str:
+    """Function to hash the parameters of a chat-completions request into a cache key."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def is_cacheable(params: dict) -> bool:
+    """Function to check whether a request is deterministic enough to cache: temperature 0, one choice, no streaming."""
+    return params.get("temperature") == 0 and not params.get("stream") and params.get("n", 1) == 1
+
+
+class CompletionCache:
+    """Bounded LRU of serialized completions, optionally backed by a size-bounded SQLite file."""
+
+    def __init__(self, max_entries: int = 512, path: str = None, max_bytes: int = 100 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._db = None
+        self._size = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, response TEXT, size INTEGER, last_used REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+            self._db.commit()
+            self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key: str):
+        """Return the serialized completion stored under `key`, or None."""
+        with self._lock:
+            response = self._entries.get(key)
+            if response is not None:
+                self._entries.move_to_end(key)
+                return response
+            if self._db is None:
+                return None
+            row = self._db.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return self._remember(key, row[0])
+
+    def put(self, key: str, response: str):
+        """Store a serialized completion in both tiers."""
+        with self._lock:
+            self._remember(key, response)
+            if self._db is None:
+                return
+            previous = self._db.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._size += len(response) - (previous[0] if previous else 0)
+            self._db.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, response, len(response), time.time()))
+            self._evict()
+            self._db.commit()
+
+    def clear(self):
+        """Drop every cached completion."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM completions")
+                self._db.commit()
+                self._size = 0
+
+    def _remember(self, key, response):
+        """Insert an entry into the in-memory tier; the caller must hold the lock."""
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return response
+
+    def _evict(self):
+        """Delete the least recently used rows until the store fits in `max_bytes`; the caller must hold the lock."""
+        while self._size > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM completions ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._entries.pop(key, None)
+                self._size -= size
+                metrics.increment("completion_cache.evicted")
+                if self._size <= self.max_bytes:
+                    break
+
+
+class CachedCompletions:
+    """Drop-in replacement for `client.chat.completions` that serves repeated deterministic requests from a cache.
+
+    Hits and misses are counted in total and per call site (the calling module and function).
+    """
+
+    def __init__(self, completions, cache: CompletionCache, mode: str = "on"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown completion cache mode {mode!r}, expected one of {CACHE_MODES}")
+        self._completions = completions
+        self.cache = cache
+        self.mode = mode
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+    def create(self, **params):
+        """Return the cached completion for these parameters, calling the API (and caching the result) on a miss."""
+        if self.mode == "off" or not is_cacheable(params):
+            return self._completions.create(**params)
+
+        caller = sys._getframe(1)  # pylint: disable=protected-access
+        site = f"{caller.f_globals.get('__name__')}.{caller.f_code.co_name}"
+        key = completion_key(params)
+
+        if self.mode != "record":
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.increment("completion_cache.hit")
+                metrics.increment(f"completion_cache.hit.{site}")
+                return ChatCompletion.model_validate_json(cached)
+            if self.mode == "replay":
+                metrics.increment(f"completion_cache.replay_miss.{site}")
+                raise CompletionCacheMiss(f"No recorded completion for {site} (key {key[:12]})")
+
+        metrics.increment("completion_cache.miss")
+        metrics.increment(f"completion_cache.miss.{site}")
+        response = self._completions.create(**params)
+        self.cache.put(key, response.model_dump_json())
+        return response
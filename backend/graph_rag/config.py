@@ -1,23 +1,144 @@
 import os
-import logging
 
 from openai import OpenAI
 from langchain_community.graphs import Neo4jGraph
 
 from dotenv import load_dotenv
 
+from graph_rag.completion_cache import CachedCompletions, CompletionCache
+from graph_rag.embeddings import get_embedding_provider
+from graph_rag.graph_index import LiveGraphIndex
+from graph_rag.graph_version import VersionWatcher
+from graph_rag.logs import configure_logging
+from graph_rag.openai_scheduler import OpenAIScheduler, scheduled_http_client
+
 load_dotenv()
 
-logging.basicConfig()
+# JSON logs written by a background thread: LOG_LEVEL (INFO in production), fields capped at
+# LOG_MAX_PAYLOAD characters, only LOG_DEBUG_SAMPLE_RATE / LOG_INFO_SAMPLE_RATE of the DEBUG / INFO
+# records kept, and records dropped rather than waited on once LOG_QUEUE_SIZE are pending
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+configure_logging(
+    level=LOG_LEVEL,
+    max_payload=int(os.environ.get("LOG_MAX_PAYLOAD", 2000)),
+    debug_sample_rate=float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", 1.0)),
+    info_sample_rate=float(os.environ.get("LOG_INFO_SAMPLE_RATE", 1.0)),
+    queue_size=int(os.environ.get("LOG_QUEUE_SIZE", 10000)),
+)
+
+# Every OpenAI request of this process (`client` and the agents' ChatOpenAI) goes through one scheduler:
+# OPENAI_RPM / OPENAI_TPM token buckets, OPENAI_MAX_CONCURRENCY (OPENAI_BATCH_MAX_CONCURRENCY for batch
+# work), interactive requests ahead of batch ones and a shared backoff after 429s. Set OPENAI_BUDGET_PATH to
+# share the RPM/TPM budget and the 429 pause with the batch jobs given the same path
+openai_scheduler = OpenAIScheduler.from_env(default_priority="interactive")
+openai_http_client = scheduled_http_client(openai_scheduler)
+
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=openai_http_client)
+
+# Temperature-0 chat completions on `client` are cached by a hash of the whole request. Set
+# COMPLETION_CACHE_PATH to persist them in SQLite (evicted past COMPLETION_CACHE_MAX_BYTES);
+# COMPLETION_CACHE_MODE is "on", "off", "record" (always call the API) or "replay" (never call it)
+COMPLETION_CACHE_SIZE = int(os.environ.get("COMPLETION_CACHE_SIZE", 512))
+COMPLETION_CACHE_PATH = os.environ.get("COMPLETION_CACHE_PATH")
+COMPLETION_CACHE_MAX_BYTES = int(os.environ.get("COMPLETION_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+COMPLETION_CACHE_MODE = os.environ.get("COMPLETION_CACHE_MODE", "on")
+completion_cache = CompletionCache(
+    max_entries=COMPLETION_CACHE_SIZE, path=COMPLETION_CACHE_PATH, max_bytes=COMPLETION_CACHE_MAX_BYTES
+)
+client.chat.completions = CachedCompletions(client.chat.completions, completion_cache, mode=COMPLETION_CACHE_MODE)
+
+# Budget for LLM-generated Cypher: row cap appended when a query has no LIMIT, estimated
+# db hits above which the plan is rejected, and the server-side transaction timeout
+CYPHER_ROW_LIMIT = int(os.environ.get("CYPHER_ROW_LIMIT", 200))
+CYPHER_MAX_DB_HITS = float(os.environ.get("CYPHER_MAX_DB_HITS", 1_000_000))
+CYPHER_TIMEOUT_SECONDS = float(os.environ.get("CYPHER_TIMEOUT_SECONDS", 10))
+
+# With CYPHER_CANDIDATES > 1, one completion proposes that many alternative Cypher queries
+# (property match, traversal, text search) that run concurrently within CYPHER_RACE_TIMEOUT
+# seconds; CYPHER_RACE_STRATEGY "first" keeps the first non-empty result and cancels the
+# others, "merge" combines every result that arrives in time
+CYPHER_CANDIDATES = int(os.environ.get("CYPHER_CANDIDATES", 1))
+CYPHER_RACE_TIMEOUT = float(os.environ.get("CYPHER_RACE_TIMEOUT", 8))
+CYPHER_RACE_STRATEGY = os.environ.get("CYPHER_RACE_STRATEGY", "first")
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Model-tier cascade: define_query, Cypher generation/correction and the agent's steps try this
+# cheaper model first and escalate to their usual model only when its output fails a local check
+# (set it to an empty string to always use the larger models)
+CASCADE_SMALL_MODEL = os.environ.get("CASCADE_SMALL_MODEL", "gpt-4o-mini")
+
+# Graph results are streamed and reading stops once this many distinct entities or tokens are collected
+STREAM_MAX_ENTITIES = int(os.environ.get("STREAM_MAX_ENTITIES", 50))
+STREAM_MAX_TOKENS = int(os.environ.get("STREAM_MAX_TOKENS", 4000))
+STREAM_FETCH_SIZE = int(os.environ.get("STREAM_FETCH_SIZE", 100))
+
+# Neighborhood tool: EXPANSION_DEPTH hops from at most EXPANSION_MAX_START parts and models, at most
+# EXPANSION_FANOUT neighbors per node and relationship type (EXPANSION_FANOUT_BY_TYPE overrides it per
+# type, e.g. "HAS_REVIEW=3,COMPATIBLE_WITH=10") and at most EXPANSION_MAX_NODES nodes in all
+EXPANSION_DEPTH = int(os.environ.get("EXPANSION_DEPTH", 2))
+EXPANSION_FANOUT = int(os.environ.get("EXPANSION_FANOUT", 5))
+EXPANSION_FANOUT_BY_TYPE = {
+    relationship.strip(): int(cap)
+    for relationship, cap in (
+        item.split("=") for item in os.environ.get("EXPANSION_FANOUT_BY_TYPE", "HAS_REVIEW=3,HAS_ANSWER=2").split(",") if item
+    )
+}
+EXPANSION_MAX_START = int(os.environ.get("EXPANSION_MAX_START", 10))
+EXPANSION_MAX_NODES = int(os.environ.get("EXPANSION_MAX_NODES", 60))
 
 neo4j_graph = Neo4jGraph(
     url=os.environ.get("NEO4J_URI"),
     username=os.environ.get("NEO4J_USERNAME"),
     password=os.environ.get("NEO4J_PASSWORD"),
+    timeout=CYPHER_TIMEOUT_SECONDS,
 )
 
+# Graph data version, bumped by ingestion and index builds; cached for a few seconds per process
+graph_version = VersionWatcher(neo4j_graph, poll_interval=float(os.environ.get("GRAPH_VERSION_POLL_SECONDS", 5)))
+
+# In-process compatibility/symptom index, rebuilt in the background whenever the graph version changes
+graph_index = LiveGraphIndex(neo4j_graph, graph_version)
+
+# Tool results are sent to the LLM as compact tables; longer field values are truncated to this length
+RESULT_FIELD_MAX_LENGTH = int(os.environ.get("RESULT_FIELD_MAX_LENGTH", 300))
+
+# Agent scratchpad budget: the latest observations stay verbatim, older ones are digested or
+# summarized with the cheap SUMMARY_MODEL once the scratchpad grows past the budget
+SCRATCHPAD_TOKEN_BUDGET = int(os.environ.get("SCRATCHPAD_TOKEN_BUDGET", 3000))
+SCRATCHPAD_RECENT_STEPS = int(os.environ.get("SCRATCHPAD_RECENT_STEPS", 1))
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4o-mini")
+
+# Speculative prefetch: the sequential agent starts Query and Similarity Search on the raw question
+# while its first LLM step runs, on a pool of SPECULATION_WORKERS threads shared by all requests
+SPECULATIVE_PREFETCH = os.environ.get("SPECULATIVE_PREFETCH", "false").lower() in ("1", "true", "yes")
+SPECULATION_WORKERS = int(os.environ.get("SPECULATION_WORKERS", 8))
+
+# Answer cache for stateless /agent/ questions (set ANSWER_CACHE_PATH to persist it in SQLite)
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 1024))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+ANSWER_CACHE_PATH = os.environ.get("ANSWER_CACHE_PATH")
+
+# Admission control per /agent/ worker: concurrent requests per class (fast-path compatibility checks,
+# cached answers, full agent runs), queued requests per class and how long they may wait for a slot
+ADMISSION_FAST_PATH_CONCURRENCY = int(os.environ.get("ADMISSION_FAST_PATH_CONCURRENCY", 32))
+ADMISSION_CACHED_CONCURRENCY = int(os.environ.get("ADMISSION_CACHED_CONCURRENCY", 32))
+ADMISSION_AGENT_CONCURRENCY = int(os.environ.get("ADMISSION_AGENT_CONCURRENCY", 8))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 16))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 2))
+
+# How often, in seconds, /agent/ checks whether the client is still connected while the agent runs
+DISCONNECT_POLL_INTERVAL = float(os.environ.get("DISCONNECT_POLL_INTERVAL", 0.5))
+
+# Sampled profiling of /agent/ requests, also switchable at runtime through /admin/profiling/:
+# PROFILING_MODE is "off", "cprofile" (deterministic) or "sampler" (wall-clock stacks every
+# PROFILING_INTERVAL seconds), one request in PROFILING_SAMPLE_RATE is profiled and the last
+# PROFILING_MAX_PROFILES are kept. The /admin/ endpoints require the X-Admin-Token header to
+# match ADMIN_TOKEN and are disabled when it is not set
+PROFILING_MODE = os.environ.get("PROFILING_MODE", "off")
+PROFILING_SAMPLE_RATE = int(os.environ.get("PROFILING_SAMPLE_RATE", 100))
+PROFILING_INTERVAL = float(os.environ.get("PROFILING_INTERVAL", 0.005))
+PROFILING_MAX_PROFILES = int(os.environ.get("PROFILING_MAX_PROFILES", 200))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
 # Constants
 EMBEDDING_MODELS = {
     "small": "text-embedding-3-small",
@@ -25,6 +146,22 @@ EMBEDDING_MODELS = {
     "large": "text-embedding-3-large"
 }
 
+# Embedding backend used for queries and index builds: "openai" or the offline "hashing" provider.
+# EMBEDDING_DIMENSIONS shortens text-embedding-3 vectors (e.g. 512); vector_indexes.py must have been
+# run with the same --dimensions
+EMBEDDING_PROVIDER = os.environ.get("EMBEDDING_PROVIDER", "openai")
+EMBEDDING_DIMENSIONS = int(os.environ["EMBEDDING_DIMENSIONS"]) if os.environ.get("EMBEDDING_DIMENSIONS") else None
+
+# Similarity search only scores nodes of the brand and appliance type a question names
+# (see search_partitions.py), falling back to the whole label when that finds nothing
+SIMILARITY_PARTITION_FILTERS = os.environ.get("SIMILARITY_PARTITION_FILTERS", "true").lower() in ("1", "true", "yes")
+embedding_provider = get_embedding_provider(
+    EMBEDDING_PROVIDER,
+    model=EMBEDDING_MODELS["small"],
+    client=client,
+    dimensions=EMBEDDING_DIMENSIONS,
+)
+
 
 GRAPH_ENTITIES = {
     "part": """
@@ -62,46 +199,24 @@ GRAPH_ENTITIES = {
 
     "manufacturer": "Represents the manufacturer of a part. Examples include 'GE' and 'Whirlpool'. Attributes include 'name'.",
     "model": """
-    Represents a specific model of an appliance or device. Different types of models are defined with varying sets of properties as follows:
-
-    a. Model (General Model Information):
-        - `modelNum`: Unique number identifying the model (e.g., "FPHD2491KF0").
+    Represents a specific model of an appliance or device, with the following properties:
+        - `canonicalModelNumber`: Unique identifier for the model: the model number in uppercase with whitespace and
+          punctuation removed (e.g., "FPHD2491KF0"). Always look models up by this property.
         - `name`: Name of the model (e.g., "Frigidaire Professional Dishwasher").
         - `brand`: Brand associated with the model (e.g., "Frigidaire").
-        - `modelType`: Type of the model (e.g., "Dishwasher").
+        - `modelType`: Type of the model (e.g., "Dishwasher", "Refrigerator").
         - `description`: Brief description of the model (e.g., "A professional dishwasher model with advanced cleaning technology.").
-        - `modelNumber`: Another unique identifier for the model (e.g., "FPHD2491KF0").
+    Related to: `Instruction` through `HAS_INSTRUCTION`, `Symptom` through `HAS_SYMPTOM`, `Section` through `HAS_SECTION`,
+    `Manual` through `HAS_MANUAL` and `Part` through `COMPATIBLE_WITH`.
 
-    **Example Query**:
-    MATCH (m:Model {modelNumber: 'FPHD2491KF0'})
+    **Example Queries**:
+    MATCH (m:Model {canonicalModelNumber: 'FPHD2491KF0'})
     RETURN m;
 
-    b. `Model` connected to `Instruction` entity:
-        - `description`: Description of the model (e.g., "Frigidaire Dishwasher Model with advanced tech.").
-        - `modelNumber`: Model number identifying the appliance (e.g., "FPHD2491KF0").
-        - `brand`: Brand associated with the model (e.g., "Frigidaire").
-        - Related to: `Instruction` (e.g., Installation instructions specific to the model).
-
-    **Example Query**:
-    MATCH (m:Model)-[:HAS_INSTRUCTION]->(i:Instruction)
-    WHERE m.modelNumber = 'FPHD2491KF0'
+    MATCH (m:Model {canonicalModelNumber: 'FPHD2491KF0'})-[:HAS_INSTRUCTION]->(i:Instruction)
     RETURN m, i;
 
-    c. `Model` :
-        - `modelNum`: Unique identifier for the model , synonymous with `modelNumber`(e.g., "12345").
-        - `name`: Name of the model (e.g., "Frigidaire Dishwasher").
-        - `modelType`: Type of the model (e.g., "Dishwasher","Refrigerator").
-
-    **Example Query**:
-    MATCH (m:Model {modelNum: '12345'})
-    RETURN m;
-
-    d. Model connected to `Symptom` entity through `HAS_SYMPTOM`:
-        - `modelId`: Unique identifier for the model, synonymous with modelNum and modelNumber (e.g., "98765").
-    Related to: `Symptom` (e.g., Symptoms associated with this model, such as "Water leakage").
-
-    **Example Query**:
-    MATCH (m:Model {modelId: '98765'})-[:HAS_SYMPTOM]->(s:Symptom)
+    MATCH (m:Model {canonicalModelNumber: '98765'})-[:HAS_SYMPTOM]->(s:Symptom)
     RETURN m, s;
     """,
 
@@ -152,6 +267,7 @@ GRAPH_ENTITIES = {
             "answer": "Hello Kathy, thank you for writing. We do have an installation video for this replacement on your model. Here is a link: https://www.youtube.com/watch?v=OWFBZZEFB3E. We hope this helps."
         }
     """,
+    "part_digest": "Represents the precomputed digest of a part's reviews, repair stories and Q&A. Attributes include 'summary', 'difficulty', 'repairTime', 'reviewRating', 'topSymptoms'.",
     "instruction": "Represents installation instructions related to models. Attributes include 'modelNumber', 'title', 'description', 'difficulty', 'repairTime', 'helpfulVotes'.Be sure to use only 'installation' as the name of the entity"
 }
 
@@ -166,11 +282,12 @@ GRAPH_RELATIONSHIPS = {
     "HAS_ANSWER": "Represents that a question about the part has an associated answer. Example - MATCH (q:Question) -[r:HAS_ANSWER]-> (n:Answer) RETURN n,r,q ",
     "HAS_SECTION": "Represents that a model has a section related to its structure.",
     "HAS_MANUAL": "Represents that a model has an associated manual.",
-    "HAS_INSTRUCTION": "Represents that a model has associated instructions."
+    "HAS_INSTRUCTION": "Represents that a model has associated instructions.",
+    "HAS_DIGEST": "Represents that a part has a precomputed digest of its reviews, repair stories and Q&A."
 }
 
 ENTITY_RELATIONSHIP_MAP = {
-    "part": ["MANUFACTURED_BY", "HAS_REVIEW", "COMPATIBLE_WITH", "HAS_REPAIR_STORY", "HAS_QUESTION"],
+    "part": ["MANUFACTURED_BY", "HAS_REVIEW", "COMPATIBLE_WITH", "HAS_REPAIR_STORY", "HAS_QUESTION", "HAS_DIGEST"],
     "manufacturer": ["MANUFACTURED_BY"],
     "model": ["COMPATIBLE_WITH", "HAS_SYMPTOM", "HAS_SECTION", "HAS_MANUAL", "HAS_INSTRUCTION"],
     "symptom": ["FIXED_BY", "HAS_SYMPTOM"],
@@ -180,7 +297,8 @@ ENTITY_RELATIONSHIP_MAP = {
     "answer": ["HAS_ANSWER"],
     "section": ["HAS_SECTION"],
     "manual": ["HAS_MANUAL"],
-    "instruction": ["HAS_INSTRUCTION"]
+    "instruction": ["HAS_INSTRUCTION"],
+    "part_digest": ["HAS_DIGEST"]
 }
 
 
@@ -0,0 +1,133 @@
+"""Cost guard for generated Cypher: inspect the EXPLAIN plan before a query is allowed to run."""
+
+import re
+import threading
+from collections import OrderedDict
+
+from graph_rag import metrics
+
+# Plan operators that usually mean the generated query lost its anchor or its join condition
+FLAGGED_OPERATORS = {"CartesianProduct", "AllNodesScan"}
+
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+|\$\w+)\s*$", re.IGNORECASE)
+UNION_PATTERN = re.compile(r"\bUNION\b", re.IGNORECASE)
+RETURN_PATTERN = re.compile(r"\bRETURN\b", re.IGNORECASE)
+
+# Generated text is cut to the Cypher between the first clause and the first line of prose
+FENCE_PATTERN = re.compile(r"```(?:cypher)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
+QUERY_START = re.compile(r"^\s*(OPTIONAL\s+MATCH|MATCH|WITH|CALL|UNWIND|RETURN)\b", re.IGNORECASE)
+QUERY_LINE = re.compile(
+    r"^\s*(OPTIONAL|MATCH|WHERE|WITH|RETURN|ORDER|SKIP|LIMIT|UNWIND|CALL|UNION|YIELD|AND|OR|XOR|NOT|CASE|WHEN|THEN|"
+    r"ELSE|END|DISTINCT|COLLECT|COUNT|EXISTS)\b|^\s+\S|^\s*[(){}\[\],.:'\"$`<>=+*/-]",
+    re.IGNORECASE,
+)
+
+# EXPLAIN plans of recently guarded queries, so validating and then guarding a query plans it once
+PLAN_CACHE_SIZE = 256
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+class CypherCostError(ValueError):
+    """Raised when a generated query is estimated to cost more than the configured budget."""
+
+    def __init__(self, message: str, cost: dict):
+        super().__init__(message)
+        self.cost = cost
+
+
+def extract_cypher(text: str) -> str:
+    """Function to keep only the Cypher of a completion: no code fences, no prose before or after the query."""
+    fenced = FENCE_PATTERN.search(text)
+    lines = (fenced.group(1) if fenced else text.replace("```", "")).strip().splitlines()
+    start = next((i for i, line in enumerate(lines) if QUERY_START.match(line)), None)
+    if start is None:
+        return "\n".join(lines).strip()
+    query = [lines[start]]
+    for line in lines[start + 1:]:
+        if not line.strip() or not QUERY_LINE.match(line):
+            break
+        query.append(line)
+    return "\n".join(query).strip()
+
+
+def prepare_query(text: str, limit: int) -> str:
+    """Function to turn a completion into the query that is planned and run: Cypher only, with a LIMIT."""
+    return ensure_limit(extract_cypher(text), limit)
+
+
+def ensure_limit(query: str, limit: int) -> str:
+    """Function to append a LIMIT to a query whose final RETURN has none."""
+    query = query.strip().rstrip(";").strip()
+    if LIMIT_PATTERN.search(query) or not RETURN_PATTERN.search(query):
+        return query
+    # A trailing LIMIT would only bound the last branch of a UNION, so leave those alone
+    if UNION_PATTERN.search(query):
+        return query
+    return f"{query}\nLIMIT {limit}"
+
+
+def explain(graph, query: str, params: dict = None) -> dict:
+    """Function to fetch the EXPLAIN plan of a query without executing it."""
+    with graph._driver.session(database=graph._database) as session:  # pylint: disable=protected-access
+        summary = session.run(f"EXPLAIN {query}", params or {}).consume()
+    return summary.plan or {}
+
+
+def cached_plan(graph, query: str, params: dict = None) -> dict:
+    """Function to EXPLAIN a query once and reuse its plan for the next checks of the same text."""
+    with _plans_lock:
+        if query in _plans:
+            _plans.move_to_end(query)
+            metrics.increment("cypher_guard.plan_cache_hit")
+            return _plans[query]
+    plan = explain(graph, query, params)
+    with _plans_lock:
+        _plans[query] = plan
+        while len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    return plan
+
+
+def estimate_cost(plan: dict) -> dict:
+    """Function to summarise a plan: estimated rows, estimated db hits and flagged operators.
+
+    EXPLAIN does not report db hits, so they are estimated as the rows flowing through
+    every operator of the plan; the result row estimate is the root operator's.
+    """
+    cost = {"estimated_rows": 0, "estimated_db_hits": 0, "flagged_operators": []}
+    pending = [plan] if plan else []
+    while pending:
+        operator = pending.pop()
+        operator_type = operator.get("operatorType", "").split("@")[0]
+        rows = operator.get("args", {}).get("EstimatedRows", 0)
+        cost["estimated_db_hits"] += rows
+        if operator_type in FLAGGED_OPERATORS:
+            cost["flagged_operators"].append(operator_type)
+        pending.extend(operator.get("children", []))
+    if plan:
+        cost["estimated_rows"] = plan.get("args", {}).get("EstimatedRows", 0)
+    return cost
+
+
+def guard_query(graph, query: str, params: dict = None, row_limit: int = 200, max_db_hits: float = 1_000_000) -> str:
+    """Function to bound a generated query and reject it when its plan is over budget.
+
+    Returns the query to execute (the Cypher of the completion, with a LIMIT added where
+    none exists), or raises `CypherCostError` when the estimated db hits exceed `max_db_hits`.
+    """
+    query = prepare_query(query, row_limit)
+    cost = estimate_cost(cached_plan(graph, query, params))
+
+    for operator_type in cost["flagged_operators"]:
+        metrics.increment(f"cypher_guard.flagged.{operator_type}")
+    if cost["estimated_db_hits"] > max_db_hits:
+        metrics.increment("cypher_guard.rejected")
+        raise CypherCostError(
+            f"Query rejected: estimated {cost['estimated_db_hits']:.0f} db hits exceeds the budget of {max_db_hits:.0f}"
+            + (f" (plan uses {', '.join(cost['flagged_operators'])})" if cost["flagged_operators"] else ""),
+            cost,
+        )
+
+    metrics.increment("cypher_guard.accepted")
+    return query
@@ -0,0 +1,200 @@
+"""Recall vs latency and memory of shortened and int8-quantized embeddings over the graph's own texts.
+
+The texts of a sample of nodes (built like vector_indexes.py does) are embedded once at
+full size; shortened embeddings are derived locally, which is what the API's `dimensions`
+parameter does. Short fields of a sample of those nodes (part names, symptoms, questions,
+titles) serve as queries, and the top-k neighbours by full-size float embeddings are the
+ground truth every other setting is measured against.
+
+Only the shortened sizes are a storage mode of the service (vector_indexes.py --dimensions);
+the int8 rows show what quantization would buy. Two sizes are reported per vector:
+`bytes_per_vector` for a store with native float32 and int8 vectors, and
+`neo4j_bytes_per_vector` for Neo4j list properties, whose floats are 64-bit doubles and whose
+integers are 64-bit too, so an int8 copy saves nothing there. Rescoring reads the
+full-precision vector, so its rows count both. The latency is an offline proxy: a NumPy scan
+of in-memory arrays, not the Cypher queries the server runs, so only the ratios between
+settings carry over.
+
+    python -m graph_rag.embedding_benchmark --nodes 5000 --queries 200 --dimensions 256 512 1024 1536
+"""
+
+import os
+import argparse
+import json
+import logging
+import random
+import time
+
+import numpy as np
+from langchain_community.graphs import Neo4jGraph
+from openai import OpenAI
+from dotenv import load_dotenv
+
+from graph_rag.embeddings import quantize_vectors, truncate_embeddings
+from graph_rag.openai_scheduler import OpenAIScheduler, scheduled_http_client
+from graph_rag.vector_indexes import EMBEDDING_MODELS, ENTITY_EMBEDDINGS
+
+load_dotenv()
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Fields that read like something a customer would search for
+QUERY_FIELDS = ("partName", "name", "question", "title", "symptomName")
+
+NODE_TEXTS_QUERY = """
+MATCH (e:`{entity}`)
+RETURN e AS node
+LIMIT $limit
+"""
+
+
+def configure_logger(verbose):
+    """Configure logger level based on verbosity"""
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+
+def load_texts(graph, limit: int) -> tuple:
+    """Function to fetch up to `limit` nodes spread over the embedded labels, as (document texts, query texts)."""
+    documents, queries = [], []
+    per_entity = max(limit // len(ENTITY_EMBEDDINGS), 1)
+    for entity, properties in ENTITY_EMBEDDINGS.items():
+        for row in graph.query(NODE_TEXTS_QUERY.format(entity=entity), params={"limit": per_entity}):
+            node = row["node"]
+            text = "".join(f"\n{prop}: {node[prop]}" for prop in properties if node.get(prop))
+            if not text:
+                continue
+            documents.append(text)
+            query = next((str(node[field]) for field in QUERY_FIELDS if node.get(field)), None)
+            if query:
+                queries.append(query)
+    return documents, queries
+
+
+def embed(client, texts: list, model: str, batch_size: int = 256) -> np.ndarray:
+    """Function to embed texts at full size in batches."""
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        result = client.embeddings.create(model=model, input=texts[start:start + batch_size])
+        vectors.extend(item.embedding for item in result.data)
+        logger.debug(f"Embedded {min(start + batch_size, len(texts))}/{len(texts)} texts")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k best scores of every row, best first."""
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, best, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(best, order, axis=1)
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    """Mean share of the true top-k found."""
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found.tolist(), truth.tolist())]))
+
+
+def benchmark(documents: np.ndarray, queries: np.ndarray, dimensions: list, k: int, rescore_factor: int) -> list:
+    """Function to measure recall@k, offline per-query search latency and memory of every storage setting."""
+    truth = top_k(queries @ documents.T, k)
+    results = []
+    for size in dimensions:
+        docs = truncate_embeddings(documents, size)
+        query_vectors = truncate_embeddings(queries, size)
+        quantized, _ = quantize_vectors(docs)
+        quantized_norms = np.linalg.norm(quantized.astype(np.float32), axis=1)
+
+        def float_search():
+            return top_k(query_vectors @ docs.T, k)
+
+        def int8_search(candidates=k):
+            # Cosine similarity against the int8 vectors does not depend on their scales
+            return top_k((query_vectors @ quantized.T.astype(np.float32)) / quantized_norms, candidates)
+
+        def int8_rescored_search():
+            candidates = int8_search(k * rescore_factor)
+            exact = np.einsum("qd,qcd->qc", query_vectors, docs[candidates])
+            return np.take_along_axis(candidates, top_k(exact, k), axis=1)
+
+        # Bytes per vector with native float32/int8 vectors, and as Neo4j list properties of doubles and of
+        # 64-bit integers (plus the scale); without rescoring the int8 copy could replace the float vector
+        settings = (
+            ("float32", float_search, size * 4, size * 8),
+            ("int8", int8_search, size + 4, size * 8 + 8),
+            (f"int8+rescore x{rescore_factor}", int8_rescored_search, size + 4 + size * 4, size * 8 + size * 8 + 8),
+        )
+        for storage, search, bytes_per_vector, neo4j_bytes_per_vector in settings:
+            start = time.perf_counter()
+            found = search()
+            elapsed = time.perf_counter() - start
+            results.append({
+                "dimensions": size,
+                "storage": storage,
+                f"recall@{k}": round(recall(found, truth), 4),
+                "offline_latency_ms_per_query": round(elapsed / len(queries) * 1000, 4),
+                "bytes_per_vector": bytes_per_vector,
+                "index_mb": round(bytes_per_vector * len(documents) / 1024 / 1024, 2),
+                "neo4j_bytes_per_vector": neo4j_bytes_per_vector,
+                "neo4j_mb": round(neo4j_bytes_per_vector * len(documents) / 1024 / 1024, 2),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shortened and quantized embeddings on the graph data")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    parser.add_argument("--nodes", type=int, default=5000, help="Number of nodes to embed")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1024, 1536], help="Sizes to compare")
+    parser.add_argument("--k", type=int, default=10, help="Number of neighbours to retrieve")
+    parser.add_argument("--rescore-factor", type=int, default=5, help="Candidates per result rescored at full precision")
+    parser.add_argument("--model", default=EMBEDDING_MODELS["small"], help="text-embedding-3 model")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    configure_logger(args.verbose)
+
+    graph = Neo4jGraph(
+        url=os.environ.get("NEO4J_URI"),
+        username=os.environ.get("NEO4J_USERNAME"),
+        password=os.environ.get("NEO4J_PASSWORD"),
+        refresh_schema=False,
+    )
+    documents, queries = load_texts(graph, args.nodes)
+    queries = random.Random(0).sample(queries, min(args.queries, len(queries)))
+    logger.info(f"Embedding {len(documents)} documents and {len(queries)} queries with {args.model}")
+
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        http_client=scheduled_http_client(OpenAIScheduler.from_env(default_priority="batch")),
+    )
+    results = benchmark(
+        embed(client, documents, args.model),
+        embed(client, queries, args.model),
+        [size for size in args.dimensions if size],
+        args.k,
+        args.rescore_factor,
+    )
+
+    # Latency is a NumPy scan of in-memory arrays, a proxy for the Cypher queries the server runs
+    print(
+        f"{'dims':>6}  {'storage':<20}{'recall':>8}{'offline ms/q':>14}{'bytes/vec':>11}{'index MB':>10}"
+        f"{'neo4j bytes/vec':>17}{'neo4j MB':>10}"
+    )
+    for row in results:
+        print(
+            f"{row['dimensions']:>6}  {row['storage']:<20}{row[f'recall@{args.k}']:>8}"
+            f"{row['offline_latency_ms_per_query']:>14}{row['bytes_per_vector']:>11}{row['index_mb']:>10}"
+            f"{row['neo4j_bytes_per_vector']:>17}{row['neo4j_mb']:>10}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Embedding providers shared by query-time search and vector index builds."""
+
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from openai import OpenAI
+
+from graph_rag.cancellation import RequestCancelled
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class EmbeddingProvider(Embeddings):
+    """Base class for embedding providers.
+
+    Every provider writes its vectors to its own node property and vector indexes,
+    so embeddings of different providers (and dimensionalities) never get mixed.
+    """
+
+    name = ""
+    dimensions = None
+
+    @property
+    def embedding_property(self) -> str:
+        """Node property holding this provider's embeddings."""
+        return f"embedding_{self.name}"
+
+    def index_name(self, entity: str) -> str:
+        """Vector index name for the given node label."""
+        return f"{entity}_{self.name}"
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the OpenAI API.
+
+    At full size the original `embedding` property and index names are kept; shortened
+    embeddings (the text-embedding-3 `dimensions` parameter) get their own, e.g.
+    `embedding_512` and `Part_512`.
+    """
+
+    name = "openai"
+
+    def __init__(self, model: str, client: OpenAI = None, dimensions: int = None):
+        self.model = model
+        self.client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.dimensions = dimensions
+
+    @property
+    def embedding_property(self) -> str:
+        return f"embedding_{self.dimensions}" if self.dimensions else "embedding"
+
+    def index_name(self, entity: str) -> str:
+        return f"{entity}_{self.dimensions}" if self.dimensions else entity
+
+    def embed_documents(self, texts: list) -> list:
+        if self.dimensions:
+            result = self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dimensions)
+        else:
+            result = self.client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in result.data]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """Offline CPU embeddings: signed feature hashing of words and character n-grams.
+
+    Needs no network or model files, so it also makes the pipeline testable offline.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 512, ngram_sizes: tuple = (3, 4)):
+        self.dimensions = dimensions
+        self.ngram_sizes = ngram_sizes
+
+    def _features(self, text: str) -> list:
+        """Return the words of the text plus the character n-grams of each word."""
+        features = []
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            features.append(token)
+            padded = f"<{token}>"
+            for size in self.ngram_sizes:
+                features.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+        return features
+
+    def _embed(self, text: str) -> list:
+        features = self._features(text)
+        if not features:
+            return [0.0] * self.dimensions
+
+        hashes = np.fromiter(
+            (zlib.crc32(feature.encode("utf-8")) for feature in features), dtype=np.uint32, count=len(features)
+        )
+        # The low bits pick the dimension, the top bit picks the sign to cancel out collisions
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+        vector = np.bincount(hashes % self.dimensions, weights=signs, minlength=self.dimensions)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self._embed(text) for text in texts]
+
+
+class _LeaderCancelled(Exception):
+    """Set on the texts of a batch whose leader was cancelled before embedding them."""
+
+
+class EmbeddingBatcher:
+    """Merges the `embed_query` calls of concurrent threads into batched `embed_documents` calls.
+
+    The first caller of a batch waits up to `max_wait` seconds (or until `max_batch` distinct
+    texts have joined) and then embeds the whole batch in one request; the others wait for
+    its result. If the first caller's own request is cancelled meanwhile, the others embed
+    their texts themselves instead of failing with it. The last `cache_size` embeddings are
+    kept, so texts repeated across questions are embedded once.
+    """
+
+    def __init__(self, provider: EmbeddingProvider, max_batch: int = 256, max_wait: float = 0.02, cache_size: int = 10000):
+        self.provider = provider
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.requests = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._batch = None
+        self._full = None
+
+    def embed_query(self, text: str) -> list:
+        with self._lock:
+            self.requests += 1
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+            batch, full = self._batch, self._full
+            leader = batch is None
+            if leader:
+                batch, full = self._batch, self._full = {}, threading.Event()
+            future = batch.get(text)
+            if future is None:
+                future = batch[text] = Future()
+                if len(batch) >= self.max_batch:
+                    self._batch = None
+                    full.set()
+
+        if leader:
+            full.wait(self.max_wait)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._embed(batch)
+        try:
+            return future.result()
+        except _LeaderCancelled:
+            return self.provider.embed_query(text)
+
+    def _embed(self, batch: dict):
+        texts = list(batch)
+        try:
+            vectors = self.provider.embed_documents(texts)
+        except RequestCancelled:
+            # Only the leader's request was cancelled, not those of the texts it embeds
+            for future in batch.values():
+                future.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            for future in batch.values():
+                future.set_exception(e)
+            raise
+        with self._lock:
+            self.batches += 1
+            for text, vector in zip(texts, vectors):
+                self._cache[text] = vector
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        for text, vector in zip(texts, vectors):
+            batch[text].set_result(vector)
+
+
+EMBEDDING_PROVIDERS = ["openai", "hashing"]
+
+
+def get_embedding_provider(name: str, model: str = None, client: OpenAI = None, dimensions: int = None) -> EmbeddingProvider:
+    """Function to build the embedding provider selected by name."""
+    if name == "openai":
+        return OpenAIEmbeddingProvider(model=model, client=client, dimensions=dimensions)
+    if name == "hashing":
+        return HashingEmbeddingProvider(dimensions=dimensions or 512)
+    raise ValueError(f"Unknown embedding provider '{name}', expected one of {EMBEDDING_PROVIDERS}")
+
+
+def quantize_vectors(vectors: np.ndarray) -> tuple:
+    """Function to quantize row vectors to int8 with one scale per vector, so that vector ~= int8 * scale."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def truncate_embeddings(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """Function to shorten text-embedding-3 vectors locally: keep the leading dimensions and renormalize.
+
+    This is what the API's `dimensions` parameter does, so one full-size embedding run is
+    enough to compare every shortened size.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)[:, :dimensions]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
@@ -0,0 +1,32 @@
+"""Answers to part/model compatibility checks straight from the graph index, without the agent."""
+
+import re
+
+from graph_rag import metrics
+from graph_rag.graph_index import IDENTIFIER
+
+COMPATIBILITY_QUESTION = re.compile(r"\b(compatible|compatibility|fit|fits|work with|works with)\b", re.IGNORECASE)
+
+
+def is_compatibility_question(text: str) -> bool:
+    """Function to check whether a question looks like "is part X compatible with model Y?"."""
+    return bool(COMPATIBILITY_QUESTION.search(text)) and len(IDENTIFIER.findall(text)) >= 2
+
+
+def answer_compatibility(index, text: str):
+    """Function to answer a compatibility check naming exactly one known part and one known model, or return None."""
+    if not is_compatibility_question(text):
+        return None
+    identifiers = IDENTIFIER.findall(text)
+    parts = [identifier for identifier in identifiers if index.find("Part", identifier)]
+    models = [identifier for identifier in identifiers if index.find("Model", identifier)]
+    if len(parts) != 1 or len(models) != 1:
+        return None
+
+    compatible = index.is_compatible(parts[0], models[0])
+    if compatible is None:
+        return None
+    metrics.increment("fast_path.answered")
+    if compatible:
+        return f"Yes, part {parts[0]} is compatible with model {models[0]}."
+    return f"No, part {parts[0]} is not listed as compatible with model {models[0]}."
@@ -0,0 +1,168 @@
+"""Bounded neighborhood expansion of retrieved parts and models in one Cypher call.
+
+Given the part and model numbers returned by `query_db` or `similarity_search`, one
+parameterized query walks up to `depth` hops over the relationships that
+`config.ENTITY_RELATIONSHIP_MAP` allows for each entity type: a part's reviews, repair
+stories, Q&A and compatible models, a model's symptoms and, one hop further, the parts that
+fix them, its sections, manuals and instructions. Every hop reads at most `fanout` neighbors
+per node and relationship type (each type is its own `LIMIT`ed branch, so high-degree nodes
+are never read in full), and the subgraph stops growing at `max_nodes` nodes. Nodes and
+relationships are returned once each.
+"""
+
+import logging
+import time
+
+from graph_rag import metrics
+from graph_rag.cancellation import check_cancelled
+from graph_rag.graph_index import IDENTIFIER, normalize_identifier
+from graph_rag.graph_query import map_entity
+
+logger = logging.getLogger(__name__)
+
+# Neo4j labels of the entity types of `ENTITY_RELATIONSHIP_MAP`
+ENTITY_LABELS = {
+    "part": "Part",
+    "manufacturer": "Manufacturer",
+    "model": "Model",
+    "symptom": "Symptom",
+    "review": "Review",
+    "repair_story": "RepairStory",
+    "question": "Question",
+    "answer": "Answer",
+    "section": "Section",
+    "manual": "Manual",
+    "instruction": "Instruction",
+    "part_digest": "PartDigest",
+}
+
+# Properties read from every node: those `map_entity` keeps, plus the names of the nodes it has no field for
+NODE_FIELDS = (
+    "partSelectNumber", "partName", "manufacturerPartNumber", "price", "rating", "reviewCount", "description",
+    "manufacturer", "canonicalModelNumber", "modelNumber", "brand", "modelType", "reviewerName", "date", "title",
+    "reviewText", "symptomName", "fixPercentage", "partNumber", "partPrice", "availability", "customer",
+    "instruction", "difficulty", "time", "helpfulness", "question", "questionDate", "answer", "summary",
+    "repairTime", "reviewRating", "topSymptoms", "name",
+)
+
+START_QUERY = """
+CALL {
+    MATCH (n:Part) WHERE n.partSelectNumber IN $ids OR n.manufacturerPartNumber IN $ids RETURN n
+    UNION
+    MATCH (n:Model) WHERE n.canonicalModelNumber IN $models RETURN n
+}
+WITH collect(n)[..$max_start] AS nodes
+WITH nodes, nodes AS frontier, [] AS relationships
+"""
+
+BRANCH = """        WITH source
+        MATCH (source:{label})-[r:{relationship}]-(target) RETURN r, target LIMIT $fanout_{relationship}"""
+
+# One hop from the frontier; only nodes not reached before form the next frontier
+HOP_QUERY = """
+CALL {{
+    WITH frontier
+    UNWIND frontier AS source
+    CALL {{
+{branches}
+    }}
+    RETURN collect(DISTINCT target) AS reached, collect(DISTINCT r) AS hop
+}}
+WITH nodes, relationships + hop AS relationships, [n IN reached WHERE NOT n IN nodes] AS reached
+WITH nodes, relationships, reached[..CASE WHEN size(nodes) < $max_nodes THEN $max_nodes - size(nodes) ELSE 0 END] AS frontier
+WITH nodes + frontier AS nodes, relationships, frontier
+"""
+
+RETURN_QUERY = """
+RETURN [n IN nodes | {{id: elementId(n), label: [label IN labels(n) WHERE label IN $labels][0], properties: n {{{fields}}}}}] AS nodes,
+       [r IN relationships WHERE startNode(r) IN nodes AND endNode(r) IN nodes |
+        {{type: type(r), source: elementId(startNode(r)), target: elementId(endNode(r))}}] AS relationships
+"""
+
+
+def build_expansion_query(relationship_map: dict, depth: int) -> str:
+    """Function to write the expansion query walking `depth` hops over the relationships of each entity type."""
+    branches = "\n        UNION\n".join(
+        BRANCH.format(label=ENTITY_LABELS[entity], relationship=relationship)
+        for entity, relationships in relationship_map.items()
+        if entity in ENTITY_LABELS
+        for relationship in relationships
+    )
+    fields = ", ".join(f".{field}" for field in NODE_FIELDS)
+    return START_QUERY + HOP_QUERY.format(branches=branches) * depth + RETURN_QUERY.format(fields=fields)
+
+
+def expansion_params(relationship_map: dict, fanout: int, fanout_by_type: dict) -> dict:
+    """Function to give every relationship type its fan-out cap as a query parameter."""
+    relationships = {relationship for relationships in relationship_map.values() for relationship in relationships}
+    return {f"fanout_{relationship}": fanout_by_type.get(relationship, fanout) for relationship in relationships}
+
+
+def node_key(node: dict, index: int) -> str:
+    """Function to name a node by its part or model number, or by its label and position in the subgraph."""
+    properties = node["properties"]
+    for field in ("partSelectNumber", "canonicalModelNumber", "modelNumber", "symptomName", "name"):
+        if properties.get(field):
+            return str(properties[field])
+    return f"{node['label']} {index}"
+
+
+def subgraph_matches(row: dict) -> list:
+    """Function to turn the returned subgraph into tool results: one match per node, then its relationships."""
+    matches, keys = [], {}
+    for index, node in enumerate(row.get("nodes") or [], start=1):
+        if node["id"] in keys:
+            continue
+        keys[node["id"]] = node_key(node, index)
+        properties = {field: value for field, value in node["properties"].items() if value is not None}
+        match = map_entity(properties)
+        if "name" in properties and not match.get("symptomName"):
+            match["name"] = properties["name"]
+        # Nodes without an identifying field get the key their relationships refer to
+        key = {} if keys[node["id"]] in match.values() else {"key": keys[node["id"]]}
+        matches.append({"type": node["label"] or "Node", **key, **match})
+
+    seen = set()
+    for relationship in row.get("relationships") or []:
+        edge = (keys.get(relationship["source"]), relationship["type"], keys.get(relationship["target"]))
+        if None in edge or edge in seen:
+            continue
+        seen.add(edge)
+        matches.append({"type": "Relationship", "from": edge[0], "relationship": edge[1], "to": edge[2]})
+    return matches
+
+
+class GraphExpander:
+    """Expands part and model numbers to their bounded neighborhood with one prepared query."""
+
+    def __init__(self, graph, relationship_map: dict, depth: int = 2, fanout: int = 5, fanout_by_type: dict = None,
+                 max_start: int = 10, max_nodes: int = 60):
+        self.graph = graph
+        self.query = build_expansion_query(relationship_map, depth)
+        self.params = {
+            **expansion_params(relationship_map, fanout, fanout_by_type or {}),
+            "labels": list(ENTITY_LABELS.values()),
+            "max_start": max_start,
+            "max_nodes": max_nodes,
+        }
+
+    def expand(self, text: str) -> list:
+        """Function to return the deduplicated neighborhood of the part and model numbers found in `text`."""
+        ids = list(dict.fromkeys(IDENTIFIER.findall(text or "")))
+        if not ids:
+            return [{"error": "No part or model number found. Pass the part and model numbers returned by the other tools."}]
+
+        check_cancelled("graph_expansion")
+        params = {
+            **self.params,
+            "ids": ids + [identifier.upper() for identifier in ids],
+            "models": [normalize_identifier(identifier) for identifier in ids],
+        }
+        start = time.perf_counter()
+        rows = self.graph.query(self.query, params=params)
+        metrics.observe("graph_expansion", time.perf_counter() - start)
+
+        matches = subgraph_matches(rows[0]) if rows else []
+        metrics.increment("graph_expansion.nodes", sum(match["type"] != "Relationship" for match in matches))
+        logger.debug("Neighborhood expanded", extra={"ids": ids, "count": len(matches)})
+        return matches or [{"error": f"No part or model found for {', '.join(ids)}."}]
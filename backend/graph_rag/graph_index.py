@@ -0,0 +1,284 @@
+"""In-process index of the compatibility and symptom graph for lookups that do not need Cypher.
+
+The index is built from a Neo4j export of Part, Model and Symptom nodes and the
+`COMPATIBLE_WITH`, `HAS_SYMPTOM` and `FIXED_BY` relationships. Nodes are interned to
+dense integers, every relationship type is stored as CSR adjacency arrays, and node
+attributes live in one array-backed store, so a lookup is a few array slices.
+"""
+
+import logging
+import re
+import threading
+from array import array
+
+import numpy as np
+
+from graph_rag import metrics
+
+logger = logging.getLogger(__name__)
+
+INDEXED_LABELS = ("Part", "Model", "Symptom")
+INDEXED_RELATIONSHIPS = ("COMPATIBLE_WITH", "HAS_SYMPTOM", "FIXED_BY")
+
+EXPORT_NODES_QUERY = """
+MATCH (n) WHERE n:Part OR n:Model OR n:Symptom
+RETURN elementId(n) AS id,
+       [label IN labels(n) WHERE label IN ['Part', 'Model', 'Symptom']][0] AS label,
+       [n.partSelectNumber, n.manufacturerPartNumber, n.partNumber, n.partId,
+        n.canonicalModelNumber, n.modelNum, n.modelNumber, n.modelId] AS keys,
+       coalesce(n.partName, n.name, n.canonicalModelNumber, n.modelNum, n.modelNumber, n.modelId) AS name,
+       coalesce(n.price, n.partPrice) AS price
+"""
+
+EXPORT_RELATIONSHIPS_QUERY = """
+MATCH (a)-[r:COMPATIBLE_WITH|HAS_SYMPTOM|FIXED_BY]->(b)
+RETURN type(r) AS type, elementId(a) AS source, elementId(b) AS target
+"""
+
+IDENTIFIER = re.compile(r"\b(?=[A-Za-z0-9-]*\d)[A-Za-z0-9-]{5,}\b")
+WORD = re.compile(r"[a-z]+")
+
+
+def normalize_identifier(value) -> str:
+    """Function to normalize a part or model number: uppercase, without whitespace or punctuation."""
+    return re.sub(r"[^0-9A-Z]", "", str(value).upper())
+
+
+def matches_symptom(name: str, text: str) -> bool:
+    """Function to check whether most words of a symptom name ("Ice maker not making ice") occur in the text."""
+    name_words = set(WORD.findall(name.lower()))
+    if not name_words:
+        return False
+    return len(name_words & set(WORD.findall(text.lower()))) * 2 >= len(name_words)
+
+
+class NodeStore:
+    """Array-backed attributes of the interned nodes, addressed by node number."""
+
+    __slots__ = ("label_ids", "keys", "names", "prices")
+
+    def __init__(self):
+        self.label_ids = array("B")
+        self.keys = []
+        self.names = []
+        self.prices = []
+
+    def add(self, label: str, key: str, name, price) -> int:
+        self.label_ids.append(INDEXED_LABELS.index(label))
+        self.keys.append(key)
+        self.names.append(name or "")
+        self.prices.append(price)
+        return len(self.keys) - 1
+
+    def label(self, node: int) -> str:
+        return INDEXED_LABELS[self.label_ids[node]]
+
+    def describe(self, node: int) -> dict:
+        entity = {"type": self.label(node), "id": self.keys[node], "name": self.names[node]}
+        if self.prices[node] is not None:
+            entity["price"] = self.prices[node]
+        return entity
+
+
+class Adjacency:
+    """CSR adjacency of one relationship type: neighbours of node i are targets[offsets[i]:offsets[i + 1]]."""
+
+    __slots__ = ("offsets", "targets")
+
+    def __init__(self, sources: np.ndarray, targets: np.ndarray, node_count: int):
+        order = np.argsort(sources, kind="stable")
+        self.offsets = np.zeros(node_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=node_count), out=self.offsets[1:])
+        self.targets = targets[order].astype(np.int32)
+
+    def neighbours(self, node: int) -> np.ndarray:
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+
+class GraphIndex:
+    """Typed lookups over the exported graph."""
+
+    def __init__(self, nodes, relationships):
+        """Build the index from exported node rows and (type, source, target) relationship rows."""
+        self.nodes = NodeStore()
+        self.by_identifier = {label: {} for label in INDEXED_LABELS}
+        interned = {}
+
+        for row in nodes:
+            if row["label"] not in INDEXED_LABELS:
+                continue
+            keys = [normalize_identifier(key) for key in row["keys"] if key]
+            key = keys[0] if keys else row["name"]
+            node = interned[row["id"]] = self.nodes.add(row["label"], key, row["name"], row["price"])
+            lookup = self.by_identifier[row["label"]]
+            for identifier in keys or [normalize_identifier(row["name"] or "")]:
+                lookup.setdefault(identifier, []).append(node)
+
+        edges = {relationship_type: ([], []) for relationship_type in INDEXED_RELATIONSHIPS}
+        for row in relationships:
+            source, target = interned.get(row["source"]), interned.get(row["target"])
+            if source is None or target is None:
+                continue
+            sources, targets = edges[row["type"]]
+            sources.append(source)
+            targets.append(target)
+
+        node_count = len(self.nodes.keys)
+        self.adjacency = {}
+        for relationship_type, (sources, targets) in edges.items():
+            sources = np.array(sources, dtype=np.int64)
+            targets = np.array(targets, dtype=np.int64)
+            # Scrapers store compatibility in both directions, so index it as undirected
+            if relationship_type == "COMPATIBLE_WITH":
+                sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+            self.adjacency[relationship_type] = Adjacency(sources, targets, node_count)
+
+        self.symptom_nodes = [node for node in range(node_count) if self.nodes.label(node) == "Symptom"]
+
+    def find(self, label: str, identifier: str) -> list:
+        """Return the nodes with the given label whose part or model number matches `identifier`."""
+        return self.by_identifier[label].get(normalize_identifier(identifier), [])
+
+    def _neighbours(self, nodes, relationship_type: str, label: str) -> list:
+        found = {}
+        for node in nodes:
+            for neighbour in self.adjacency[relationship_type].neighbours(node).tolist():
+                if self.nodes.label(neighbour) == label:
+                    found.setdefault(neighbour, None)
+        return list(found)
+
+    def is_compatible(self, part_number: str, model_number: str):
+        """Return whether the part fits the model, or None when either is not in the graph."""
+        parts, models = self.find("Part", part_number), self.find("Model", model_number)
+        if not parts or not models:
+            return None
+        return bool(set(self._neighbours(parts, "COMPATIBLE_WITH", "Model")) & set(models))
+
+    def compatible_parts(self, model_number: str, limit: int = 25) -> list:
+        """Return the parts compatible with a model."""
+        parts = self._neighbours(self.find("Model", model_number), "COMPATIBLE_WITH", "Part")
+        return [self.nodes.describe(node) for node in parts[:limit]]
+
+    def compatible_models(self, part_number: str, limit: int = 25) -> list:
+        """Return the models a part is compatible with."""
+        models = self._neighbours(self.find("Part", part_number), "COMPATIBLE_WITH", "Model")
+        return [self.nodes.describe(node) for node in models[:limit]]
+
+    def symptoms(self, model_number: str) -> list:
+        """Return the symptoms recorded for a model."""
+        symptoms = self._neighbours(self.find("Model", model_number), "HAS_SYMPTOM", "Symptom")
+        return [self.nodes.describe(node) for node in symptoms]
+
+    def parts_for_symptom(self, symptom: str, model_number: str = None, limit: int = 25) -> list:
+        """Return the parts that fix a symptom, optionally only among the symptoms of one model."""
+        if model_number:
+            candidates = self._neighbours(self.find("Model", model_number), "HAS_SYMPTOM", "Symptom")
+        else:
+            candidates = self.symptom_nodes
+        matched = [node for node in candidates if matches_symptom(self.nodes.names[node], symptom)]
+        parts = self._neighbours(matched, "FIXED_BY", "Part")
+        return [self.nodes.describe(node) for node in parts[:limit]]
+
+    def lookup(self, text: str) -> list:
+        """Answer a free-text compatibility or symptom question with whatever identifiers it contains."""
+        identifiers = IDENTIFIER.findall(text)
+        parts = [identifier for identifier in identifiers if self.find("Part", identifier)]
+        models = [identifier for identifier in identifiers if self.find("Model", identifier)]
+        symptom = IDENTIFIER.sub("", text).strip(" ,.?")
+
+        results = []
+        for part in parts:
+            for model in models:
+                results.append({"type": "Compatibility", "part": part, "model": model, "compatible": self.is_compatible(part, model)})
+        if models and not parts:
+            for model in models:
+                fixes = self.parts_for_symptom(symptom, model) if symptom else []
+                results.extend(fixes or self.compatible_parts(model))
+        elif parts and not models:
+            for part in parts:
+                results.extend(self.compatible_models(part))
+        elif not identifiers and symptom:
+            results.extend(self.parts_for_symptom(symptom))
+        return results
+
+
+def export_graph(graph) -> tuple:
+    """Function to export the indexed nodes and relationships from Neo4j."""
+    return graph.query(EXPORT_NODES_QUERY), graph.query(EXPORT_RELATIONSHIPS_QUERY)
+
+
+class LiveGraphIndex:
+    """Keeps a `GraphIndex` in step with the graph data version.
+
+    The first lookup builds the index, and concurrent first lookups wait for that one export;
+    after a version change the index is rebuilt in a background thread while the previous
+    one keeps answering, so lookups never wait on Neo4j.
+    """
+
+    def __init__(self, graph, version_watcher):
+        self.graph = graph
+        self.version_watcher = version_watcher
+        self._lock = threading.Lock()
+        # Held by the thread doing the first build; the others wait for its index instead of exporting too
+        self._first_build = threading.Lock()
+        self._index = None
+        self._version = None
+        self._rebuilding = False
+
+    def _build(self, version):
+        nodes, relationships = export_graph(self.graph)
+        index = GraphIndex(nodes, relationships)
+        with self._lock:
+            self._index, self._version = index, version
+        metrics.increment("graph_index.rebuilt")
+        return index
+
+    def _rebuild_in_background(self, version):
+        try:
+            self._build(version)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Could not rebuild the graph index", extra={"error": str(e)})
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _first_build_in_background(self):
+        try:
+            with self._first_build:
+                if self._index is None:
+                    self._build(self.version_watcher.current())
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Could not build the graph index", extra={"error": str(e)})
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def warm_up(self):
+        """Start building the first index in a background thread, unless it exists or is being built."""
+        with self._lock:
+            if self._index is not None or self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._first_build_in_background, daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        """Whether an index has been built, so `get` will not block on an export."""
+        return self._index is not None
+
+    def get(self) -> GraphIndex:
+        """Return the current index, building it on first use and refreshing it when the graph changed."""
+        version = self.version_watcher.current()
+        with self._lock:
+            index, stale = self._index, self._version != version
+            if index is not None and stale and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_in_background, args=(version,), daemon=True).start()
+        if index is None:
+            with self._first_build:
+                index = self._index
+                if index is None:
+                    index = self._build(version)
+                else:
+                    metrics.increment("graph_index.first_build_waited")
+        return index
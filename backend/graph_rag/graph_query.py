@@ -1,12 +1,41 @@
 """Script to generate Cypher queries based on user input and query a Neo4j graph database."""
 
+import itertools
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from neo4j import Query
+from neo4j.graph import Node, Path, Relationship
 from openai import OpenAIError
 import sys
 import re
 sys.path.append('/Users/kohsheentiku/Desktop/Open-source/case-study/backend')
 
-from graph_rag.config import client, neo4j_graph
+from graph_rag import metrics
+from graph_rag.cancellation import CancelToken, cancel_scope, check_cancelled, current_token, submit_in_context
+from graph_rag.cascade import cascade_models, run_cascade
+from graph_rag.config import (
+    CASCADE_SMALL_MODEL,
+    CYPHER_CANDIDATES,
+    CYPHER_MAX_DB_HITS,
+    CYPHER_RACE_STRATEGY,
+    CYPHER_RACE_TIMEOUT,
+    CYPHER_ROW_LIMIT,
+    STREAM_FETCH_SIZE,
+    STREAM_MAX_ENTITIES,
+    STREAM_MAX_TOKENS,
+    client,
+    neo4j_graph,
+)
+from graph_rag.cypher_guard import CypherCostError, cached_plan, guard_query, prepare_query
+from graph_rag.singleflight import coalesce
+
+logger = logging.getLogger(__name__)
+
+# Candidate queries of concurrent races run here, leaving room for eight races at a time
+cypher_race_executor = ThreadPoolExecutor(max_workers=max(CYPHER_CANDIDATES, 1) * 8, thread_name_prefix="cypher-race")
 
 CYPHER_PROMPT = """
 You are an advanced assistant specializing in generating precise Cypher queries for a Neo4j graph database. Use `Question` and `Answer` and `Instruction` along with relationships as much as possible. These are the ONLY relationships and entities that exist, donthing else, you can make cypher queries using this only!The database consists of the following entities and relationships:
@@ -20,12 +49,9 @@ You are an advanced assistant specializing in generating precise Cypher queries
 
 2. Manufacturer(Properties: `name`)
 
-3.a   Model (Properties: `modelNum`, `name`, `brand`, `modelType`, `description`, `modelNumber`)
-3.b   Model (Properties: `description`,`modelNumber`, `brand`) - related to `instruction`
-3.c   Model ( Properties: `modelNum`, '`name`,'`modelType` )
-3.d   Model (Properties: `modelId`) - related to `symptom`
+3.   Model (Properties: `canonicalModelNumber`, `name`, `brand`, `modelType`, `description`)
 
-comment - modelId, modelNum, modelNumber are all the same!
+comment - every model is identified by `canonicalModelNumber`: the model number in uppercase with whitespace and punctuation removed (e.g. "wdt-780saem1" becomes "WDT780SAEM1"). Always match models on `canonicalModelNumber`, written in that form, never on `modelNum`, `modelNumber` or `modelId`.
 
 4. Review (Properties: `reviewerName`, `date`, `rating`, `title`, `reviewText`)
 
@@ -45,21 +71,25 @@ comment - modelId, modelNum, modelNumber are all the same!
 
 11. Section (Properties: `name`, `url`)
 
+12. PartDigest (Properties: `summary`, `difficulty`, `repairTime`, `reviewRating`, `topSymptoms`, `partSelectNumber`)
+   A precomputed digest of the reviews, repair stories and Q&A of one part: how hard and how long the repair is, the review rating, the symptoms it fixes and a short summary.
+
 
 **Relationships:**
 1. Part(1.a) - `MANUFACTURED_BY` -> Manufacturer
    Part (1.a)  - `HAS_REVIEW` -> Review 
-   Part(1.a) - `COMPATIBLE_WITH` -> Model(description,modelNumber, brand) (3.b)
+   Part(1.a) - `COMPATIBLE_WITH` -> Model
    Part (1.a) - `HAS_REPAIR_STORY` -> RepairStory 
    Part - `HAS_QUESTION` -> Question 
    Part(Properties: `partUrl`, `partName`) - `USED_IN` -> Instruction 
    Part(Properties: `partPrice`,`partNumber`,`fixPercentage`,`availability`,`partName`) <- `FIXED_BY` - Symptom 
+   Part(1.a) - `HAS_DIGEST` -> PartDigest
 
 2. Model
-   Model (Properties: `modelNum`, '`name`,'`modelType` ) - `HAS_SECTION` → Section
+   Model - `HAS_SECTION` → Section
    Model - `HAS_MANUAL` -> Manual
-   Model (Properties: `modelId`) - `HAS_SYMPTOM` -> Symptom
-   Model (Properties: `description`,`modelNumber`, `brand`) - `HAS_INSTRUCTION` -> Instruction
+   Model - `HAS_SYMPTOM` -> Symptom
+   Model - `HAS_INSTRUCTION` -> Instruction
 
 3. Review - `HAS_REVIEW` -> Part
 
@@ -87,7 +117,7 @@ comment - modelId, modelNum, modelNumber are all the same!
 
 
 
-2. **Detect Entity Filters**: Identify specific attributes (e.g., `partSelectNumber`, `manufacturerPartNumber`, `modelNumber`) and apply `WHERE` clauses to filter results. Sometimes the 'description' of the part contains the installation installation instructions, be sure to read fully.
+2. **Detect Entity Filters**: Identify specific attributes (e.g., `partSelectNumber`, `manufacturerPartNumber`, `canonicalModelNumber`) and apply `WHERE` clauses to filter results. Sometimes the 'description' of the part contains the installation installation instructions, be sure to read fully.
    - Example: "Find the part with manufacturerPartNumber 5304506533" should generate:
      `MATCH (p:Part {manufacturerPartNumber: '5304506533'}) RETURN p`
   - Example: "How can I install part number PS11752778?" should generate:
@@ -109,7 +139,7 @@ comment - modelId, modelNum, modelNumber are all the same!
 
 2. **Reflect Relationships**: If the user mentions relationships (e.g., "Find parts compatible with model M12345"), structure the query to match the relationship.
    - Example: "Find parts compatible with model M12345" should generate:
-     `MATCH (m:Model {modelNumber: 'M12345'})<-[:COMPATIBLE_WITH]-(p:Part) RETURN p`
+     `MATCH (m:Model {canonicalModelNumber: 'M12345'})-[:COMPATIBLE_WITH]-(p:Part) RETURN p`
 
 
 4. **Return Entity-Specific Fields**: If the user requests a specific field (e.g., "name"), return that field instead of the entire node.
@@ -118,7 +148,7 @@ comment - modelId, modelNum, modelNumber are all the same!
 
 5. **Return entity, relationship and entitity**
   - Example: Is this part, speaking about PS11752778 compatible with my 10640262010 model?
-  MATCH (p:Part {partSelectNumber: 'PS11752778'})-[r:COMPATIBLE_WITH]->(m:Model) where m.modelNumber='10640262010' RETURN p,r,m
+  MATCH (p:Part {partSelectNumber: 'PS11752778'})-[r:COMPATIBLE_WITH]-(m:Model {canonicalModelNumber: '10640262010'}) RETURN p,r,m
 
 6. be able to match with other attributes in the node and answer generic queries
     Example - "The ice maker on fridge is not working. How can I fix it?"
@@ -130,7 +160,7 @@ comment - modelId, modelNum, modelNumber are all the same!
     OPTIONAL MATCH (m)-[:HAS_INSTRUCTION]->(i:Instruction)
     WHERE i.description CONTAINS 'ice maker'
     OPTIONAL MATCH (m)-[:HAS_MANUAL]->(man:Manual)
-    OPTIONAL MATCH (m)<-[:COMPATIBLE_WITH]-(p:Part)
+    OPTIONAL MATCH (m)-[:COMPATIBLE_WITH]-(p:Part)
     OPTIONAL MATCH (p)-[:HAS_REVIEW]->(r:Review)
     WHERE r.reviewText CONTAINS 'ice maker'
     OPTIONAL MATCH (p)-[:HAS_QUESTION]->(q:Question)-[:HAS_ANSWER]->(a:Answer)
@@ -144,21 +174,24 @@ comment - modelId, modelNum, modelNumber are all the same!
     WITH m
     OPTIONAL MATCH (m)-[:HAS_INSTRUCTION]->(i:Instruction)
     WHERE i.title CONTAINS 'door seal' OR i.description CONTAINS 'door seal'
-    RETURN m.modelNumber, i.title, i.description
+    RETURN m.canonicalModelNumber, i.title, i.description
 
 8. example -"What are the most common issues with a Kenmore refrigerator?"
     MATCH (m:Model)
     WHERE m.brand = 'Kenmore' AND m.modelType = 'Refrigerator'
     WITH m
     OPTIONAL MATCH (m)-[:HAS_SYMPTOM]->(s:Symptom)
-    RETURN m.modelNumber, s.symptomName, COUNT(s.symptomName) AS frequency
+    RETURN m.canonicalModelNumber, s.name, COUNT(s.name) AS frequency
     ORDER BY frequency DESC
 
 9. example - "Can I find a review for part PS11752778?"
     MATCH (p:Part {partSelectNumber: 'PS11752778'})-[:HAS_REVIEW]->(r:Review)
     RETURN p, r
+9.b example - "Is part PS11752778 easy to install, and does it fix a leak?" - prefer the digest over individual reviews and repair stories
+    MATCH (p:Part {partSelectNumber: 'PS11752778'})-[:HAS_DIGEST]->(d:PartDigest)
+    RETURN p, d
 10. "Is this part  PS11752778 compatible with my WDT780SAEM1 model?"
-    MATCH p=(n:Part{partSelectNumber:'PS11752778'})-[x:COMPATIBLE_WITH]->(m:Model{modelNumber:"WDT780SAEM1"}) RETURN m
+    MATCH p=(n:Part{partSelectNumber:'PS11752778'})-[x:COMPATIBLE_WITH]-(m:Model{canonicalModelNumber:"WDT780SAEM1"}) RETURN m
 
 
 
@@ -175,7 +208,7 @@ comment - modelId, modelNum, modelNumber are all the same!
 Read description and understand
 
 **User Prompt**: "Find parts compatible with model M12345"
-- **Cypher Query**: `MATCH (m:Model {modelNumber: 'M12345'})<-[:COMPATIBLE_WITH]-(p:Part) RETURN p`
+- **Cypher Query**: `MATCH (m:Model {canonicalModelNumber: 'M12345'})-[:COMPATIBLE_WITH]-(p:Part) RETURN p`
 
 **User Prompt**: "Find the name of parts with manufacturerPartNumber 5304506533"
 - **Cypher Query**: `MATCH (p:Part {manufacturerPartNumber: '5304506533'}) RETURN p.name`
@@ -195,181 +228,400 @@ You are an advanced Neo4j Cypher and graph database expert. Your task is to vali
 Please respond with only the corrected or optimized Cypher query without any additional text. The output should be formatted as a complete and ready-to-execute query and after that complete following all the prompt instrcutions of confidence interval, dont just return and think job is done.
 """
 
+CYPHER_CANDIDATES_PROMPT = """
+
+Instead of a single query, write {count} alternative Cypher queries for the same question, each formulated differently:
+for example a direct property match, a relationship traversal and a case-insensitive text search (`toLower(...) CONTAINS`).
+Respond only with a JSON object of the form {{"queries": ["<first query>", "<second query>"]}}, without any other text.
+"""
+
+
+
+def strip_code_fences(query: str) -> str:
+    """Function to remove the ```cypher markdown fences the model sometimes wraps a query in."""
+    return re.sub(r"```(?:cypher)?", "", query).strip()
+
+
+def is_valid_cypher(query: str) -> bool:
+    """Function to check that Neo4j can plan a query, without running it."""
+    try:
+        # Plans the exact text `guard_query` checks next, so the guard reuses this EXPLAIN
+        cached_plan(neo4j_graph, prepare_query(query, CYPHER_ROW_LIMIT), params={"threshold": 0.7})
+        return True
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.info("Generated Cypher does not EXPLAIN", extra={"error": str(e)})
+        return False
 
 
 def generate_cypher_query(user_input: str, model: str = "gpt-4o"):
     """Function to generate a Cypher query based on user input using OpenAI's API."""
-    
-    try:
-        print(' in generate_cypher_query')
+
+    def complete(tier_model):
         response = client.chat.completions.create(
-            model=model,
+            model=tier_model,
             temperature=0,
             messages=[{"role": "system", "content": CYPHER_PROMPT}, {"role": "user", "content": user_input}],
         )
-        print("whats this response in generate_cypher_query ")
-        print(response)
+        logger.debug("Cypher generation response", extra={"payload": response})
+        return response.choices[0].message.content
 
-        cypher_query = response.choices[0].message.content
-        print(f"Generated Cypher Query: {cypher_query}")
+    try:
+        # The cheaper model's query is used whenever Neo4j can plan it
+        cypher_query = run_cascade(
+            "generate_cypher_query", cascade_models(CASCADE_SMALL_MODEL, model), complete, is_valid_cypher
+        )
+        logger.debug("Generated Cypher query", extra={"query": cypher_query})
 
     except OpenAIError as e:
-        print(f"An error occurred with the OpenAI API: {e}")
-        print('we are here!')
+        logger.error("OpenAI error while generating Cypher", extra={"error": str(e)})
         return user_input
     
-    return response.choices[0].message.content
+    return cypher_query
+
+
+def parse_cypher_candidates(text: str) -> list:
+    """Function to read the distinct queries of a `{"queries": [...]}` completion."""
+    try:
+        queries = json.loads(re.sub(r"```(?:json)?", "", text).strip())["queries"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return []
+    if not isinstance(queries, list):
+        return []
+    return list(dict.fromkeys(strip_code_fences(query) for query in queries if isinstance(query, str) and query.strip()))
+
+
+def generate_cypher_candidates(user_input: str, count: int, model: str = "gpt-4o") -> list:
+    """Function to generate up to `count` alternative Cypher queries for the user input in a single completion."""
+
+    def complete(tier_model):
+        response = client.chat.completions.create(
+            model=tier_model,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": CYPHER_PROMPT + CYPHER_CANDIDATES_PROMPT.format(count=count)},
+                {"role": "user", "content": user_input},
+            ],
+        )
+        return response.choices[0].message.content
+
+    def has_valid_query(output):
+        return any(is_valid_cypher(query) for query in parse_cypher_candidates(output))
+
+    try:
+        # The cheaper model's candidates are used whenever Neo4j can plan at least one of them
+        output = run_cascade(
+            "generate_cypher_candidates", cascade_models(CASCADE_SMALL_MODEL, model), complete, has_valid_query
+        )
+    except OpenAIError as e:
+        logger.error("OpenAI error while generating Cypher candidates", extra={"error": str(e)})
+        return []
+    candidates = parse_cypher_candidates(output)[:count]
+    logger.debug("Generated Cypher candidates", extra={"queries": candidates})
+    return candidates
 
 
 def correct_cypher_query(query: str, model: str = "gpt-4o") -> str:
    
     """Function to use OpenAI's API to correct a Cypher query if needed."""
-    try:
-        print('in correct_cypher_query')
+
+    def complete(tier_model):
         response = client.chat.completions.create(
-            model=model,
+            model=tier_model,
             temperature=0,
             messages=[{"role": "system", "content": ENHANCED_CYPHER_PROMPT}, {"role": "user", "content": query}]
         )
-
         # Extract and clean Cypher query using regular expressions to remove code block markers
-        corrected_query = response.choices[0].message.content.strip()
-        corrected_query = re.sub(r"```(?:cypher)?", "", corrected_query).strip()  # Remove ```cypher and ```
+        return strip_code_fences(response.choices[0].message.content.strip())
 
-        return corrected_query
+    try:
+        return run_cascade("correct_cypher_query", cascade_models(CASCADE_SMALL_MODEL, model), complete, is_valid_cypher)
 
     except OpenAIError as e:
-        print(f"An error occurred with the OpenAI API: {e}")
+        logger.error("OpenAI error while correcting Cypher", extra={"error": str(e)})
         return query
 
 
+def stream_graph(query: str, params: dict = None, timeout: float = None):
+    """Generator yielding driver records one by one as they are received.
+
+    Records are pulled from the server in batches of `STREAM_FETCH_SIZE`; closing the
+    generator early discards the remaining records and releases the server-side cursor,
+    which is also what happens when the request is cancelled between two records.
+    """
+    check_cancelled("neo4j_query")
+    with neo4j_graph._driver.session(  # pylint: disable=protected-access
+        database=neo4j_graph._database,  # pylint: disable=protected-access
+        fetch_size=STREAM_FETCH_SIZE,
+    ) as session:
+        # A caller's deadline can only shorten the configured transaction timeout
+        if timeout is None or (neo4j_graph.timeout and neo4j_graph.timeout < timeout):
+            timeout = neo4j_graph.timeout
+        result = session.run(Query(query, timeout=timeout), params or {})
+        try:
+            for record in result:
+                check_cancelled("neo4j_stream")
+                yield record
+        finally:
+            result.consume()
+
+
+def _run_candidate(token: CancelToken, query: str, threshold: float, deadline: float) -> list:
+    """Function to guard and run one candidate query under its own cancellation token."""
+    with cancel_scope(token):
+        guarded_query = guard_query(
+            neo4j_graph, query, params={"threshold": threshold}, row_limit=CYPHER_ROW_LIMIT, max_db_hits=CYPHER_MAX_DB_HITS
+        )
+        # The server stops the query at the race deadline as well
+        timeout = max(deadline - time.monotonic(), 0.1)
+        with closing(stream_graph(guarded_query, params={"threshold": threshold}, timeout=timeout)) as records:
+            return collect_matches(map_entities(records), STREAM_MAX_ENTITIES, STREAM_MAX_TOKENS)
+
+
+def race_cypher_queries(queries: list, threshold: float, timeout: float, strategy: str = "first") -> list:
+    """Function to run candidate queries concurrently within a shared timeout.
+
+    With the "first" strategy the first non-empty result wins; with "merge" the distinct
+    matches of every result that arrives in time are combined. Candidates still running
+    when the race ends are cancelled: queued ones never start, running ones stop reading
+    at their next record.
+    """
+    deadline = time.monotonic() + timeout
+    tokens = [CancelToken(parent=current_token()) for _ in queries]
+    futures = {
+        submit_in_context(cypher_race_executor, _run_candidate, token, query, threshold, deadline): index
+        for index, (token, query) in enumerate(zip(tokens, queries))
+    }
+    metrics.increment("cypher_race.runs")
+    results, errors = [], []
+    start = time.perf_counter()
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            try:
+                matches = future.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.info("Cypher candidate failed", extra={"candidate": futures[future], "error": str(e)})
+                errors.append(e)
+                continue
+            if not matches:
+                continue
+            if strategy == "first":
+                metrics.increment(f"cypher_race.winner.{futures[future]}")
+                return matches
+            results.append(matches)
+    except TimeoutError:
+        metrics.increment("cypher_race.timeout")
+    finally:
+        for token, future in zip(tokens, futures):
+            if not future.done():
+                token.cancel()
+                future.cancel()
+                metrics.increment("cypher_race.cancelled")
+        metrics.observe("cypher_race", time.perf_counter() - start)
+
+    if results:
+        return collect_matches(itertools.chain.from_iterable(results), STREAM_MAX_ENTITIES, STREAM_MAX_TOKENS)
+    metrics.increment("cypher_race.empty")
+    if errors and all(isinstance(e, CypherCostError) for e in errors):
+        return [{"error": f"{errors[0]}. Please make your request more specific, e.g. with a part or model number."}]
+    return []
+
+
+@coalesce("query_graph")
 def query_graph(user_input: str, threshold: float = 0.7):
     
     """Function to query the Neo4j graph database based on user input."""
-    print('in query graph')
-    query = generate_cypher_query(user_input)
-    print('this is the generated cypher query: ',query)
+    if CYPHER_CANDIDATES > 1:
+        # Alternative formulations race each other instead of retrying one query serially
+        candidates = generate_cypher_candidates(user_input, CYPHER_CANDIDATES)
+        if candidates:
+            result = race_cypher_queries(candidates, threshold, CYPHER_RACE_TIMEOUT, CYPHER_RACE_STRATEGY)
+            return result or [{"error": "We were unable to retrieve results for your query. Please refine your request."}]
 
+    query = generate_cypher_query(user_input)
     reviewed_query = correct_cypher_query(query)
-
-    print('this is the correct_cypher_query : ',reviewed_query)
+    logger.debug("Cypher query reviewed", extra={"generated": query, "reviewed": reviewed_query})
 
     attempt = 0
     max_retries = 3
     while attempt < max_retries:
         try:  
-            print("we are running the query in neo4j")
-            result = neo4j_graph.query(reviewed_query, params={"threshold": threshold})
+            # Check the plan first so one runaway query cannot tie up the database
+            guarded_query = guard_query(
+                neo4j_graph,
+                reviewed_query,
+                params={"threshold": threshold},
+                row_limit=CYPHER_ROW_LIMIT,
+                max_db_hits=CYPHER_MAX_DB_HITS,
+            )
+            # Stop reading as soon as the agent has enough; closing the stream discards the rest on the server
+            with closing(stream_graph(guarded_query, params={"threshold": threshold})) as records:
+                result = collect_matches(map_entities(records), STREAM_MAX_ENTITIES, STREAM_MAX_TOKENS)
             if result:
                 return result
             else:
-                print(f"Attempt {attempt + 1}: No results found, retrying...")
+                logger.info("No results found, retrying", extra={"attempt": attempt + 1})
+        except CypherCostError as e:
+            # Rerunning the same query would be rejected again
+            logger.warning("Cypher query rejected by the cost guard", extra={"error": str(e)})
+            return [{"error": f"{e}. Please make your request more specific, e.g. with a part or model number."}]
         except Exception as e:
-            print(f"An error occurred on attempt {attempt + 1}: {e}")
+            logger.warning("Graph query failed", extra={"attempt": attempt + 1, "error": str(e)})
         attempt += 1
 
     # If we reach here, retries were unsuccessful
     return [{"error": "We were unable to retrieve results for your query. Please refine your request."}]
 
 
+def map_entity(entity_data: dict) -> dict:
+    """Function to keep the schema fields of a returned node that are useful to the agent."""
+    match = {}
+    # Map the schema fields appropriately for Part
+    if "partSelectNumber" in entity_data:
+        match["partSelectNumber"] = entity_data["partSelectNumber"]
+    if "partName" in entity_data:
+        match["partName"] = entity_data["partName"]
+    if "manufacturerPartNumber" in entity_data:
+        match["manufacturerPartNumber"] = entity_data["manufacturerPartNumber"]
+    if "price" in entity_data:
+        match["price"] = entity_data["price"]
+    if "rating" in entity_data:
+        match["rating"] = entity_data["rating"]
+    if "reviewCount" in entity_data:
+        match["reviewCount"] = entity_data["reviewCount"]
+    if "description" in entity_data:
+        match["description"] = entity_data["description"]
+
+    # Map the schema fields appropriately for Manufacturer
+    if "manufacturer" in entity_data:
+        match["manufacturer"] = entity_data["manufacturer"]
+
+    # Map the schema fields appropriately for Model
+    if "canonicalModelNumber" in entity_data:
+        match["canonicalModelNumber"] = entity_data["canonicalModelNumber"]
+    if "modelNumber" in entity_data:
+        match["modelNumber"] = entity_data["modelNumber"]
+    if "brand" in entity_data:
+        match["brand"] = entity_data["brand"]
+    if "modelType" in entity_data:
+        match["modelType"] = entity_data["modelType"]
+    if "description" in entity_data:
+        match["description"] = entity_data["description"]
+
+    # Map the schema fields appropriately for Review
+    if "reviewerName" in entity_data:
+        match["reviewerName"] = entity_data["reviewerName"]
+    if "date" in entity_data:
+        match["date"] = entity_data["date"]
+    if "rating" in entity_data:
+        match["rating"] = entity_data["rating"]
+    if "title" in entity_data:
+        match["title"] = entity_data["title"]
+    if "reviewText" in entity_data:
+        match["reviewText"] = entity_data["reviewText"]
+
+    # Map the schema fields appropriately for Symptom
+    if "symptomName" in entity_data:
+        match["symptomName"] = entity_data["symptomName"]
+    if "fixPercentage" in entity_data:
+        match["fixPercentage"] = entity_data["fixPercentage"]
+    if "partNumber" in entity_data:
+        match["partNumber"] = entity_data["partNumber"]
+    if "partPrice" in entity_data:
+        match["partPrice"] = entity_data["partPrice"]
+    if "availability" in entity_data:
+        match["availability"] = entity_data["availability"]
+
+    # Map the schema fields appropriately for RepairStory
+    if "title" in entity_data:
+        match["title"] = entity_data["title"]
+    if "customer" in entity_data:
+        match["customer"] = entity_data["customer"]
+    if "instruction" in entity_data:
+        match["instruction"] = entity_data["instruction"]
+    if "difficulty" in entity_data:
+        match["difficulty"] = entity_data["difficulty"]
+    if "time" in entity_data:
+        match["time"] = entity_data["time"]
+    if "helpfulness" in entity_data:
+        match["helpfulness"] = entity_data["helpfulness"]
+
+    # Map the schema fields appropriately for Question and Answer
+    if "question" in entity_data:
+        match["question"] = entity_data["question"]
+    if "questionDate" in entity_data:
+        match["questionDate"] = entity_data["questionDate"]
+    if "helpfulness" in entity_data:
+        match["helpfulness"] = entity_data["helpfulness"]
+    if "modelNumber" in entity_data:
+        match["modelNumber"] = entity_data["modelNumber"]
+
+    if "answer" in entity_data:
+        match["answer"] = entity_data["answer"]
+
+    # Map the schema fields appropriately for PartDigest
+    if "summary" in entity_data:
+        match["summary"] = entity_data["summary"]
+    if "repairTime" in entity_data:
+        match["repairTime"] = entity_data["repairTime"]
+    if "reviewRating" in entity_data:
+        match["reviewRating"] = entity_data["reviewRating"]
+    if "topSymptoms" in entity_data:
+        match["topSymptoms"] = entity_data["topSymptoms"]
+
+    return match
+
+
+def map_entities(records):
+    """Generator mapping every node or value of every record to a match, lazily."""
+    for record in records:
+        for column, value in record.items():
+            pending = [value]
+            while pending:
+                value = pending.pop(0)
+                if not value or isinstance(value, Relationship):
+                    continue
+                if isinstance(value, Path):
+                    pending.extend(value.nodes)
+                elif isinstance(value, list):
+                    pending.extend(value)
+                elif isinstance(value, Node):
+                    match = map_entity(dict(value))
+                    if match:
+                        # Keep the label so results can be grouped by entity type
+                        yield {"type": next(iter(value.labels), column), **match}
+                elif isinstance(value, dict):
+                    yield map_entity(value)
+                else:
+                    # Projected properties such as `RETURN p.partName` come back as plain values
+                    yield {column: value}
+
+
+def collect_matches(matches, max_entities: int, max_tokens: int) -> list:
+    """Function to take distinct matches until `max_entities` or roughly `max_tokens` are collected."""
+    collected = []
+    seen = set()
+    tokens = 0
+    for match in matches:
+        if not match:
+            continue
+        key = repr(sorted(match.items()))
+        if key in seen:
+            continue
+        seen.add(key)
+        collected.append(match)
+        # Roughly four characters per token, which is all the prompt budget needs
+        tokens += len(key) // 4
+        if len(collected) >= max_entities or tokens >= max_tokens:
+            metrics.increment("query_graph.stream_truncated")
+            break
+    return collected
+
+
 def query_db(query: str) -> list:
     """Function to query the Neo4j graph database based on user input."""
-    print("in query db")
-    matches = []
-    # Update the Cypher query as per your schema
-    result = query_graph(query)
-    print(result)
-
-    for r in result:
-        for _, value in r.items():
-            entity_data = value
-            if not entity_data:
-                continue
-            match = {}
-            # Map the schema fields appropriately for Part
-            if "partSelectNumber" in entity_data:
-                match["partSelectNumber"] = entity_data["partSelectNumber"]
-            if "partName" in entity_data:
-                match["partName"] = entity_data["partName"]
-            if "manufacturerPartNumber" in entity_data:
-                match["manufacturerPartNumber"] = entity_data["manufacturerPartNumber"]
-            if "price" in entity_data:
-                match["price"] = entity_data["price"]
-            if "rating" in entity_data:
-                match["rating"] = entity_data["rating"]
-            if "reviewCount" in entity_data:
-                match["reviewCount"] = entity_data["reviewCount"]
-            if "description" in entity_data:
-                match["description"] = entity_data["description"]
-
-            # Map the schema fields appropriately for Manufacturer
-            if "manufacturer" in entity_data:
-                match["manufacturer"] = entity_data["manufacturer"]
-
-            # Map the schema fields appropriately for Model
-            if "modelNumber" in entity_data:
-                match["modelNumber"] = entity_data["modelNumber"]
-            if "brand" in entity_data:
-                match["brand"] = entity_data["brand"]
-            if "modelType" in entity_data:
-                match["modelType"] = entity_data["modelType"]
-            if "description" in entity_data:
-                match["description"] = entity_data["description"]
-
-            # Map the schema fields appropriately for Review
-            if "reviewerName" in entity_data:
-                match["reviewerName"] = entity_data["reviewerName"]
-            if "date" in entity_data:
-                match["date"] = entity_data["date"]
-            if "rating" in entity_data:
-                match["rating"] = entity_data["rating"]
-            if "title" in entity_data:
-                match["title"] = entity_data["title"]
-            if "reviewText" in entity_data:
-                match["reviewText"] = entity_data["reviewText"]
-
-            # Map the schema fields appropriately for Symptom
-            if "symptomName" in entity_data:
-                match["symptomName"] = entity_data["symptomName"]
-            if "fixPercentage" in entity_data:
-                match["fixPercentage"] = entity_data["fixPercentage"]
-            if "partNumber" in entity_data:
-                match["partNumber"] = entity_data["partNumber"]
-            if "partPrice" in entity_data:
-                match["partPrice"] = entity_data["partPrice"]
-            if "availability" in entity_data:
-                match["availability"] = entity_data["availability"]
-
-            # Map the schema fields appropriately for RepairStory
-            if "title" in entity_data:
-                match["title"] = entity_data["title"]
-            if "customer" in entity_data:
-                match["customer"] = entity_data["customer"]
-            if "instruction" in entity_data:
-                match["instruction"] = entity_data["instruction"]
-            if "difficulty" in entity_data:
-                match["difficulty"] = entity_data["difficulty"]
-            if "time" in entity_data:
-                match["time"] = entity_data["time"]
-            if "helpfulness" in entity_data:
-                match["helpfulness"] = entity_data["helpfulness"]
-
-            # Map the schema fields appropriately for Question and Answer
-            if "question" in entity_data:
-                match["question"] = entity_data["question"]
-            if "questionDate" in entity_data:
-                match["questionDate"] = entity_data["questionDate"]
-            if "helpfulness" in entity_data:
-                match["helpfulness"] = entity_data["helpfulness"]
-            if "modelNumber" in entity_data:
-                match["modelNumber"] = entity_data["modelNumber"]
-
-            if "answer" in entity_data:
-                match["answer"] = entity_data["answer"]
-
-            # Add the match to the list
-            matches.append(match)
-    
+    # query_graph already streams, maps and bounds the records
+    matches = query_graph(query)
+    logger.debug("Graph query results", extra={"count": len(matches), "payload": matches})
     return matches
 
 
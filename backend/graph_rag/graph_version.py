@@ -0,0 +1,64 @@
+"""Graph data-version counter used to invalidate everything derived from the graph."""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# A single `GraphMeta` node holds the counter; ingestion and index builds bump it (and create it)
+READ_VERSION_QUERY = """
+OPTIONAL MATCH (v:GraphMeta {name: 'dataVersion'})
+RETURN coalesce(v.version, 0) AS version
+"""
+
+BUMP_VERSION_QUERY = """
+MERGE (v:GraphMeta {name: 'dataVersion'})
+SET v.version = coalesce(v.version, 0) + 1
+RETURN v.version AS version
+"""
+
+
+def read_version(graph) -> int:
+    """Function to read the current graph data version."""
+    return graph.query(READ_VERSION_QUERY)[0]["version"]
+
+
+def bump_version(graph) -> int:
+    """Function to increment the graph data version after the graph data changed."""
+    return graph.query(BUMP_VERSION_QUERY)[0]["version"]
+
+
+class VersionWatcher:
+    """Caches the graph data version, re-reading it at most every `poll_interval` seconds."""
+
+    def __init__(self, graph, poll_interval: float = 5.0):
+        self.graph = graph
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def current(self) -> int:
+        """Return the graph data version, refreshing it when the cached value is too old.
+
+        One caller refreshes, outside the lock; the others keep getting the cached version
+        meanwhile, so no request waits on the Neo4j round trip once a version is known.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._version is not None and now - self._checked_at < self.poll_interval:
+                return self._version
+            # Claim the refresh: until it is done, concurrent callers get the cached version
+            self._checked_at = now
+            cached = self._version
+
+        try:
+            version = read_version(self.graph)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Keep serving the last known version while Neo4j is unreachable
+            logger.warning("Could not read the graph data version", extra={"error": str(e)})
+            version = -1 if cached is None else cached
+        with self._lock:
+            self._version = version
+            return version
@@ -0,0 +1,120 @@
+"""Structured, non-blocking logging for the request path.
+
+`configure_logging` puts a queue handler on the root logger: a request thread only
+decides whether to keep a record (level, then sampling) and puts it on a bounded queue.
+Formatting (one JSON object per line, every field capped at `max_payload` characters) and
+the write to stdout happen in the listener's background thread. When the queue is full
+records are dropped and counted instead of blocking the request.
+
+Large objects go in `extra` rather than in the message, so they are only rendered when the
+record is written:
+
+    logger.debug("Neo4j results", extra={"payload": matches, "count": len(matches)})
+"""
+
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from graph_rag import metrics
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Client libraries that log every HTTP request or query at INFO; they only log warnings unless debugging
+QUIET_LOGGERS = ("httpx", "httpcore", "openai", "neo4j", "urllib3")
+
+_listener = None
+
+
+def cap(text: str, limit: int) -> str:
+    """Function to shorten a text to `limit` characters, saying how much was cut."""
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} more chars]"
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the `extra` fields and every field capped in size."""
+
+    def __init__(self, max_payload: int):
+        super().__init__()
+        self.max_payload = max_payload
+
+    def _field(self, value):
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        text = value if isinstance(value, str) else json.dumps(value, default=str, ensure_ascii=False)
+        return cap(text, self.max_payload)
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": cap(record.getMessage(), self.max_payload),
+        }
+        entry.update({key: self._field(value) for key, value in vars(record).items() if key not in _STANDARD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = cap(self.formatException(record.exc_info), self.max_payload * 4)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the records of the chatty levels; warnings and errors are always kept."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        metrics.increment("logging.sampled_out")
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that never formats on the calling thread and drops records when the queue is full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting (and rendering payloads) is left to the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("logging.dropped")
+
+
+def configure_logging(level: str = "INFO", max_payload: int = 2000, debug_sample_rate: float = 1.0,
+                      info_sample_rate: float = 1.0, queue_size: int = 10000):
+    """Function to route every log record through a bounded queue to a JSON handler on a background thread."""
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter(max_payload))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(SamplingFilter({logging.DEBUG: debug_sample_rate, logging.INFO: info_sample_rate}))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level.upper())
+    if root.level > logging.DEBUG:
+        for name in QUIET_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # Write out what is still queued when the process exits
+    atexit.register(_listener.stop)
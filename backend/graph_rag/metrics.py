@@ -0,0 +1,44 @@
+"""In-process counters and timings for the GraphRAG pipeline."""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def increment(name: str, value: int = 1):
+    """Function to add `value` to the counter called `name`."""
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float):
+    """Function to record one duration sample (in seconds) under `name`."""
+    with _lock:
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = {"count": 0, "total": 0.0, "max": 0.0}
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+
+def snapshot() -> dict:
+    """Function to return a copy of every counter and timing recorded so far."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {
+                name: {**timing, "mean": timing["total"] / timing["count"]}
+                for name, timing in _timings.items()
+            },
+        }
+
+
+def reset():
+    """Function to clear all counters and timings."""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
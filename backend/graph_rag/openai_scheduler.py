@@ -0,0 +1,417 @@
+"""Process-wide scheduler for OpenAI API requests.
+
+Every request made through an HTTP client from `scheduled_http_client` waits for:
+- its turn in a priority queue ("interactive" requests always go before "batch" ones),
+- a free slot under the total and per-class concurrency caps,
+- room in the requests-per-minute and tokens-per-minute token buckets,
+- the end of any backoff pause after a 429.
+
+Rate-limit headers of every response keep the buckets in step with the server's view of
+the limits, and a 429 pauses all requests for the time the server asks for (doubling on
+consecutive 429s without a hint). Both the `openai` client and `ChatOpenAI` accept such an HTTP client.
+
+With a `SharedBudget` the buckets and the 429 pause live in a SQLite file instead, so the
+server and the batch jobs (vector_indexes.py, part_digests.py, embedding_benchmark.py)
+running on the same host draw from one RPM/TPM budget. Batch requests leave a reserve of
+that budget to interactive ones.
+"""
+
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+from openai import DefaultHttpxClient
+
+from graph_rag import metrics
+from graph_rag.cancellation import check_cancelled, is_cancelled
+
+PRIORITIES = ("interactive", "batch")
+
+# Longest a queued request sleeps before checking whether its request has been cancelled
+CANCEL_POLL_INTERVAL = 0.25
+
+_priority = contextvars.ContextVar("openai_priority", default=None)
+
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+@contextmanager
+def priority(name: str):
+    """Run the OpenAI requests made inside the block with the given priority class."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority {name!r}, expected one of {PRIORITIES}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def parse_duration(value: str) -> float:
+    """Function to parse a rate-limit reset such as "1s", "6m0s" or "20ms" into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION.findall(value))
+
+
+def estimate_request_tokens(body: bytes) -> int:
+    """Function to estimate the tokens a chat-completions or embeddings request counts against the TPM limit."""
+    try:
+        payload = json.loads(body or b"{}")
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return 1
+    if "messages" in payload:
+        prompt = sum(len(str(message.get("content", ""))) for message in payload["messages"]) // 4
+        return prompt + int(payload.get("max_tokens") or 256)
+    inputs = payload.get("input", "")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    return max(sum(len(str(text)) for text in inputs) // 4, 1)
+
+
+class TokenBucket:
+    """Bucket refilled continuously at `per_minute` units per minute, holding at most a minute's worth."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (requests larger than the bucket wait for a full one)."""
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0) * 60 / self.capacity
+
+
+class SharedBudget:
+    """Requests-per-minute and tokens-per-minute buckets and the 429 pause, stored in a SQLite file.
+
+    Every process opening the same file shares them. Batch requests only take from a bucket
+    while it holds more than `batch_reserve` of its capacity, so interactive requests of
+    other processes keep some headroom.
+    """
+
+    def __init__(self, path: str, requests_per_minute: float, tokens_per_minute: float, batch_reserve: float = 0.2):
+        self.capacity = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.batch_reserve = batch_reserve
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS budget (name TEXT PRIMARY KEY, level REAL, updated REAL)")
+
+    def _levels(self, now: float) -> dict:
+        """Bucket levels refilled up to `now` (and the pause end); must run inside a transaction."""
+        stored = {name: (level, updated) for name, level, updated in self._db.execute("SELECT name, level, updated FROM budget")}
+        levels = {"paused_until": stored.get("paused_until", (0.0, now))[0]}
+        for name, capacity in self.capacity.items():
+            level, updated = stored.get(name, (capacity, now))
+            levels[name] = min(capacity, level + max(now - updated, 0) * capacity / 60)
+        return levels
+
+    def _store(self, levels: dict, now: float):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO budget (name, level, updated) VALUES (?, ?, ?)",
+            [(name, level, now) for name, level in levels.items()],
+        )
+
+    def take(self, tokens: int, name: str) -> float:
+        """Take one request and `tokens` tokens when available and return 0, or return the seconds to wait."""
+        now = time.time()
+        reserve = self.batch_reserve if name == "batch" else 0.0
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                levels = self._levels(now)
+                needed = {"requests": 1, "tokens": tokens}
+                wait = max(
+                    [levels["paused_until"] - now]
+                    + [
+                        (min(needed[bucket], capacity) + reserve * capacity - levels[bucket]) * 60 / capacity
+                        for bucket, capacity in self.capacity.items()
+                    ]
+                )
+                if wait <= 0:
+                    for bucket, capacity in self.capacity.items():
+                        levels[bucket] -= min(needed[bucket], capacity)
+                    self._store(levels, now)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return max(wait, 0.0)
+
+    def observe(self, remaining_requests=None, remaining_tokens=None, paused_until: float = None):
+        """Lower the buckets to the server's remaining counts and extend the pause after a 429."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                levels = self._levels(now)
+                if remaining_requests is not None:
+                    levels["requests"] = min(levels["requests"], float(remaining_requests))
+                if remaining_tokens is not None:
+                    levels["tokens"] = min(levels["tokens"], float(remaining_tokens))
+                if paused_until is not None:
+                    levels["paused_until"] = max(levels["paused_until"], paused_until)
+                self._store(levels, now)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            levels = self._levels(now)
+        return {
+            "requests_available": round(levels["requests"], 1),
+            "tokens_available": round(levels["tokens"]),
+            "paused_for": round(max(levels["paused_until"] - now, 0), 3),
+        }
+
+
+class OpenAIScheduler:
+    """Priority queue, concurrency caps, token buckets and 429 backoff shared by all OpenAI requests."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = 5_000,
+        tokens_per_minute: float = 800_000,
+        max_concurrency: int = 16,
+        batch_max_concurrency: int = 4,
+        default_priority: str = "interactive",
+        budget: SharedBudget = None,
+    ):
+        self.budget = budget
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.total_concurrency = max_concurrency
+        self.max_concurrency = {"interactive": max_concurrency, "batch": min(batch_max_concurrency, max_concurrency)}
+        self.default_priority = default_priority
+        self._condition = threading.Condition()
+        self._queue = []
+        # Queued entry taking its share of the shared budget, outside the condition
+        self._taking = None
+        self._sequence = itertools.count()
+        self._running = {name: 0 for name in PRIORITIES}
+        self._paused_until = 0.0
+        self._backoff = 1.0
+
+    @classmethod
+    def from_env(cls, default_priority: str = "interactive") -> "OpenAIScheduler":
+        """Function to build a scheduler from the OPENAI_RPM, OPENAI_TPM, concurrency and budget environment variables.
+
+        The RPM/TPM budget is shared with every process given the same OPENAI_BUDGET_PATH
+        (a SQLite file); without it this process keeps a budget of its own.
+        """
+        requests_per_minute = float(os.environ.get("OPENAI_RPM", 5_000))
+        tokens_per_minute = float(os.environ.get("OPENAI_TPM", 800_000))
+        budget_path = os.environ.get("OPENAI_BUDGET_PATH")
+        budget = None
+        if budget_path:
+            budget = SharedBudget(
+                budget_path,
+                requests_per_minute,
+                tokens_per_minute,
+                batch_reserve=float(os.environ.get("OPENAI_BATCH_RESERVE", 0.2)),
+            )
+        return cls(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_concurrency=int(os.environ.get("OPENAI_MAX_CONCURRENCY", 16)),
+            batch_max_concurrency=int(os.environ.get("OPENAI_BATCH_MAX_CONCURRENCY", 4)),
+            default_priority=default_priority,
+            budget=budget,
+        )
+
+    def _ready_in(self, entry, tokens: int, now: float):
+        """Seconds until the queued entry may start (0 when it may start now), or None to wait for a release.
+
+        With a shared budget, 0 means the entry may take its share of the budget.
+        """
+        if self._queue[0] is not entry or self._taking is not None:
+            return None
+        name = entry[2]
+        if sum(self._running.values()) >= self.total_concurrency or self._running[name] >= self.max_concurrency[name]:
+            return None
+        if self.budget is not None:
+            return max(self._paused_until - now, 0)
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self._paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def _take_budget(self, entry, tokens: int, name: str) -> float:
+        """Take the entry's share of the shared budget, or return the seconds to wait for it.
+
+        Called holding the condition, which is released during the SQLite transaction (it may wait
+        for a batch job's write lock), so other requests can still be queued and released meanwhile.
+        No other entry may start until the share is taken.
+        """
+        self._taking = entry
+        self._condition.release()
+        try:
+            return self.budget.take(tokens, name)
+        finally:
+            self._condition.acquire()
+            self._taking = None
+            self._condition.notify_all()
+
+    def acquire(self, tokens: int, name: str = None) -> str:
+        """Block until a request estimated at `tokens` tokens may be sent; returns its priority class."""
+        name = name or _priority.get() or self.default_priority
+        entry = (PRIORITIES.index(name), next(self._sequence), name)
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    wait = self._ready_in(entry, tokens, time.monotonic())
+                    if wait == 0 and self.budget is not None:
+                        # The shared budget deducts the request itself when it may start
+                        wait = self._take_budget(entry, tokens, name)
+                    if wait == 0:
+                        break
+                    check_cancelled("openai_queue")
+                    self._condition.wait(timeout=CANCEL_POLL_INTERVAL if wait is None else min(wait, CANCEL_POLL_INTERVAL))
+            finally:
+                # Leave the queue, started or cancelled, so the requests behind this one are not held up;
+                # entries of a higher priority may have been queued ahead of it while it took its budget
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+            if self.budget is None:
+                self.requests.level -= 1
+                self.tokens.level -= min(tokens, self.tokens.capacity)
+            self._running[name] += 1
+        metrics.observe(f"openai_scheduler.queue_wait.{name}", time.monotonic() - start)
+        metrics.increment(f"openai_scheduler.requests.{name}")
+        return name
+
+    def release(self, name: str):
+        """Free the concurrency slot of a finished request."""
+        with self._condition:
+            self._running[name] -= 1
+            self._condition.notify_all()
+
+    def observe(self, status_code: int, headers):
+        """Adapt to the rate-limit headers of a response and pause everything after a 429."""
+        now = time.monotonic()
+        with self._condition:
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            # The server knows about traffic from other processes sharing the key
+            if remaining_requests is not None:
+                self.requests.level = min(self.requests.level, float(remaining_requests))
+            if remaining_tokens is not None:
+                self.tokens.level = min(self.tokens.level, float(remaining_tokens))
+
+            if status_code == 429:
+                # Wait as long as the server asks; without a hint, back off exponentially
+                hint = max(
+                    parse_duration(headers.get("retry-after")),
+                    parse_duration(headers.get("x-ratelimit-reset-requests")) if remaining_requests == "0" else 0,
+                    parse_duration(headers.get("x-ratelimit-reset-tokens")) if remaining_tokens == "0" else 0,
+                )
+                self._paused_until = max(self._paused_until, now + (hint or self._backoff))
+                self._backoff = min(self._backoff * 2, 60)
+                metrics.increment("openai_scheduler.rate_limited")
+            elif status_code < 400:
+                self._backoff = 1.0
+            self._condition.notify_all()
+        if self.budget is not None:
+            # Other processes pause too, for as long as this one does (in wall-clock time)
+            paused_until = time.time() + self._paused_until - now if status_code == 429 else None
+            self.budget.observe(remaining_requests, remaining_tokens, paused_until)
+
+    def stats(self) -> dict:
+        """Function to return the current queue length, running requests and bucket levels."""
+        with self._condition:
+            stats = {
+                "queued": len(self._queue),
+                "running": dict(self._running),
+                "requests_available": round(self.requests.level, 1),
+                "tokens_available": round(self.tokens.level),
+                "paused_for": round(max(self._paused_until - time.monotonic(), 0), 3),
+            }
+        if self.budget is not None:
+            stats.update(self.budget.stats(), shared_budget=True)
+        return stats
+
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees the scheduler slot once it has been read or closed.
+
+    A streamed completion of a cancelled request stops between chunks; closing the body
+    then drops the connection instead of reading the rest of the completion.
+    """
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        for chunk in self._stream:
+            check_cancelled("openai_stream")
+            yield chunk
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """HTTP transport sending every request through an `OpenAIScheduler`."""
+
+    def __init__(self, scheduler: OpenAIScheduler, transport: httpx.BaseTransport = None):
+        self.scheduler = scheduler
+        self._transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        check_cancelled("openai_request")
+        name = self.scheduler.acquire(estimate_request_tokens(request.read()))
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self.scheduler.release(name)
+
+        try:
+            response = self._transport.handle_request(request)
+        except Exception:
+            release()
+            raise
+        self.scheduler.observe(response.status_code, response.headers)
+        # The slot stays taken while a (possibly streamed) body is still being received
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),
+            extensions=response.extensions,
+        )
+
+    def close(self):
+        self._transport.close()
+
+
+def scheduled_http_client(scheduler: OpenAIScheduler) -> httpx.Client:
+    """Function to build an HTTP client for `OpenAI(http_client=...)` and `ChatOpenAI(http_client=...)`."""
+    return DefaultHttpxClient(transport=ScheduledTransport(scheduler))
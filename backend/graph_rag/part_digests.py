@@ -0,0 +1,205 @@
+"""Precomputed per-part digests of reviews, repair stories and Q&A.
+
+Run after ingestion: every Part gets a `PartDigest` node (`(:Part)-[:HAS_DIGEST]->(:PartDigest)`)
+holding its repair difficulty and time distributions, review rating stats, the symptoms it
+fixes (ranked by how often the stories and reviews mention them) and a short LLM summary of
+the reviews and Q&A. Only parts whose reviews, stories or questions changed since their
+digest was written are recomputed. The retrieval tools attach the digest to every part they
+return, so the agent rarely needs the individual reviews.
+"""
+
+import os
+import argparse
+import logging
+import re
+import time
+from collections import Counter
+
+from langchain_community.graphs import Neo4jGraph
+from openai import OpenAI, OpenAIError
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+from graph_rag.graph_index import matches_symptom
+from graph_rag.graph_version import bump_version
+from graph_rag.openai_scheduler import OpenAIScheduler, scheduled_http_client
+
+load_dotenv()
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Parts whose sources changed since their digest was written (the counts act as the signature)
+STALE_PARTS_QUERY = """
+MATCH (p:Part) WHERE p.partSelectNumber IS NOT NULL
+OPTIONAL MATCH (p)-[:HAS_DIGEST]->(d:PartDigest)
+WITH p, d,
+     toString(COUNT { (p)-[:HAS_REVIEW]->() }) + ':' + toString(COUNT { (p)-[:HAS_REPAIR_STORY]->() }) + ':' +
+     toString(COUNT { (p)-[:HAS_QUESTION]->() }) + ':' + toString(COUNT { ()-[:FIXED_BY]->(p) }) AS signature
+WHERE $force OR d IS NULL OR d.sourceSignature <> signature
+RETURN elementId(p) AS id, p.partSelectNumber AS partSelectNumber, p.partName AS partName, signature
+"""
+
+PART_SOURCES_QUERY = """
+MATCH (p:Part) WHERE elementId(p) = $id
+RETURN [(p)-[:HAS_REVIEW]->(r:Review) | r {.rating, .title, .reviewText}] AS reviews,
+       [(p)-[:HAS_REPAIR_STORY]->(s:RepairStory) | s {.title, .instruction, .difficulty, .time}] AS stories,
+       [(p)-[:HAS_QUESTION]->(q:Question) | q {.question, answers: [(q)-[:HAS_ANSWER]->(a:Answer) | a.answer]}] AS questions,
+       [(s:Symptom)-[:FIXED_BY]->(p) | s.name] AS symptoms
+"""
+
+WRITE_DIGEST_QUERY = """
+MATCH (p:Part) WHERE elementId(p) = $id
+MERGE (p)-[:HAS_DIGEST]->(d:PartDigest)
+SET d += $digest
+"""
+
+# Digest fields the retrieval tools attach to a part
+DIGEST_FIELDS = ("summary", "difficulty", "repairTime", "reviewRating", "topSymptoms")
+
+PART_DIGESTS_QUERY = """
+MATCH (p:Part)-[:HAS_DIGEST]->(d:PartDigest)
+WHERE p.partSelectNumber IN $numbers
+RETURN p.partSelectNumber AS partSelectNumber, d {.*} AS digest
+"""
+
+SUMMARY_PROMPT = """
+You summarize customer feedback about one appliance part for a parts assistant. From the reviews, repair stories
+and questions with answers below, write at most three short sentences: how hard it is to install and what tools or
+steps matter, which problems it fixed, and any recurring caveat. Only use what the text says.
+"""
+
+PERCENT = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+
+
+def configure_logger(verbose):
+    """Configure logger level based on verbosity"""
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+
+def distribution(values) -> str:
+    """Function to render the counts of values, most common first, e.g. "Very Easy: 12, Easy: 3"."""
+    return ", ".join(f"{value}: {count}" for value, count in Counter(v for v in values if v).most_common())
+
+
+def rating_stats(reviews: list) -> str:
+    """Function to summarize review ratings ("100%", "80%") as the mean and the number of rated reviews."""
+    ratings = [float(match.group(1)) for review in reviews if (match := PERCENT.search(str(review.get("rating") or "")))]
+    if not ratings:
+        return ""
+    return f"{sum(ratings) / len(ratings):.0f}% average over {len(ratings)} reviews"
+
+
+def top_symptoms(symptoms: list, texts: list, limit: int = 5) -> list:
+    """Function to rank the symptoms a part fixes by how many stories and reviews mention them."""
+    mentions = {name: sum(matches_symptom(name, text) for text in texts) for name in set(symptoms) if name}
+    return sorted(mentions, key=lambda name: (-mentions[name], name))[:limit]
+
+
+def source_text(part_name: str, sources: dict, max_chars: int = 12000) -> str:
+    """Function to lay out the reviews, repair stories and Q&A of a part for the summary prompt."""
+    lines = [f"Part: {part_name}"]
+    lines += [f"Review ({review.get('rating')}): {review.get('title')} - {review.get('reviewText')}" for review in sources["reviews"]]
+    lines += [
+        f"Repair story ({story.get('difficulty')}, {story.get('time')}): {story.get('title')} - {story.get('instruction')}"
+        for story in sources["stories"]
+    ]
+    lines += [f"Q: {question.get('question')} A: {' / '.join(question.get('answers') or [])}" for question in sources["questions"]]
+    return "\n".join(lines)[:max_chars]
+
+
+def summarize(client, model: str, text: str) -> str:
+    """Function to write the LLM summary of a part's feedback."""
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            temperature=0,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": text}],
+        )
+        return response.choices[0].message.content.strip()
+    except OpenAIError as e:
+        logger.error(f"Could not summarize the feedback: {e}")
+        return ""
+
+
+def build_digest(part: dict, sources: dict, client, model: str) -> dict:
+    """Function to compute the digest properties of one part."""
+    texts = [f"{story.get('title')} {story.get('instruction')}" for story in sources["stories"]]
+    texts += [f"{review.get('title')} {review.get('reviewText')}" for review in sources["reviews"]]
+    has_feedback = sources["reviews"] or sources["stories"] or sources["questions"]
+    return {
+        "partSelectNumber": part["partSelectNumber"],
+        "difficulty": distribution(story.get("difficulty") for story in sources["stories"]),
+        "repairTime": distribution(story.get("time") for story in sources["stories"]),
+        "reviewRating": rating_stats(sources["reviews"]),
+        "topSymptoms": top_symptoms(sources["symptoms"], texts),
+        "summary": summarize(client, model, source_text(part["partName"], sources)) if has_feedback else "",
+        "sourceSignature": part["signature"],
+        "updatedAt": time.time(),
+    }
+
+
+def update_digests(graph, client, model: str, force: bool = False) -> int:
+    """Function to (re)compute the digests of the parts whose sources changed; returns how many were written."""
+    stale = graph.query(STALE_PARTS_QUERY, params={"force": force})
+    logger.info(f"{len(stale)} part digests to update")
+    for part in tqdm(stale, desc="Digesting parts"):
+        sources = graph.query(PART_SOURCES_QUERY, params={"id": part["id"]})[0]
+        graph.query(WRITE_DIGEST_QUERY, params={"id": part["id"], "digest": build_digest(part, sources, client, model)})
+        logger.debug(f"Digest written for {part['partSelectNumber']}")
+    if stale:
+        bump_version(graph)
+    return len(stale)
+
+
+def attach_digests(graph, matches: list) -> list:
+    """Function to return the tool results with the digest fields added to every part, with one query."""
+    numbers = list({match["partSelectNumber"] for match in matches if match.get("partSelectNumber")})
+    if not numbers:
+        return matches
+    try:
+        digests = {row["partSelectNumber"]: row["digest"] for row in graph.query(PART_DIGESTS_QUERY, params={"numbers": numbers})}
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.warning("Could not fetch the part digests", extra={"error": str(e)})
+        return matches
+
+    # Matches may be shared with other callers (single-flight results), so they are copied, never updated
+    results = []
+    for match in matches:
+        digest = digests.get(match.get("partSelectNumber"))
+        if digest:
+            match = {**match, **{field: digest[field] for field in DIGEST_FIELDS if digest.get(field)}}
+        results.append(match)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute per-part digests of reviews, repair stories and Q&A")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    parser.add_argument("--force", action="store_true", help="Recompute every digest, not only the stale ones")
+    parser.add_argument("--model", default=os.environ.get("DIGEST_MODEL", "gpt-4o-mini"), help="Model writing the summaries")
+    args = parser.parse_args()
+
+    configure_logger(args.verbose)
+
+    graph = Neo4jGraph(
+        url=os.environ.get("NEO4J_URI"),
+        username=os.environ.get("NEO4J_USERNAME"),
+        password=os.environ.get("NEO4J_PASSWORD"),
+        refresh_schema=False,
+    )
+    # Digests are batch work: they yield to interactive requests sharing the API key
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        http_client=scheduled_http_client(OpenAIScheduler.from_env(default_priority="batch")),
+    )
+    count = update_digests(graph, client, args.model, force=args.force)
+    logger.info(f"Updated {count} part digests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Token-budgeted agent scratchpad: recent observations stay verbatim, older ones are compacted."""
+
+import json
+import logging
+from functools import lru_cache
+
+from openai import OpenAIError
+
+from graph_rag import metrics
+from graph_rag.config import SCRATCHPAD_RECENT_STEPS, SCRATCHPAD_TOKEN_BUDGET, SUMMARY_MODEL, client
+from graph_rag.serializers import digest_serialized, is_serialized
+
+logger = logging.getLogger(__name__)
+
+# Fields that identify an entity; a digest keeps only these
+DIGEST_FIELDS = (
+    "type",
+    "partSelectNumber",
+    "manufacturerPartNumber",
+    "partNumber",
+    "canonicalModelNumber",
+    "modelNumber",
+    "modelNum",
+    "modelId",
+    "id",
+    "partName",
+    "name",
+    "symptomName",
+    "title",
+    "price",
+    "error",
+)
+
+SUMMARY_PROMPT = """
+You compress tool results for an appliance parts assistant. Summarize the result below in at most five short lines.
+Keep every part number, model number, name, price and any fact that answers a customer question; drop everything else.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Function to estimate the number of tokens of a text (about four characters per token)."""
+    return len(text) // 4
+
+
+def _truncate(value, length: int = 40) -> str:
+    value = str(value)
+    return value if len(value) <= length else value[:length - 3] + "..."
+
+
+@lru_cache(maxsize=256)
+def summarize_observation(text: str) -> str:
+    """Function to summarize an unstructured observation with a cheap model, once per distinct text."""
+    try:
+        response = client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            temperature=0,
+            messages=[{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": text}],
+        )
+        return f"[summary of an earlier result] {response.choices[0].message.content.strip()}"
+    except OpenAIError as e:
+        logger.error("OpenAI error while summarizing a scratchpad step", extra={"error": str(e)})
+        return f"[truncated earlier result] {_truncate(text, 400)}"
+
+
+def digest_observation(observation) -> str:
+    """Function to replace an observation with a compact digest of the entities it contains."""
+    if isinstance(observation, list) and all(isinstance(item, dict) for item in observation):
+        entities = []
+        for item in observation:
+            fields = [f"{field}={_truncate(item[field])}" for field in DIGEST_FIELDS if item.get(field)]
+            entities.append(", ".join(fields) or _truncate(json.dumps(item, default=str), 80))
+        return f"[digest of {len(observation)} earlier results] " + "; ".join(entities)
+    if isinstance(observation, str) and is_serialized(observation):
+        return f"[digest of an earlier result]\n{digest_serialized(observation)}"
+    return summarize_observation(str(observation))
+
+
+def format_scratchpad(intermediate_steps, budget: int = SCRATCHPAD_TOKEN_BUDGET, keep_recent: int = SCRATCHPAD_RECENT_STEPS) -> str:
+    """Function to build the agent scratchpad from (AgentAction, observation) pairs within a token budget.
+
+    The `keep_recent` latest observations are always kept in full; older ones are
+    replaced by digests, oldest first, until the scratchpad fits in `budget` tokens.
+    """
+    observations = [str(observation) for _, observation in intermediate_steps]
+    total = sum(estimate_tokens(action.log) for action, _ in intermediate_steps)
+    total += sum(estimate_tokens(observation) for observation in observations)
+
+    for i in range(max(len(intermediate_steps) - keep_recent, 0)):
+        if total <= budget:
+            break
+        digest = digest_observation(intermediate_steps[i][1])
+        if len(digest) < len(observations[i]):
+            total -= estimate_tokens(observations[i]) - estimate_tokens(digest)
+            observations[i] = digest
+            metrics.increment("scratchpad.compacted")
+
+    thoughts = ""
+    for (action, _), observation in zip(intermediate_steps, observations):
+        thoughts += action.log
+        thoughts += f"\nObservation: {observation}\nThought: "
+    return thoughts
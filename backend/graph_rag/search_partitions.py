@@ -0,0 +1,176 @@
+"""Brand and appliance-type partitions of the embedded nodes, for filtered similarity search.
+
+Every embedded node gets `partitionBrands` and `partitionTypes`: the lowercased brands and
+model types (`Model.modelType`) of the models it belongs to. Models carry their own, parts
+those of their compatible models, symptoms, sections, manuals and instructions those of
+their models, and reviews, repair stories, questions and answers those of their part. With
+these lists `similarity_search` drops the nodes outside the brand and appliance type a
+question names before computing any cosine similarity.
+
+Run after ingestion and after canonicalize_models.py:
+
+    python -m graph_rag.search_partitions
+"""
+
+import os
+import argparse
+import logging
+import re
+
+from langchain_community.graphs import Neo4jGraph
+from tqdm import tqdm
+from dotenv import load_dotenv
+
+from graph_rag.graph_version import bump_version
+
+load_dotenv()
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Brands of the dataset, as listed in the prompts
+BRANDS = (
+    "Frigidaire", "Kenmore", "Crosley", "Electrolux", "Tappan", "Kelvinator", "Gibson", "General Electric",
+    "Whirlpool", "Maytag", "LG", "Amana", "Litton", "Admiral", "Magic Chef", "Jenn-Air", "Hoover", "KitchenAid",
+    "Roper", "Haier", "Samsung", "Bosch", "Thermador", "Inglis", "Uni", "Hotpoint", "Norge", "Speed Queen", "Caloric",
+)
+
+# `Model.modelType` values and the words customers use for them
+APPLIANCE_TYPES = {
+    "Refrigerator": ("refrigerator", "fridge"),
+    "Freezer": ("freezer",),
+    "Dishwasher": ("dishwasher",),
+    "Washer": ("washer", "washing machine"),
+    "Dryer": ("dryer",),
+    "Range": ("oven", "stove", "cooktop"),
+    "Microwave": ("microwave",),
+}
+
+# "GE" is how most customers write General Electric; "Uni" only counts as a whole word
+BRAND_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(brand) for brand in sorted(BRANDS, key=len, reverse=True)) + r"|GE)\b", re.IGNORECASE
+)
+APPLIANCE_PATTERNS = {
+    name: re.compile(r"\b(" + "|".join(re.escape(word) for word in words) + r")s?\b", re.IGNORECASE)
+    for name, words in APPLIANCE_TYPES.items()
+}
+
+# Nodes partitioned by the models they are linked to, as (label, pattern binding `m` to those models)
+FROM_MODELS = (
+    ("Model", "(m:Model) WHERE m = e"),
+    ("Part", "(e)-[:COMPATIBLE_WITH]->(m:Model)"),
+    ("Symptom", "(m:Model)-[:HAS_SYMPTOM]->(e)"),
+    ("Section", "(m:Model)-[:HAS_SECTION]->(e)"),
+    ("Manual", "(m:Model)-[:HAS_MANUAL]->(e)"),
+    ("Instruction", "(m:Model)-[:HAS_INSTRUCTION]->(e)"),
+)
+
+# Nodes inheriting the partitions of their parent, in dependency order
+FROM_PARENT = (
+    ("Review", "(parent:Part)-[:HAS_REVIEW]->(e)"),
+    ("RepairStory", "(parent:Part)-[:HAS_REPAIR_STORY]->(e)"),
+    ("Question", "(parent:Part)-[:HAS_QUESTION]->(e)"),
+    ("Answer", "(parent:Question)-[:HAS_ANSWER]->(e)"),
+)
+
+FROM_MODELS_QUERY = """
+MATCH (e:`{entity}`)
+CALL {{
+    WITH e
+    OPTIONAL MATCH {pattern}
+    WITH e, collect(DISTINCT toLower(m.brand)) AS brands, collect(DISTINCT toLower(m.modelType)) AS types
+    SET e.partitionBrands = brands, e.partitionTypes = types
+}} IN TRANSACTIONS OF 1000 ROWS
+"""
+
+FROM_PARENT_QUERY = """
+MATCH (e:`{entity}`)
+CALL {{
+    WITH e
+    OPTIONAL MATCH {pattern}
+    WITH e, head(collect(parent)) AS parent
+    SET e.partitionBrands = coalesce(parent.partitionBrands, []), e.partitionTypes = coalesce(parent.partitionTypes, [])
+}} IN TRANSACTIONS OF 1000 ROWS
+"""
+
+
+def configure_logger(verbose):
+    """Configure logger level based on verbosity"""
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.INFO)
+
+
+def find_brand(text: str):
+    """Function to return the brand a text names, or None when it names none or several."""
+    brands = {match.lower() for match in BRAND_PATTERN.findall(text or "")}
+    brands = {"general electric" if brand == "ge" else brand for brand in brands}
+    return brands.pop() if len(brands) == 1 else None
+
+
+def find_appliance_type(text: str):
+    """Function to return the model type a text names, or None when it names none or several."""
+    if (text or "").strip().lower() in {name.lower() for name in APPLIANCE_TYPES}:
+        return text.strip().lower()
+    types = [name for name, pattern in APPLIANCE_PATTERNS.items() if pattern.search(text or "")]
+    return types[0].lower() if len(types) == 1 else None
+
+
+def search_filters(prompt: str, filters: dict = None) -> dict:
+    """Function to combine the filters extracted by `define_query` with the brand and appliance type the prompt names.
+
+    Only known brands and types are kept, lowercased like the partition lists.
+    """
+    filters = filters if isinstance(filters, dict) else {}
+    brand = find_brand(str(filters.get("brand") or "")) or find_brand(prompt)
+    model_type = find_appliance_type(str(filters.get("modelType") or "")) or find_appliance_type(prompt)
+    return {key: value for key, value in (("brand", brand), ("modelType", model_type)) if value}
+
+
+def partition_conditions(filters: dict) -> list:
+    """Function to return the Cypher conditions restricting `e` to the partitions of `filters`.
+
+    Nodes not partitioned yet (no list at all) are kept, so filtering never hides data
+    before this module has been run.
+    """
+    conditions = []
+    if filters.get("brand"):
+        conditions.append("(e.partitionBrands IS NULL OR $brand IN e.partitionBrands)")
+    if filters.get("modelType"):
+        conditions.append("(e.partitionTypes IS NULL OR $modelType IN e.partitionTypes)")
+    return conditions
+
+
+def build_partitions(graph):
+    """Function to store the brand and appliance-type partitions of every embedded node."""
+    for entity, pattern in tqdm(FROM_MODELS, desc="Partitioning from models"):
+        graph.query(FROM_MODELS_QUERY.format(entity=entity, pattern=pattern))
+        logger.debug(f"Partitions stored for {entity}")
+    for entity, pattern in tqdm(FROM_PARENT, desc="Partitioning from parents"):
+        graph.query(FROM_PARENT_QUERY.format(entity=entity, pattern=pattern))
+        logger.debug(f"Partitions stored for {entity}")
+    # Filtered searches return different nodes now, so invalidate cached answers
+    bump_version(graph)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store brand and appliance-type partitions for filtered similarity search")
+    parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    args = parser.parse_args()
+
+    configure_logger(args.verbose)
+
+    graph = Neo4jGraph(
+        url=os.environ.get("NEO4J_URI"),
+        username=os.environ.get("NEO4J_USERNAME"),
+        password=os.environ.get("NEO4J_PASSWORD"),
+        refresh_schema=False,
+    )
+    build_partitions(graph)
+    logger.info("Search partitions stored")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,26 @@
 """Module to perform similarity search in a graph database using embeddings."""
 
+import contextvars
 import json
-
-from graph_rag.config import  GRAPH_ENTITIES, GRAPH_RELATIONSHIPS, EMBEDDING_MODELS, client, neo4j_graph
+import logging
+from contextlib import contextmanager
+
+from graph_rag import metrics
+from graph_rag.cancellation import check_cancelled
+from graph_rag.cascade import cascade_models, run_cascade
+from graph_rag.config import (
+    CASCADE_SMALL_MODEL,
+    GRAPH_ENTITIES,
+    GRAPH_RELATIONSHIPS,
+    SIMILARITY_PARTITION_FILTERS,
+    client,
+    embedding_provider,
+    neo4j_graph,
+)
+from graph_rag.search_partitions import partition_conditions, search_filters
+from graph_rag.singleflight import coalesce
+
+logger = logging.getLogger(__name__)
 
 
 SEMANTIC_SEARCH_PROMPT = f'''
@@ -50,6 +68,13 @@ SEMANTIC_SEARCH_PROMPT = f'''
 
     There can be more than 2 relationships too. Example- "why ice maker is not working in my fridge?" {{question:"contains ice","answer":"contains ice","review":"contains ice","instruction":"contains ice"}}
 
+    If the user prompt names a brand or an appliance type (the `modelType` of models, such as "Dishwasher" or "Refrigerator"),
+    also add a "filters" key whose value is an object with "brand" and/or "modelType". Example- "My Whirlpool fridge is leaking"
+    {{
+        "symptom": "leaking",
+        "filters": {{"brand": "Whirlpool", "modelType": "Refrigerator"}}
+    }}
+
      
     Do not include any # comments in the JSON object.
     
@@ -57,24 +82,99 @@ SEMANTIC_SEARCH_PROMPT = f'''
 '''
 
 
+def is_entity_json(text: str) -> bool:
+    """Function to check that `define_query` returned a JSON object of entity type to string value, plus optional filters."""
+    try:
+        query_data = json.loads(text)
+    except json.JSONDecodeError:
+        return False
+    if not isinstance(query_data, dict) or not isinstance(query_data.get("filters", {}), dict):
+        return False
+    return all(isinstance(value, str) for key, value in query_data.items() if key != "filters")
+
+
 def define_query(prompt: str, model: str = "gpt-4o"):
     """Function to generate a query based on the user input using OpenAI's API."""
-    completion = client.chat.completions.create(
-        model=model,
-        temperature=0,
-        messages=[{"role": "system", "content": SEMANTIC_SEARCH_PROMPT}, {"role": "user", "content": prompt}],
-    )
-    print('define_query')
-    print(completion.choices[0].message.content)
-    return completion.choices[0].message.content
+
+    def complete(tier_model):
+        completion = client.chat.completions.create(
+            model=tier_model,
+            temperature=0,
+            messages=[{"role": "system", "content": SEMANTIC_SEARCH_PROMPT}, {"role": "user", "content": prompt}],
+        )
+        return completion.choices[0].message.content
+
+    # The cheaper model's answer is used whenever it is valid JSON
+    content = run_cascade("define_query", cascade_models(CASCADE_SMALL_MODEL, model), complete, is_entity_json)
+    logger.debug("Entities defined", extra={"entities": content})
+    return content
+
+
+def build_similarity_query(entity_label: str, conditions: list = ()) -> str:
+    """Function to build the cosine similarity query of the configured embedding provider.
+
+    `conditions` (brand and appliance-type partitions) are applied before any scoring.
+    """
+    pushdown = "".join(f"{condition} AND " for condition in conditions)
+    # Each embedding provider stores its vectors in its own node property
+    embedding_property = embedding_provider.embedding_property
+    return f'''
+            WITH $embedding AS inputEmbedding
+            MATCH (e:{entity_label})
+            WHERE {pushdown}size(inputEmbedding) = size(e.{embedding_property})  // Ensure vectors are the same size
+            WITH e, 
+                 reduce(s = 0, i IN range(0, size(e.{embedding_property})-1) | s + inputEmbedding[i] * e.{embedding_property}[i]) AS dot_product,
+                 reduce(s = 0, i IN range(0, size(e.{embedding_property})-1) | s + inputEmbedding[i] * inputEmbedding[i]) AS input_norm,
+                 reduce(s = 0, i IN range(0, size(e.{embedding_property})-1) | s + e.{embedding_property}[i] * e.{embedding_property}[i]) AS embedding_norm
+            WITH e, dot_product / (sqrt(input_norm) * sqrt(embedding_norm)) AS cosine_similarity
+            WHERE cosine_similarity > $threshold
+            RETURN e
+            LIMIT 10
+            '''
+
+
+def build_label_query(entity_label: str, conditions: list = ()) -> str:
+    """Function to build the query returning some nodes of a label, within the given partitions."""
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f'''
+                MATCH (e:{entity_label})
+                {where}
+                RETURN e
+                LIMIT 10
+            '''
+
+
+def query_with_retry(query: str, params: dict = None) -> list:
+    """Function to run a similarity query, retrying on Neo4j errors until it succeeds or the request is cancelled."""
+    while True:
+        check_cancelled("neo4j_query")
+        try:  # Attempt to query the graph
+            return neo4j_graph.query(query, params=params or {})
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("Similarity query failed, retrying", extra={"error": str(e)})
 
 
+# Batch runs embed the queries of concurrent questions together (see graph_rag.batch)
+_embedder = contextvars.ContextVar("embedder", default=None)
+
+
+@contextmanager
+def embedding_scope(embedder):
+    """Create the embeddings needed inside the block with `embedder`, e.g. an EmbeddingBatcher."""
+    token = _embedder.set(embedder)
+    try:
+        yield
+    finally:
+        _embedder.reset(token)
+
+
+@coalesce("create_embedding")
 def create_embedding(text: str):
-    """Function to create an embedding for a given text using OpenAI's API."""
-    result = client.embeddings.create(model=EMBEDDING_MODELS["small"], input=text)
-    return result.data[0].embedding
+    """Function to create an embedding for a given text using the configured embedding provider."""
+    return (_embedder.get() or embedding_provider).embed_query(text)
 
 
+@coalesce("similarity_search")
 def similarity_search(prompt: str, threshold: float = 0.7):  # pylint: disable=too-many-branches, too-many-statements
     """Function to perform similarity search in a graph database using embeddings."""
     matches = []
@@ -85,11 +185,17 @@ def similarity_search(prompt: str, threshold: float = 0.7):  # pylint: disable=t
     try:
         query_data = json.loads(query_data)
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON: {e}")
+        logger.info("define_query did not return JSON", extra={"error": str(e)})
         query_data = {}
 
+    # Brand and appliance-type filters are pushed down into every search below
+    filters = search_filters(prompt, query_data.pop("filters", None)) if isinstance(query_data, dict) else {}
+    conditions = partition_conditions(filters) if SIMILARITY_PARTITION_FILTERS else []
+    if conditions:
+        metrics.increment("similarity_search.filtered")
+
     if not query_data:
-        print("No relevant entities found in the user prompt.")
+        logger.debug("No relevant entities found in the user prompt")
         return []
 
     for entity_type, entity_value in query_data.items():
@@ -108,17 +214,9 @@ def similarity_search(prompt: str, threshold: float = 0.7):  # pylint: disable=t
                 "answer": "Answer",
             }.get(entity_type.lower(), "Part")  # Default to 'Part' if not recognized
 
-            query = f'''
-                MATCH (e:{entity_label})
-                RETURN e
-                LIMIT 10
-            '''
-            while True:
-                try:  # Attempt to query the graph
-                    result = neo4j_graph.query(query)
-                    break
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"An error occurred with the Neo4j graph query: {e}")
+            query = build_label_query(entity_label, conditions)
+            unfiltered_query = build_label_query(entity_label)
+            params = filters
 
         else:
             # Perform cosine similarity search
@@ -136,26 +234,15 @@ def similarity_search(prompt: str, threshold: float = 0.7):  # pylint: disable=t
                 "answer": "Answer",
             }.get(entity_type.lower(), "Part")  # Default to 'Part' if not recognized
 
-            query = f'''
-            WITH $embedding AS inputEmbedding
-            MATCH (e:{entity_label})
-            WHERE size(inputEmbedding) = size(e.embedding)  // Ensure vectors are the same size
-            WITH e, 
-                 reduce(s = 0, i IN range(0, size(e.embedding)-1) | s + inputEmbedding[i] * e.embedding[i]) AS dot_product,
-                 reduce(s = 0, i IN range(0, size(e.embedding)-1) | s + inputEmbedding[i] * inputEmbedding[i]) AS input_norm,
-                 reduce(s = 0, i IN range(0, size(e.embedding)-1) | s + e.embedding[i] * e.embedding[i]) AS embedding_norm
-            WITH e, dot_product / (sqrt(input_norm) * sqrt(embedding_norm)) AS cosine_similarity
-            WHERE cosine_similarity > $threshold
-            RETURN e
-            LIMIT 10
-            '''
+            query = build_similarity_query(entity_label, conditions)
+            unfiltered_query = build_similarity_query(entity_label)
+            params = {'embedding': embedding, 'threshold': threshold, **filters}
 
-            while True:
-                try:  # Attempt to query the graph
-                    result = neo4j_graph.query(query, params={'embedding': embedding, 'threshold': threshold})
-                    break
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"An error occurred with the Neo4j graph query: {e}")
+        result = query_with_retry(query, params)
+        if not result and conditions:
+            # The named brand or appliance type may be wrong or unpartitioned: search the whole label
+            metrics.increment("similarity_search.partition_fallback")
+            result = query_with_retry(unfiltered_query, params)
 
         # Process results
         for r in result:
@@ -183,6 +270,8 @@ def similarity_search(prompt: str, threshold: float = 0.7):  # pylint: disable=t
                     match["description"] = entity_data["description"]
                 if "id" in entity_data:
                     match["id"] = entity_data["id"]
+                if "canonicalModelNumber" in entity_data:
+                    match["canonicalModelNumber"] = entity_data["canonicalModelNumber"]
                 if "modelNum" in entity_data:
                     match["modelNum"] = entity_data["modelNum"]
                 if "brand" in entity_data:
@@ -0,0 +1,81 @@
+"""Compact, columnar serialization of tool results for the LLM prompt."""
+
+from collections import OrderedDict
+
+# Identifying fields come first in every group so a digest can keep just the leading columns
+ID_FIELDS = (
+    "key",
+    "partSelectNumber",
+    "manufacturerPartNumber",
+    "partNumber",
+    "canonicalModelNumber",
+    "modelNumber",
+    "modelNum",
+    "modelId",
+    "id",
+    "partName",
+    "name",
+    "symptomName",
+    "title",
+)
+
+GROUP_PREFIX = "## "
+SEPARATOR = " | "
+
+
+def _cell(value, max_length: int) -> str:
+    """Render one value on a single line without the column separator, truncated to `max_length`."""
+    text = " ".join(str(value).split()).replace("|", "/")
+    return text if len(text) <= max_length else text[:max_length - 3] + "..."
+
+
+def serialize_matches(matches: list, max_length: int = 300) -> str:
+    """Function to render tool results as one header per entity type followed by delimited rows.
+
+    Instead of repeating every key in every row, each group is written as
+    `## Part (2): partSelectNumber | partName | price` followed by one line per entity.
+    Long fields such as `description` or `reviewText` are truncated to `max_length` characters.
+    """
+    if not matches:
+        return "No results found."
+
+    groups = OrderedDict()
+    errors = []
+    for match in matches:
+        if "error" in match:
+            errors.append(f"error: {match['error']}")
+            continue
+        entity_type = match.get("type") or "Result"
+        groups.setdefault(entity_type, []).append(match)
+
+    lines = []
+    for entity_type, rows in groups.items():
+        fields = []
+        for row in rows:
+            fields.extend(field for field in row if field != "type" and field not in fields)
+        fields.sort(key=lambda field: ID_FIELDS.index(field) if field in ID_FIELDS else len(ID_FIELDS))
+
+        lines.append(f"{GROUP_PREFIX}{entity_type} ({len(rows)}): {SEPARATOR.join(fields)}")
+        for row in rows:
+            lines.append(SEPARATOR.join(_cell(row[field], max_length) if field in row else "" for field in fields))
+
+    return "\n".join(lines + errors)
+
+
+def digest_serialized(text: str, columns: int = 2) -> str:
+    """Function to shrink a serialized result to its headers and leading (identifying) columns."""
+    lines = []
+    for line in text.splitlines():
+        if line.startswith(GROUP_PREFIX):
+            header, _, fields = line.partition(": ")
+            lines.append(f"{header}: {SEPARATOR.join(fields.split(SEPARATOR)[:columns])}")
+        elif line.startswith("error: "):
+            lines.append(line)
+        else:
+            lines.append(SEPARATOR.join(_cell(cell, 40) for cell in line.split(SEPARATOR)[:columns]))
+    return "\n".join(lines)
+
+
+def is_serialized(text: str) -> bool:
+    """Function to check whether a text was produced by `serialize_matches`."""
+    return text.startswith(GROUP_PREFIX) or text.startswith("error: ") or text == "No results found."
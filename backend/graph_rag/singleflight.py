@@ -0,0 +1,116 @@
+"""Single-flight coalescing: concurrent calls with the same key share one computation."""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from graph_rag import metrics
+from graph_rag.cancellation import RequestCancelled, is_cancelled
+
+# Number of distinct keys whose per-key statistics are kept per group
+MAX_TRACKED_KEYS = 1024
+
+
+class _Call:
+    """A computation in flight, shared by its leader and any followers."""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Group of calls where only one computation per key runs at a time."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._key_stats = OrderedDict()
+
+    def do(self, key, func, *args, **kwargs):
+        """Run `func` for `key`, or wait for and share the result of the identical call already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._record(key, "executed" if leader else "shared")
+
+        if not leader:
+            metrics.increment(f"singleflight.{self.name}.shared")
+            call.done.wait()
+            if isinstance(call.error, RequestCancelled) and not is_cancelled():
+                # The leader's client went away but this caller still wants the result: run it again
+                return self.do(key, func, *args, **kwargs)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment(f"singleflight.{self.name}.executed")
+        start = time.perf_counter()
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            metrics.observe(f"singleflight.{self.name}", time.perf_counter() - start)
+
+    def _record(self, key, outcome: str):
+        """Update the per-key statistics; the caller must hold the lock."""
+        stats = self._key_stats.pop(key, None) or {"executed": 0, "shared": 0}
+        stats[outcome] += 1
+        self._key_stats[key] = stats
+        if len(self._key_stats) > MAX_TRACKED_KEYS:
+            self._key_stats.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Return per-key counts of executed and shared calls, most recent keys last."""
+        with self._lock:
+            return {repr(key): dict(stats) for key, stats in self._key_stats.items()}
+
+    def in_flight(self) -> int:
+        """Return the number of keys currently being computed."""
+        with self._lock:
+            return len(self._calls)
+
+
+GROUPS = {}
+
+
+def coalesce(name: str, key=None):
+    """Decorator that coalesces concurrent identical calls of the wrapped function.
+
+    By default the key is built from the positional and keyword arguments; pass
+    `key` to derive it differently (it receives the same arguments as the function).
+    """
+
+    def decorator(func):
+        group = GROUPS.setdefault(name, SingleFlight(name))
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            return group.do(call_key, func, *args, **kwargs)
+
+        wrapper.flight = group
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict:
+    """Return per-key statistics and in-flight counts for every coalescing group."""
+    return {
+        name: {"in_flight": group.in_flight(), "keys": group.stats()}
+        for name, group in GROUPS.items()
+    }
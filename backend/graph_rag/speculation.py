@@ -0,0 +1,92 @@
+"""Speculative prefetch of tool results while the agent is still deciding which tool to call.
+
+`speculate` starts the given tools on the raw question in the background for the duration
+of an agent run. A tool wrapped with `prefetchable` hands over the prefetched result when
+the agent calls it with (essentially) the same input; whatever is left unused when the run
+ends is cancelled: a prefetch that has not started never runs, a running one stops at its
+next cancellation checkpoint.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from graph_rag import metrics
+from graph_rag.cancellation import CancelToken, cancel_scope, current_token, submit_in_context
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+def normalize_input(text: str) -> str:
+    """Function to normalize a tool input so quoting, case and spacing differences still match."""
+    return " ".join(str(text).lower().split()).strip("\"'?!. ")
+
+
+def _run_prefetch(token: CancelToken, func, text: str):
+    with cancel_scope(token):
+        return func(text)
+
+
+class Speculation:
+    """Background runs of several tools on one input, each under its own child cancellation token."""
+
+    def __init__(self, tools: dict, text: str, executor):
+        self.key = normalize_input(text)
+        # Child tokens stop with the request, and on their own when the prefetch goes unused
+        self.tokens = {name: CancelToken(parent=current_token()) for name in tools}
+        self.futures = {
+            name: submit_in_context(executor, _run_prefetch, self.tokens[name], func, text) for name, func in tools.items()
+        }
+        metrics.increment("speculation.started", len(self.futures))
+
+    def take(self, name: str, tool_input: str):
+        """Return the future prefetched for this tool and input, or None; each future is handed over once."""
+        if normalize_input(tool_input) != self.key:
+            return None
+        return self.futures.pop(name, None)
+
+    def cancel(self):
+        """Cancel the prefetches nobody asked for, stopping the running ones at their next checkpoint."""
+        for name, future in self.futures.items():
+            if future.cancel():
+                metrics.increment("speculation.cancelled")
+            elif not future.done():
+                self.tokens[name].cancel()
+                metrics.increment("speculation.stopped")
+            else:
+                metrics.increment("speculation.wasted")
+        self.futures.clear()
+
+
+@contextmanager
+def speculate(tools: dict, text: str, executor):
+    """Prefetch `tools` on `text` for the calls made by this thread inside the block."""
+    speculation = Speculation(tools, text, executor)
+    previous, _current.speculation = getattr(_current, "speculation", None), speculation
+    try:
+        yield speculation
+    finally:
+        _current.speculation = previous
+        speculation.cancel()
+
+
+def prefetchable(name: str, func):
+    """Function to wrap a tool so it uses the current thread's prefetched result when there is one."""
+
+    def wrapper(tool_input):
+        speculation = getattr(_current, "speculation", None)
+        future = speculation.take(name, tool_input) if speculation is not None else None
+        if future is not None:
+            try:
+                result = future.result()
+                metrics.increment(f"speculation.used.{name}")
+                return result
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Speculative tool run failed, running it again", extra={"tool": name, "error": str(e)})
+        return func(tool_input)
+
+    wrapper.__name__ = getattr(func, "__name__", name)
+    wrapper.__doc__ = func.__doc__
+    return wrapper
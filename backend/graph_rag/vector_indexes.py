@@ -2,10 +2,14 @@ import os
 import argparse
 import logging
 from langchain_community.vectorstores import Neo4jVector
-from langchain_community.embeddings import OpenAIEmbeddings
+from openai import OpenAI
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from graph_rag.embeddings import EMBEDDING_PROVIDERS, get_embedding_provider
+from graph_rag.graph_version import bump_version
+from graph_rag.openai_scheduler import OpenAIScheduler, scheduled_http_client
+
 load_dotenv()
 
 # Constants
@@ -21,7 +25,7 @@ logger.setLevel(logging.INFO)
 
 ENTITY_EMBEDDINGS = {
     "Part": ["partName", "description", "manufacturerPartNumber", "price", "rating", "reviewCount", "manufacturer"],
-    "Model": ["modelNum", "brand", "modelType", "name", "description"],
+    "Model": ["canonicalModelNumber", "brand", "modelType", "name", "description"],
     "Review": ["reviewerName", "date", "rating", "title", "reviewText"],
     "Symptom": ["name"],
     "RepairStory": ["title", "customer", "instruction", "difficulty", "time", "helpfulness"],
@@ -39,21 +43,23 @@ def configure_logger(verbose):
     else:
         logger.setLevel(logging.INFO)
 
-def create_vector_index(entity, properties):
+def create_vector_index(entity, properties, embedding_provider):
     """Create vector index for a given entity, removing collection dependency"""
     try:
-        # Using OpenAI's small embedding model as default
+        # The provider decides the index name and node property, so providers never share an index
         vector_store = Neo4jVector.from_existing_graph(
-            OpenAIEmbeddings(model=EMBEDDING_MODELS["small"]),
+            embedding_provider,
             url=os.environ.get("NEO4J_URI"),  # Collection parameter removed
             username=os.environ.get("NEO4J_USERNAME"),
             password=os.environ.get("NEO4J_PASSWORD"),
-            index_name=entity,
+            index_name=embedding_provider.index_name(entity),
             node_label=entity,
             text_node_properties=properties,
-            embedding_node_property='embedding',
+            embedding_node_property=embedding_provider.embedding_property,
         )
         logger.info(f"Vector index created for {entity}")
+        # New embeddings change similarity results, so invalidate cached answers
+        bump_version(vector_store)
     except Exception as e:
         logger.error(f"Error creating vector index for {entity}: {e}")
 
@@ -61,13 +67,33 @@ def create_vector_index(entity, properties):
 def main():
     parser = argparse.ArgumentParser(description="Embed entities in Neo4j graph")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    parser.add_argument(
+        "--provider",
+        choices=EMBEDDING_PROVIDERS,
+        default=os.environ.get("EMBEDDING_PROVIDER", "openai"),
+        help="Embedding provider used to build the indexes",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=int(os.environ["EMBEDDING_DIMENSIONS"]) if os.environ.get("EMBEDDING_DIMENSIONS") else None,
+        help="Shorten the embeddings to this many dimensions (text-embedding-3 models, hashing provider)",
+    )
     args = parser.parse_args()
 
     configure_logger(args.verbose)
+    # Re-embedding is batch work: it yields to interactive requests and stays within its own rate budget
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        http_client=scheduled_http_client(OpenAIScheduler.from_env(default_priority="batch")),
+    )
+    embedding_provider = get_embedding_provider(
+        args.provider, model=EMBEDDING_MODELS["small"], client=client, dimensions=args.dimensions
+    )
 
     # Loop through all entities in ENTITY_EMBEDDINGS
     for entity, properties in tqdm(ENTITY_EMBEDDINGS.items(), desc="Embedding entities"):
-        create_vector_index(entity, properties)  # No need for collection argument
+        create_vector_index(entity, properties, embedding_provider)  # No need for collection argument
 
 
 if __name__ == "__main__":
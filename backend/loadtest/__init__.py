@@ -0,0 +1 @@
+"""Load-test harness for the FastAPI service, with fake OpenAI and Neo4j backends."""
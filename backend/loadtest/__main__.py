@@ -0,0 +1,195 @@
+"""Fire concurrent users at the `/agent/` endpoint and report latency, throughput and event-loop lag.
+
+By default the service runs in-process against fake OpenAI and Neo4j backends with
+injectable latency, and each agent mode is measured in turn:
+
+    cd backend
+    python -m loadtest --users 20 --duration 30 --modes sequential parallel plan --openai-latency 0.8
+
+With `--url` the users hit an already running server instead, in whatever mode it runs.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+
+import httpx
+
+from loadtest.fake_backends import install_fake_backends, load_scraped_data
+
+QUESTION_TEMPLATES = (
+    "Is part {part} compatible with my {brand} model {model}?",
+    "How can I install part number {part}?",
+    "What does part {manufacturer_part} cost?",
+    "Which parts fit the {model} model?",
+    "My {brand} {appliance} is {symptom}, how do I fix it?",
+    "{symptom} on model {model}, which part do I need?",
+    "How difficult is it to replace the {part_name}?",
+    "{instruction}",
+)
+
+
+def build_questions(data: dict, count: int, seed: int = 0) -> list:
+    """Function to draw a question mix from the scraped part, its models and the repair instructions."""
+    rng = random.Random(seed)
+    part = data["part"]
+    models = part.get("modelData") or [{"brand": "Frigidaire", "modelNumber": "FFTR1821TS"}]
+    symptoms = part.get("symptoms") or ["Not working"]
+    instructions = [item["title"] for item in data["instructions"] if item.get("title")] or ["How do I replace the filter?"]
+
+    questions = []
+    for _ in range(count):
+        model = rng.choice(models)
+        questions.append(rng.choice(QUESTION_TEMPLATES).format(
+            part=part["partSelectNumber"],
+            manufacturer_part=part["manufacturerPartNumber"],
+            part_name=part["partName"],
+            brand=model["brand"],
+            model=model["modelNumber"],
+            appliance=rng.choice(["refrigerator", "freezer", "dishwasher"]),
+            symptom=rng.choice(symptoms).lower(),
+            instruction=rng.choice(instructions),
+        ))
+    return questions
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of `values`."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+async def monitor_loop_lag(samples: list, stop: asyncio.Event, interval: float = 0.01):
+    """Record how late the event loop wakes a coroutine that sleeps for `interval` seconds."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def simulate_user(client, questions: list, deadline: float, think_time: float, results: list):
+    """One user asking questions back to back (plus think time) until the deadline."""
+    while time.perf_counter() < deadline:
+        question = random.choice(questions)
+        start = time.perf_counter()
+        retry_after = 0
+        try:
+            response = await client.get("/agent/", params={"message": question})
+            status = response.status_code
+            retry_after = float(response.headers.get("Retry-After", 0))
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append((status, time.perf_counter() - start))
+        # Shed requests come back with Retry-After; a well-behaved client waits that long
+        if retry_after:
+            await asyncio.sleep(min(retry_after, max(deadline - time.perf_counter(), 0)))
+        if think_time:
+            await asyncio.sleep(random.uniform(0, 2 * think_time))
+
+
+async def run_load(client, questions: list, users: int, duration: float, think_time: float) -> dict:
+    """Function to run `users` concurrent users for `duration` seconds and summarize the results."""
+    results, lag = [], []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lag, stop))
+
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(simulate_user(client, questions, deadline, think_time, results) for _ in range(users)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    latencies = [latency for _, latency in results]
+    errors = sum(1 for status, _ in results if status != 200)
+    return {
+        "requests": len(results),
+        "throughput_rps": round(len(results) / elapsed, 2),
+        "latency_ms": {f"p{p}": round(percentile(latencies, p) * 1000, 1) for p in (50, 95, 99)},
+        "max_latency_ms": round(max(latencies, default=0) * 1000, 1),
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "status_codes": {str(status): count for status, count in Counter(status for status, _ in results).items()},
+        "loop_lag_ms": {
+            "p50": round(percentile(lag, 50) * 1000, 2),
+            "p99": round(percentile(lag, 99) * 1000, 2),
+            "max": round(max(lag, default=0) * 1000, 2),
+        },
+    }
+
+
+async def run_in_process(args, questions: list) -> dict:
+    """Measure each agent mode against the in-process app; the fake backends must be installed first."""
+    # Imported here: the app connects to Neo4j and OpenAI at import time
+    from main import app
+    from core.controllers import ai_agent as controller
+    from graph_rag import metrics
+
+    reports = {}
+    transport = httpx.ASGITransport(app=app)
+    for mode in args.modes:
+        print(f"Running {args.users} users for {args.duration}s in {mode} mode...")
+        controller.agent_executor = controller.AGENT_MODES[mode](memory=controller.memory)
+        controller.stateless_agent_executor = controller.STATELESS_AGENT_MODES[mode]()
+        controller.answer_cache.clear()
+        metrics.reset()
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout) as client:
+            report = await run_load(client, questions, args.users, args.duration, args.think_time)
+        report["pipeline"] = metrics.snapshot()
+        reports[mode] = report
+    return reports
+
+
+async def run_remote(args, questions: list) -> dict:
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+        return {args.url: await run_load(client, questions, args.users, args.duration, args.think_time)}
+
+
+def print_report(reports: dict):
+    print(f"\n{'mode':<24}{'reqs':>7}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}{'lag p99 ms':>12}{'lag max ms':>12}")
+    for name, report in reports.items():
+        latency, lag = report["latency_ms"], report["loop_lag_ms"]
+        print(
+            f"{name:<24}{report['requests']:>7}{report['throughput_rps']:>8}{latency['p50']:>10}{latency['p95']:>10}"
+            f"{latency['p99']:>10}{report['error_rate']:>9.2%}{lag['p99']:>12}{lag['max']:>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test of the /agent/ endpoint")
+    parser.add_argument("--users", type=int, default=10, help="Number of concurrent users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to run each mode for")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between a user's requests, in seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="Request timeout in seconds")
+    parser.add_argument("--questions", type=int, default=200, help="Size of the question mix")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the question mix")
+    parser.add_argument("--modes", nargs="+", default=["sequential", "parallel"], help="Agent modes to compare")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="Mean latency of a fake chat completion, in seconds")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Mean latency of a fake embedding call, in seconds")
+    parser.add_argument("--neo4j-latency", type=float, default=0.02, help="Mean latency of a fake Neo4j query, in seconds")
+    parser.add_argument("--url", help="Load an already running server at this URL instead of the in-process app")
+    parser.add_argument("--output", help="Write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    data = load_scraped_data()
+    questions = build_questions(data, args.questions, args.seed)
+
+    if args.url:
+        reports = asyncio.run(run_remote(args, questions))
+    else:
+        install_fake_backends(data, args.openai_latency, args.embedding_latency, args.neo4j_latency)
+        reports = asyncio.run(run_in_process(args, questions))
+
+    print_report(reports)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
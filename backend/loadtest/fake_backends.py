@@ -0,0 +1,268 @@
+"""Fake OpenAI and Neo4j backends with injectable latency, built from the scraped data.
+
+The fake OpenAI API is a real HTTP server on localhost that the OpenAI and langchain clients
+reach through `OPENAI_BASE_URL`; the fake Neo4j driver replaces `neo4j.GraphDatabase.driver`
+so `Neo4jGraph` and the streaming helpers talk to it unchanged.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import neo4j
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+SCRAPED_PARTS = os.path.join(os.path.dirname(__file__), "..", "..", "Scraper-service", "partData.json")
+SCRAPED_INSTRUCTIONS = os.path.join(
+    os.path.dirname(__file__), "..", "..", "Scraper-service", "src", "scrape", "instructionsData.json"
+)
+
+PART_FIELDS = ("partSelectNumber", "partName", "manufacturerPartNumber", "price", "rating", "reviewCount", "description")
+
+
+def _jittered(latency: float) -> float:
+    """Spread latency uniformly over ±50% so requests do not move in lockstep."""
+    return latency * random.uniform(0.5, 1.5)
+
+
+def load_scraped_data() -> dict:
+    """Function to load the scraped part and instructions used for fake results and questions."""
+    with open(SCRAPED_PARTS, encoding="utf-8") as f:
+        part = json.load(f)
+    with open(SCRAPED_INSTRUCTIONS, encoding="utf-8") as f:
+        instructions = json.load(f)
+    return {"part": part, "instructions": instructions}
+
+
+# --- Fake OpenAI -----------------------------------------------------------------------------
+
+def _prompt_text(messages: list) -> str:
+    return "\n".join(str(message.get("content", "")) for message in messages)
+
+
+def _user_section(text: str) -> str:
+    """Return the end of an agent prompt: the user's question followed by the scratchpad."""
+    return text.rpartition("User prompt:")[2].strip()
+
+
+def _user_question(text: str) -> str:
+    return _user_section(text).split("\n\n")[0].strip()
+
+
+def fake_completion(messages: list) -> str:
+    """Return a plausible completion for each of the pipeline's prompts."""
+    text = _prompt_text(messages)
+    system = str(messages[0].get("content", "")) if messages else ""
+    user = str(messages[-1].get("content", "")) if messages else ""
+
+    if "fetch information from a graph database" in system:
+        return json.dumps({"part": user[:80]})
+    if "alternative Cypher queries" in system:
+        return json.dumps({"queries": [
+            "MATCH (p:Part) RETURN p LIMIT 10",
+            "MATCH (p:Part)-[:COMPATIBLE_WITH]->(m:Model) RETURN p, m LIMIT 10",
+            "MATCH (p:Part) WHERE toLower(p.description) CONTAINS 'filter' RETURN p LIMIT 10",
+        ]})
+    if "generating precise Cypher" in system:
+        return "MATCH (p:Part) RETURN p LIMIT 10"
+    if "validate and optimize" in system:
+        return user
+    if "compress tool results" in system:
+        return "Summary of the earlier result."
+    if "You are planning how to answer" in text:
+        tools = re.search(r"<one of ([^>]+)>", text).group(1).split(", ")
+        question = _user_question(text)
+        return json.dumps({"steps": [{"tool": tool, "input": question} for tool in tools[:2]]})
+    # The ReAct examples contain observations too, so only the scratchpad after the question counts
+    if "Retrieved results:" in text or "Observation:" in _user_section(text):
+        return "Thought: I now know the final answer.\nConfidence: 80 (±5%)\nAnswer: This is a fake answer. Confidence: 80 (±5%)."
+    if "should be one of [" in text:
+        tool = re.search(r"should be one of \[([^\]]+)\]", text).group(1).split(", ")[0]
+        return f"Thought: I need to look this up.\nAction: {tool}\nAction Input: {_user_question(text)}"
+    return "Answer: ok"
+
+
+def fake_embedding(text: str, dimensions: int = 1536) -> list:
+    """Deterministic unit vector per text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _stream_chunks(model: str, content: str):
+    """Server-sent events of a streamed completion: the content in one chunk, then the finish reason."""
+    for delta, finish_reason in (({"role": "assistant", "content": content}, None), ({}, "stop")):
+        chunk = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def create_fake_openai_app(latency: float, embedding_latency: float) -> FastAPI:
+    """Build a FastAPI app serving the chat-completions and embeddings endpoints."""
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(_jittered(latency))
+        content = fake_completion(body.get("messages", []))
+        if body.get("stream"):
+            return StreamingResponse(_stream_chunks(body.get("model", "fake"), content), media_type="text/event-stream")
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(_prompt_text(body.get("messages", []))) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(_prompt_text(body.get("messages", []))) + len(content)) // 4},
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await asyncio.sleep(_jittered(embedding_latency))
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        dimensions = body.get("dimensions", 1536)
+        return {
+            "object": "list",
+            "model": body.get("model", "fake"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def start_fake_openai(latency: float, embedding_latency: float) -> str:
+    """Function to serve the fake OpenAI API on a free localhost port and return its base URL."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    server = uvicorn.Server(
+        uvicorn.Config(create_fake_openai_app(latency, embedding_latency), host="127.0.0.1", port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+# --- Fake Neo4j ------------------------------------------------------------------------------
+
+class FakeResult:
+    """Iterable of records with the `consume()` summary the pipeline reads."""
+
+    def __init__(self, records: list, plan: dict = None):
+        self._records = records
+        self._plan = plan
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def consume(self):
+        return SimpleNamespace(plan=self._plan)
+
+
+class FakeSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):  # pylint: disable=unused-argument
+        text = query.text if isinstance(query, neo4j.Query) else str(query)
+        time.sleep(_jittered(self.driver.latency))
+        return self.driver.answer(text.strip())
+
+
+class FakeDriver:
+    """Stand-in for the Neo4j driver answering every query from the scraped part."""
+
+    def __init__(self, data: dict, latency: float):
+        self.latency = latency
+        part = data["part"]
+        self.part = {field: part.get(field) for field in PART_FIELDS}
+        self.models = [
+            {"canonicalModelNumber": re.sub(r"[^0-9A-Z]", "", model["modelNumber"].upper()), **model}
+            for model in part.get("modelData", [])
+        ]
+        # Stored digest of the part, as part_digests.py writes it
+        self.digest = {
+            "summary": part.get("description"),
+            "difficulty": part.get("difficulty"),
+            "repairTime": part.get("time"),
+            "reviewRating": part.get("rating"),
+            "topSymptoms": [symptom.strip() for symptom in (part.get("symptoms") or "").split("|") if symptom.strip()],
+        }
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
+
+    def session(self, **kwargs):  # pylint: disable=unused-argument
+        return FakeSession(self)
+
+    def answer(self, text: str) -> FakeResult:
+        if text.startswith("EXPLAIN"):
+            return FakeResult([], plan={"operatorType": "ProduceResults@neo4j", "args": {"EstimatedRows": 10.0}, "children": []})
+        if "GraphMeta" in text:
+            return FakeResult([neo4j.Record({"version": 1})])
+        if "elementId(n) AS id" in text:
+            rows = [{"id": "part", "label": "Part", "keys": [self.part["partSelectNumber"], self.part["manufacturerPartNumber"]],
+                     "name": self.part["partName"], "price": self.part["price"]}]
+            rows += [{"id": model["canonicalModelNumber"], "label": "Model", "keys": [model["canonicalModelNumber"]],
+                      "name": model["modelNumber"], "price": None} for model in self.models]
+            return FakeResult([neo4j.Record(row) for row in rows])
+        if "type(r) AS type" in text:
+            return FakeResult([
+                neo4j.Record({"type": "COMPATIBLE_WITH", "source": "part", "target": model["canonicalModelNumber"]})
+                for model in self.models
+            ])
+        if "HAS_DIGEST" in text:
+            return FakeResult([neo4j.Record({"partSelectNumber": self.part["partSelectNumber"], "digest": self.digest})])
+        if "apoc." in text or text.startswith("SHOW") or text.startswith("CALL"):
+            return FakeResult([])
+        return FakeResult([neo4j.Record({"p": self.part})] + [neo4j.Record({"m": model}) for model in self.models[:5]])
+
+
+def install_fake_backends(data: dict, openai_latency: float, embedding_latency: float, neo4j_latency: float):
+    """Function to point the service at the fake backends; call it before importing the app."""
+    os.environ["OPENAI_BASE_URL"] = start_fake_openai(openai_latency, embedding_latency)
+    os.environ["OPENAI_API_KEY"] = "fake"
+    os.environ.setdefault("NEO4J_URI", "bolt://fake:7687")
+    os.environ.setdefault("NEO4J_USERNAME", "neo4j")
+    os.environ.setdefault("NEO4J_PASSWORD", "fake")
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+
+    driver = FakeDriver(data, neo4j_latency)
+    neo4j.GraphDatabase.driver = lambda *args, **kwargs: driver